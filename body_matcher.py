@@ -0,0 +1,87 @@
+"""Compiled body-token lookup used by the segmenter for notes no header claims.
+
+A mapping may also route notes by what their text contains:
+
+    {"header": "Apps", "target_file": "...",
+     "body": {"tags": ["apps", "ios/apps"], "links": ["App Ideas"], "words": ["testflight"], "priority": 10}}
+
+Tags are matched as #tag, links as [[link]] (ignoring any #heading or |alias)
+and words as whole words; all comparisons are case-insensitive. When a note's
+tokens match several rules, the highest priority wins, then the earliest
+mapping. Every token of every rule is folded into one dict from token to its
+best rule, so matching a note is one pass over its tokens however many rules
+there are.
+"""
+import re
+
+from header_matcher import MappingError
+
+# One scan yields every token: #tags, the target of [[links]] (with the brackets) and words
+_TOKEN = re.compile(r"(?<![\w#])#[\w/-]+|\[\[[^\]|#\n]+|\w+")
+_WORD = re.compile(r"\w+")
+_TAG = re.compile(r"[\w/-]+")
+
+
+class BodyMatcher:
+    def __init__(self, mappings):
+        self._index = {} # token -> (priority, -mapping position, target file) of the best rule using it
+        for i, m in enumerate(mappings):
+            body = m.get("body")
+            if body is None:
+                continue
+            where = f"body rule of the mapping for '{m['header']}'"
+            if not isinstance(body, dict):
+                raise MappingError(f"The {where} must be an object.")
+            priority = body.get("priority", 0)
+            if isinstance(priority, bool) or not isinstance(priority, (int, float)):
+                raise MappingError(f"The priority in the {where} must be a number.")
+            rule = (priority, -i, m["target_file"])
+            for kind in ("tags", "links", "words"):
+                values = body.get(kind, [])
+                if not isinstance(values, list) or not all(isinstance(v, str) and v.strip() for v in values):
+                    raise MappingError(f"'{kind}' in the {where} must be a list of non-empty strings.")
+                for value in values:
+                    token = self._token(kind, value.strip().lower(), where)
+                    if rule > self._index.get(token, (float("-inf"),)):
+                        self._index[token] = rule
+
+    @staticmethod
+    def _token(kind, value, where):
+        if kind == "tags":
+            value = value[1:] if value.startswith("#") else value
+            if not _TAG.fullmatch(value):
+                raise MappingError(f"'#{value}' in the {where} is not a tag.")
+            return "#" + value
+        if kind == "links":
+            value = value[2:-2].strip() if value.startswith("[[") and value.endswith("]]") else value
+            return "[[" + value
+        if not _WORD.fullmatch(value):
+            raise MappingError(f"'{value}' in the {where} is not a single word.")
+        return value
+
+    def __bool__(self):
+        return bool(self._index)
+
+    def match(self, text):
+        """Target file of the best rule text's tokens match, or None."""
+        index = self._index
+        best = None
+        for token in set(_TOKEN.findall(text.lower())):
+            rule = index.get(token.rstrip() if token.startswith("[[") else token)
+            if rule is not None and (best is None or rule > best):
+                best = rule
+        return None if best is None else best[2]
+
+
+_cache_key = None
+_cache_matcher = None
+
+
+def compile_rules(mappings):
+    """Return a BodyMatcher for mappings' body rules, reusing the last one while they are unchanged."""
+    global _cache_key, _cache_matcher
+    key = repr([(m.get("body"), m["target_file"]) for m in mappings if m.get("body") is not None])
+    if key != _cache_key:
+        _cache_matcher = BodyMatcher(mappings)
+        _cache_key = key
+    return _cache_matcher
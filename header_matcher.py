@@ -0,0 +1,194 @@
+"""Compiled header lookup used by the segmenter.
+
+Each mapping may carry an optional "match" kind and a list of "aliases":
+
+    {"header": "Proj", "match": "prefix", "aliases": ["Project"], "target_file": "..."}
+
+Kinds are "exact" (the default), "prefix", "glob" and "regex"; all comparisons are
+case-insensitive. A lookup tries exact headers first (a dict hit), then the longest
+matching prefix (a trie walk over the line), then glob/regex headers, which are
+folded into one alternation regex and tried in mapping order. Patterns with groups
+of their own (backreferences, named groups) can't share one regex, so when there
+are any, each pattern is tried on its own instead.
+
+line_regex() gives the segmenter a bytes regex that matches (at least) every line
+whose text any header could match, so it can skip the other lines unread.
+"""
+import fnmatch
+import re
+
+MATCH_KINDS = ("exact", "prefix", "glob", "regex")
+
+_TERMINAL = "" # Trie key marking the end of a prefix; real characters are never empty
+
+_ANY = rb"[^\n]*"
+# The only non-ASCII characters that lowercase to, or case-insensitively match, an ASCII letter
+_LETTER_LOOKALIKES = {"i": "\u0130\u0131", "k": "\u212a", "s": "\u017f"}
+
+
+class MappingError(ValueError):
+    pass
+
+
+class HeaderMatcher:
+    def __init__(self, mappings):
+        self._exact = {}
+        self._trie = {}
+        self._pattern_targets = {}
+        self._separate = [] # (compiled pattern, target file) in mapping order, when they can't be combined
+        self._line_keys = [] # (key, kind) of every header, for line_regex(); None once a regex header makes it unbounded
+        patterns = []
+
+        for i, m in enumerate(mappings):
+            kind = m.get("match", "exact")
+            if kind not in MATCH_KINDS:
+                raise MappingError(f"Unknown match kind '{kind}' for header '{m['header']}'.")
+            target_file = m["target_file"]
+            for header in [m["header"]] + list(m.get("aliases", [])):
+                key = header.lower()
+                if self._line_keys is not None:
+                    self._line_keys = None if kind == "regex" else self._line_keys + [(key, kind)]
+                if kind == "exact":
+                    self._exact[key] = target_file # Later mappings win, as before
+                elif kind == "prefix":
+                    self._add_prefix(key, target_file)
+                else:
+                    pattern = fnmatch.translate(key) if kind == "glob" else header
+                    try:
+                        compiled = re.compile(pattern, re.IGNORECASE)
+                    except re.error as e:
+                        raise MappingError(f"Invalid {kind} header '{header}': {e}")
+                    group = f"_h{len(patterns)}"
+                    patterns.append(f"(?P<{group}>{pattern})")
+                    self._pattern_targets[group] = (header, target_file)
+                    self._separate.append((compiled, target_file))
+
+        self._patterns = None
+        if patterns and all(compiled.groups == 0 for compiled, _ in self._separate):
+            try:
+                self._patterns = re.compile("|".join(patterns), re.IGNORECASE)
+            except re.error: # Valid on their own; keep trying them one by one
+                pass
+        if self._patterns is not None:
+            self._separate = []
+
+    def _add_prefix(self, key, target_file):
+        node = self._trie
+        for ch in key:
+            node = node.setdefault(ch, {})
+        node[_TERMINAL] = target_file
+
+    def _longest_prefix(self, key):
+        node = self._trie
+        found = node.get(_TERMINAL)
+        for ch in key:
+            node = node.get(ch)
+            if node is None:
+                break
+            found = node.get(_TERMINAL, found)
+        return found
+
+    def get(self, key, default=None):
+        # key is the candidate header line, already lowercased
+        target_file = self._exact.get(key)
+        if target_file is not None:
+            return target_file
+        if self._trie:
+            target_file = self._longest_prefix(key)
+            if target_file is not None:
+                return target_file
+        if self._patterns is not None:
+            match = self._patterns.fullmatch(key)
+            if match is not None:
+                return self._pattern_targets[match.lastgroup][1]
+        for pattern, target_file in self._separate:
+            if pattern.fullmatch(key):
+                return target_file
+        return default
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def line_regex(self):
+        """Bytes regex source matching the raw UTF-8 text of every line whose lowercased form get() could accept.
+
+        It matches more than that (non-ASCII characters match anything), never less,
+        and leaves surrounding whitespace to the caller. Returns None when a regex
+        header makes the lines impossible to bound.
+        """
+        if self._line_keys is None:
+            return None
+        if not self._line_keys:
+            return rb"(?!)"
+        # Shared leading pieces are factored into a tree so each line is tried against it once, not per header
+        tree = {}
+        for key, kind in self._line_keys:
+            node = tree
+            for token in _line_tokens(key, kind):
+                node = node.setdefault(token, {})
+            node[b""] = {}
+
+        def branches(node):
+            alternatives = [token + branches(child) if child else token for token, child in node.items()]
+            return alternatives[0] if len(alternatives) == 1 else b"(?:" + b"|".join(alternatives) + b")"
+        return branches(tree)
+
+    def line_first_bytes(self):
+        """The ASCII bytes a line_regex() match can start with, or None if it can start with anything.
+
+        Non-ASCII lead bytes are left out; callers have to allow them anyway.
+        """
+        if self._line_keys is None:
+            return None
+        first = set()
+        for key, kind in self._line_keys:
+            if not key:
+                if kind != "exact":
+                    return None
+            elif kind == "glob" and key[0] in "*?[":
+                return None
+            elif key[0] < "\x80":
+                first.update((key[0] + key[0].upper()).encode())
+        return bytes(sorted(first))
+
+
+def _line_tokens(key, kind):
+    tokens = []
+
+    def add(token):
+        if token != _ANY or not tokens or tokens[-1] != _ANY:
+            tokens.append(token)
+    for ch in key:
+        if kind == "glob" and ch in "*?[":
+            add(_ANY)
+            if ch == "[": # A character set; anything from here on is allowed
+                return tokens
+        elif ch >= "\x80":
+            add(_ANY) # Case folding can change a non-ASCII character's length, so don't try to spell it
+        elif ch.isalpha():
+            letters = ch.lower() + ch.upper()
+            lookalikes = [re.escape(c.encode("utf-8")) for c in _LETTER_LOOKALIKES.get(ch.lower(), "")]
+            add(b"(?:" + b"|".join([b"[" + letters.encode() + b"]"] + lookalikes) + b")" if lookalikes
+                else b"[" + letters.encode() + b"]")
+        else:
+            add(re.escape(ch.encode()))
+    if kind != "exact":
+        add(_ANY)
+    return tokens
+
+
+_cache_key = None
+_cache_matcher = None
+
+
+def compile_mappings(mappings):
+    """Return a HeaderMatcher for mappings, reusing the last one while they are unchanged."""
+    global _cache_key, _cache_matcher
+    key = tuple(
+        (m["header"], m["target_file"], m.get("match", "exact"), tuple(m.get("aliases", ())))
+        for m in mappings
+    )
+    if key != _cache_key:
+        _cache_matcher = HeaderMatcher(mappings)
+        _cache_key = key
+    return _cache_matcher
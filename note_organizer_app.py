@@ -1,20 +1,218 @@
 import sys
-import json
 import os
-import re
-from datetime import datetime
-import collections
+import time
+_MODULE_START = time.perf_counter() # Origin of the --startup-timing marks, before the Qt imports
+import copy
+import importlib.util
+import threading
+import concurrent.futures
 from PyQt5.QtWidgets import (QApplication, QSystemTrayIcon, QMenu, QAction,
                              QDialog, QVBoxLayout, QHBoxLayout, QLabel,
                              QLineEdit, QPushButton, QMessageBox, QFileDialog,
                              QTableWidget, QTableWidgetItem, QHeaderView, QGroupBox,
-                             QSizePolicy, QGridLayout) # Added QGridLayout
-from PyQt5.QtGui import QIcon
-from PyQt5.QtCore import Qt
+                             QSizePolicy, QGridLayout, QTableView, QAbstractItemView) # Added QGridLayout
+from PyQt5.QtGui import QIcon, QImage
+from PyQt5.QtCore import (Qt, QThread, QTimer, QFileSystemWatcher, pyqtSignal, QAbstractTableModel,
+                          QModelIndex, QMimeData, QSortFilterProxyModel, QObject, QSize)
+
+
+def _lazy_import(name):
+    # The module is only executed on first attribute access. The backend modules below pull in
+    # sqlite3, multiprocessing and asyncio; they load in finish_startup, after the tray icon is up.
+    spec = importlib.util.find_spec(name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
+
+
+body_matcher = _lazy_import("body_matcher")
+header_matcher = _lazy_import("header_matcher")
+organizer_api = _lazy_import("organizer_api")
+organizer_config = _lazy_import("organizer_config")
+organizer_dedup = _lazy_import("organizer_dedup")
+organizer_engine = _lazy_import("organizer_engine")
+organizer_history = _lazy_import("organizer_history")
+organizer_journal = _lazy_import("organizer_journal")
+organizer_log = _lazy_import("organizer_log")
+organizer_watch = _lazy_import("organizer_watch")
+_MODULE_IMPORTED = time.perf_counter()
 
-CONFIG_FILE = "config.json"
-LOG_FILE = "organizer.log"
 TRAY_ICON_FILE = "tray_icon.png"
+TRAY_TOOLTIP = "Obsidian Note Organizer"
+DEFAULT_WATCH_DEBOUNCE_MS = 2000
+HISTORY_SEARCH_DELAY_MS = 250
+MAPPING_ROWS_MIME_TYPE = "application/x-note-organizer-mapping-rows"
+TRAY_ICON_SIZES = (16, 22, 24, 32, 48, 64) # Tray slots on common desktops, at 1x and 2x
+STARTUP_TIMING_FLAG = "--startup-timing"
+
+
+def scaled_icon_path(icon_path, size):
+    # tray_icon.png -> .tray_icon.22.png, next to the original
+    directory, name = os.path.split(icon_path)
+    stem, ext = os.path.splitext(name)
+    return os.path.join(directory, f".{stem}.{size}{ext}")
+
+
+def load_tray_icon(icon_path):
+    """QIcon with one pre-scaled file per tray size, so startup never decodes the full-size image.
+
+    The scaled files are written on first use and again whenever the original is newer.
+    """
+    try:
+        original_mtime = os.stat(icon_path).st_mtime_ns
+        missing = []
+        for size in TRAY_ICON_SIZES:
+            try:
+                if os.stat(scaled_icon_path(icon_path, size)).st_mtime_ns < original_mtime:
+                    missing.append(size)
+            except FileNotFoundError:
+                missing.append(size)
+        if missing:
+            image = QImage(icon_path)
+            if image.isNull():
+                raise OSError(f"could not read {icon_path}")
+            for size in missing:
+                path = scaled_icon_path(icon_path, size)
+                tmp_path = path + ".tmp"
+                if not image.scaled(size, size, Qt.KeepAspectRatio, Qt.SmoothTransformation).save(tmp_path, "PNG"):
+                    raise OSError(f"could not write {tmp_path}")
+                os.replace(tmp_path, path)
+    except OSError as e:
+        print(f"Icon Cache Error: {e}")
+        return QIcon(icon_path)
+    icon = QIcon()
+    for size in TRAY_ICON_SIZES:
+        icon.addFile(scaled_icon_path(icon_path, size), QSize(size, size)) # Read when that size is first painted
+    return icon
+
+
+class StartupTimer:
+    # Milliseconds from the start of this module to each startup step. Logged with app_start;
+    # with --startup-timing they are also printed and the app quits once it is ready.
+    def __init__(self, report_only=False):
+        self.report_only = report_only
+        self.marks = [("imports", (_MODULE_IMPORTED - _MODULE_START) * 1000)]
+
+    def mark(self, step):
+        self.marks.append((step, (time.perf_counter() - _MODULE_START) * 1000))
+
+    def as_fields(self):
+        return {f"{step}_ms": round(ms, 1) for step, ms in self.marks}
+
+    def report(self):
+        return "Startup: " + ", ".join(f"{step} {ms:.1f} ms" for step, ms in self.marks)
+
+class MappingsModel(QAbstractTableModel):
+    # Table model over the app's live mappings list. Every edit mutates the list in place and
+    # announces just the rows it touched, so the view never rebuilds the whole table.
+    COLUMNS = (("Header", "header"), ("Target File", "target_file"))
+
+    def __init__(self, mappings, parent=None):
+        super().__init__(parent)
+        self.mappings = mappings
+
+    def set_mappings(self, mappings):
+        self.beginResetModel()
+        self.mappings = mappings
+        self.endResetModel()
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.mappings)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.COLUMNS)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if index.isValid() and role in (Qt.DisplayRole, Qt.ToolTipRole):
+            return self.mappings[index.row()].get(self.COLUMNS[index.column()][1], "")
+        return None
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role != Qt.DisplayRole:
+            return None
+        if orientation == Qt.Horizontal:
+            return self.COLUMNS[section][0]
+        return section + 1
+
+    def flags(self, index):
+        if not index.isValid():
+            return Qt.ItemIsDropEnabled # Dropping between rows
+        return Qt.ItemIsEnabled | Qt.ItemIsSelectable | Qt.ItemIsDragEnabled
+
+    def find_header(self, header):
+        for row, mapping in enumerate(self.mappings):
+            if mapping["header"] == header:
+                return row
+        return -1
+
+    def append_mapping(self, mapping):
+        row = len(self.mappings)
+        self.beginInsertRows(QModelIndex(), row, row)
+        self.mappings.append(mapping)
+        self.endInsertRows()
+        return row
+
+    def set_target_file(self, row, target_file):
+        self.mappings[row]["target_file"] = target_file
+        index = self.index(row, 1)
+        self.dataChanged.emit(index, index)
+
+    def removeRows(self, row, count, parent=QModelIndex()):
+        if parent.isValid() or row < 0 or count < 1 or row + count > len(self.mappings):
+            return False
+        self.beginRemoveRows(QModelIndex(), row, row + count - 1)
+        del self.mappings[row:row + count]
+        self.endRemoveRows()
+        return True
+
+    def moveRows(self, source_parent, source_row, count, destination_parent, destination_row):
+        # destination_row is the row the block is inserted before, counted before the move (Qt's convention)
+        if (source_parent.isValid() or destination_parent.isValid() or count < 1
+                or source_row < 0 or source_row + count > len(self.mappings)
+                or not 0 <= destination_row <= len(self.mappings)
+                or source_row <= destination_row <= source_row + count):
+            return False
+        if not self.beginMoveRows(QModelIndex(), source_row, source_row + count - 1, QModelIndex(), destination_row):
+            return False
+        block = self.mappings[source_row:source_row + count]
+        del self.mappings[source_row:source_row + count]
+        if destination_row > source_row:
+            destination_row -= count
+        self.mappings[destination_row:destination_row] = block
+        self.endMoveRows()
+        return True
+
+    # --- Drag to reorder ---
+
+    def supportedDropActions(self):
+        return Qt.MoveAction
+
+    def mimeTypes(self):
+        return [MAPPING_ROWS_MIME_TYPE]
+
+    def mimeData(self, indexes):
+        rows = sorted({index.row() for index in indexes if index.isValid()})
+        mime_data = QMimeData()
+        mime_data.setData(MAPPING_ROWS_MIME_TYPE, ",".join(map(str, rows)).encode("ascii"))
+        return mime_data
+
+    def dropMimeData(self, mime_data, action, row, column, parent):
+        if action != Qt.MoveAction or not mime_data.hasFormat(MAPPING_ROWS_MIME_TYPE):
+            return False
+        rows = bytes(mime_data.data(MAPPING_ROWS_MIME_TYPE)).decode("ascii")
+        if not rows:
+            return False
+        source_row = int(rows.split(",")[0]) # The view is single-selection
+        if row < 0:
+            row = parent.row() if parent.isValid() else len(self.mappings) # Dropped onto a row, or below the last
+        self.moveRows(QModelIndex(), source_row, 1, QModelIndex(), row)
+        # The row has already been moved; reporting the drop as not taken keeps the view
+        # from deleting the dragged row afterwards, as it does for a copy-then-remove move
+        return False
+
 
 class SettingsDialog(QDialog):
     def __init__(self, app_logic, parent=None):
@@ -74,20 +272,40 @@ class SettingsDialog(QDialog):
 
         mappings_layout.addLayout(input_layout)
 
-        # Mappings Table
-        self.mappings_table = QTableWidget()
-        self.mappings_table.setColumnCount(2)
-        self.mappings_table.setHorizontalHeaderLabels(["Header", "Target File"])
+        # Live filter over the mappings below
+        self.mappings_filter_entry = QLineEdit()
+        self.mappings_filter_entry.setPlaceholderText("Filter mappings by header or target file...")
+        self.mappings_filter_entry.setClearButtonEnabled(True)
+        mappings_layout.addWidget(self.mappings_filter_entry)
+
+        # Mappings Table: a view over the app's mappings list, so edits only touch the affected rows
+        self.mappings_model = MappingsModel(self.app_logic.mappings, self)
+        self.mappings_proxy = QSortFilterProxyModel(self)
+        self.mappings_proxy.setSourceModel(self.mappings_model)
+        self.mappings_proxy.setFilterKeyColumn(-1) # Match either column
+        self.mappings_proxy.setFilterCaseSensitivity(Qt.CaseInsensitive)
+        self.mappings_filter_entry.textChanged.connect(self.mappings_proxy.setFilterFixedString)
+        self.mappings_table = QTableView()
+        self.mappings_table.setModel(self.mappings_proxy)
         # Make columns resizable by user
         self.mappings_table.horizontalHeader().setSectionResizeMode(0, QHeaderView.Interactive)
         self.mappings_table.horizontalHeader().setSectionResizeMode(1, QHeaderView.Interactive)
         # Set initial column widths
         self.mappings_table.setColumnWidth(0, 200)
         self.mappings_table.setColumnWidth(1, 800)
-        self.mappings_table.setSelectionBehavior(QTableWidget.SelectRows)
-        self.mappings_table.setSelectionMode(QTableWidget.SingleSelection)
-        self.mappings_table.itemSelectionChanged.connect(self.on_mapping_select)
+        self.mappings_table.setSelectionBehavior(QAbstractItemView.SelectRows)
+        self.mappings_table.setSelectionMode(QAbstractItemView.SingleSelection)
+        self.mappings_table.selectionModel().selectionChanged.connect(self.on_mapping_select)
+        self.mappings_model.rowsMoved.connect(self.on_mapping_select) # Keep Move Up/Down in step after a drag
         self.mappings_table.verticalHeader().setDefaultSectionSize(25) # Adjust row height for compactness
+        self.mappings_table.verticalHeader().setSectionResizeMode(QHeaderView.Fixed) # No per-row size hints to compute
+        # Drag rows to reorder them
+        self.mappings_table.setDragEnabled(True)
+        self.mappings_table.setAcceptDrops(True)
+        self.mappings_table.setDropIndicatorShown(True)
+        self.mappings_table.setDragDropMode(QAbstractItemView.DragDrop)
+        self.mappings_table.setDefaultDropAction(Qt.MoveAction)
+        self.mappings_table.setDragDropOverwriteMode(False)
         mappings_layout.addWidget(self.mappings_table)
 
         # Buttons for table operations
@@ -115,6 +333,34 @@ class SettingsDialog(QDialog):
         mappings_group.setLayout(mappings_layout)
         main_layout.addWidget(mappings_group)
 
+        # --- Move History ---
+        history_group = QGroupBox("Move History")
+        history_layout = QVBoxLayout()
+        self.history_search_entry = QLineEdit()
+        self.history_search_entry.setPlaceholderText("Search moved notes by text or header...")
+        history_layout.addWidget(self.history_search_entry)
+        # Search once typing pauses rather than on every keystroke
+        self.history_search_timer = QTimer(self)
+        self.history_search_timer.setSingleShot(True)
+        self.history_search_timer.setInterval(HISTORY_SEARCH_DELAY_MS)
+        self.history_search_timer.timeout.connect(self.search_history)
+        self.history_search_entry.textChanged.connect(self.history_search_timer.start)
+
+        self.history_table = QTableWidget()
+        self.history_table.setColumnCount(4)
+        self.history_table.setHorizontalHeaderLabels(["Moved", "Header", "Target File", "Note"])
+        self.history_table.horizontalHeader().setSectionResizeMode(QHeaderView.Interactive)
+        self.history_table.horizontalHeader().setStretchLastSection(True)
+        self.history_table.setColumnWidth(0, 170)
+        self.history_table.setColumnWidth(1, 150)
+        self.history_table.setColumnWidth(2, 350)
+        self.history_table.setEditTriggers(QTableWidget.NoEditTriggers)
+        self.history_table.setSelectionBehavior(QTableWidget.SelectRows)
+        self.history_table.verticalHeader().setDefaultSectionSize(25)
+        history_layout.addWidget(self.history_table)
+        history_group.setLayout(history_layout)
+        main_layout.addWidget(history_group)
+
         # Dialog buttons (Save/Close)
         dialog_button_layout = QHBoxLayout()
         dialog_button_layout.addStretch()
@@ -127,6 +373,24 @@ class SettingsDialog(QDialog):
     def load_settings_to_ui(self):
         self.notes_file_entry.setText(self.app_logic.last_notes_file)
         self.populate_mappings_list()
+        self.search_history()
+
+    def search_history(self):
+        try:
+            results = self.app_logic.history.search(text=self.history_search_entry.text())
+        except Exception as e: # A broken history database shouldn't keep the settings from opening
+            results = []
+            print(f"History search failed: {e}")
+        self.history_table.setRowCount(len(results))
+        for row, move in enumerate(results):
+            moved = move["ts"].replace("T", " ")[:19]
+            if move["undone"]:
+                moved += " (undone)"
+            for column, text in enumerate((moved, move["header"], move["target"], move["snippet"].replace("\n", " "))):
+                item = QTableWidgetItem(text)
+                if column == 3:
+                    item.setToolTip(move["snippet"])
+                self.history_table.setItem(row, column, item)
 
     def browse_notes_file(self):
         filepath, _ = QFileDialog.getOpenFileName(
@@ -145,14 +409,24 @@ class SettingsDialog(QDialog):
             self.target_file_entry.setText(filepath)
 
     def populate_mappings_list(self):
-        self.mappings_table.setRowCount(0) # Clear table
-        for i, mapping in enumerate(self.app_logic.mappings):
-            self.mappings_table.insertRow(i)
-            self.mappings_table.setItem(i, 0, QTableWidgetItem(mapping["header"]))
-            self.mappings_table.setItem(i, 1, QTableWidgetItem(mapping["target_file"]))
+        # Only needed when the app's mappings list is replaced; edits go through the model
+        self.mappings_model.set_mappings(self.app_logic.mappings)
         self.mappings_table.clearSelection()
         self.remove_mapping_button.setEnabled(False)
 
+    def selected_mapping_row(self):
+        """Row of the selected mapping in app_logic.mappings, or -1."""
+        selected_rows = self.mappings_table.selectionModel().selectedRows()
+        if not selected_rows:
+            return -1
+        return self.mappings_proxy.mapToSource(selected_rows[0]).row()
+
+    def select_mapping_row(self, row):
+        proxy_index = self.mappings_proxy.mapFromSource(self.mappings_model.index(row, 0))
+        if proxy_index.isValid():
+            self.mappings_table.selectRow(proxy_index.row())
+            self.mappings_table.scrollTo(proxy_index)
+
 
     def add_or_update_mapping(self):
         header = self.header_entry.text().strip()
@@ -165,25 +439,21 @@ class SettingsDialog(QDialog):
             QMessageBox.warning(self, "Input Error", "Target file path cannot be empty.")
             return
 
-        found_idx = -1
-        for i, m in enumerate(self.app_logic.mappings):
-            if m["header"] == header:
-                found_idx = i
-                break
+        found_idx = self.mappings_model.find_header(header)
         
         if found_idx != -1:
             reply = QMessageBox.question(self, "Confirm Update",
                                          f"Header '{header}' already exists. Update target file to '{target_file}'?",
                                          QMessageBox.Yes | QMessageBox.No, QMessageBox.No)
             if reply == QMessageBox.Yes:
-                self.app_logic.mappings[found_idx]["target_file"] = target_file
+                self.mappings_model.set_target_file(found_idx, target_file)
             else:
                 return # User cancelled
         else:
-            self.app_logic.mappings.append({"header": header, "target_file": target_file})
+            self.mappings_model.append_mapping({"header": header, "target_file": target_file})
 
         # self.app_logic.save_config() # Save will happen on dialog close
-        self.populate_mappings_list()
+        self.mappings_table.clearSelection()
         self.header_entry.clear()
         self.target_file_entry.clear()
         QMessageBox.information(self, "Success", "Mapping added/updated successfully.")
@@ -192,15 +462,14 @@ class SettingsDialog(QDialog):
     def on_mapping_select(self):
         selected_rows = self.mappings_table.selectionModel().selectedRows()
         if selected_rows:
-            row_index = selected_rows[0].row()
-            header = self.mappings_table.item(row_index, 0).text()
-            target_file = self.mappings_table.item(row_index, 1).text()
-            self.header_entry.setText(header)
-            self.target_file_entry.setText(target_file)
+            row_index = selected_rows[0].row() # Position among the rows the filter shows
+            mapping = self.app_logic.mappings[self.mappings_proxy.mapToSource(selected_rows[0]).row()]
+            self.header_entry.setText(mapping["header"])
+            self.target_file_entry.setText(mapping["target_file"])
             self.remove_mapping_button.setEnabled(True)
             
             # Enable/disable move buttons based on position
-            total_rows = self.mappings_table.rowCount()
+            total_rows = self.mappings_proxy.rowCount()
             self.move_up_button.setEnabled(row_index > 0)
             self.move_down_button.setEnabled(row_index < total_rows - 1)
         else:
@@ -211,59 +480,45 @@ class SettingsDialog(QDialog):
             self.move_down_button.setEnabled(False)
 
     def move_mapping_up(self):
-        selected_rows = self.mappings_table.selectionModel().selectedRows()
-        if not selected_rows:
-            return
-        
-        row_index = selected_rows[0].row()
-        if row_index <= 0:
-            return
-        
-        # Swap the mappings in the data
-        self.app_logic.mappings[row_index], self.app_logic.mappings[row_index - 1] = \
-            self.app_logic.mappings[row_index - 1], self.app_logic.mappings[row_index]
-        
-        # Refresh the table
-        self.populate_mappings_list()
-        
-        # Select the moved row
-        self.mappings_table.selectRow(row_index - 1)
+        self.move_selected_mapping(-1)
 
     def move_mapping_down(self):
+        self.move_selected_mapping(1)
+
+    def move_selected_mapping(self, step):
+        # Moves past the neighbouring row the filter shows, which is the adjacent mapping when unfiltered
         selected_rows = self.mappings_table.selectionModel().selectedRows()
         if not selected_rows:
             return
         
-        row_index = selected_rows[0].row()
-        if row_index >= len(self.app_logic.mappings) - 1:
+        proxy_row = selected_rows[0].row()
+        neighbour = self.mappings_proxy.index(proxy_row + step, 0)
+        if not neighbour.isValid():
             return
         
-        # Swap the mappings in the data
-        self.app_logic.mappings[row_index], self.app_logic.mappings[row_index + 1] = \
-            self.app_logic.mappings[row_index + 1], self.app_logic.mappings[row_index]
-        
-        # Refresh the table
-        self.populate_mappings_list()
-        
-        # Select the moved row
-        self.mappings_table.selectRow(row_index + 1)
+        row_index = self.mappings_proxy.mapToSource(selected_rows[0]).row()
+        neighbour_row = self.mappings_proxy.mapToSource(neighbour).row()
+        # moveRows inserts before the destination row, so moving down goes one past the neighbour
+        destination_row = neighbour_row if step < 0 else neighbour_row + 1
+        if self.mappings_model.moveRows(QModelIndex(), row_index, 1, QModelIndex(), destination_row):
+            # Select the moved row
+            self.select_mapping_row(neighbour_row)
 
     def remove_mapping(self):
-        selected_rows = self.mappings_table.selectionModel().selectedRows()
-        if not selected_rows:
+        row_index = self.selected_mapping_row()
+        if row_index == -1:
             QMessageBox.warning(self, "Selection Error", "No mapping selected to remove.")
             return
 
-        row_index = selected_rows[0].row()
-        header_to_remove = self.mappings_table.item(row_index, 0).text()
+        header_to_remove = self.app_logic.mappings[row_index]["header"]
 
         reply = QMessageBox.question(self, "Confirm Removal",
                                      f"Are you sure you want to remove the mapping for header '{header_to_remove}'?",
                                      QMessageBox.Yes | QMessageBox.No, QMessageBox.No)
         if reply == QMessageBox.Yes:
-            self.app_logic.mappings = [m for m in self.app_logic.mappings if m["header"] != header_to_remove]
+            self.mappings_model.removeRows(row_index, 1)
             # self.app_logic.save_config() # Save on dialog close
-            self.populate_mappings_list()
+            self.mappings_table.clearSelection()
             self.header_entry.clear()
             self.target_file_entry.clear()
             self.remove_mapping_button.setEnabled(False)
@@ -279,23 +534,144 @@ class SettingsDialog(QDialog):
         super().reject()
 
 
+class OrganizeWorker(QThread):
+    # Runs one organize pass (or preview) off the GUI thread; results come back through queued signals
+    progress = pyqtSignal(int, int)
+    succeeded = pyqtSignal(object)
+    failed = pyqtSignal(object)
+
+    def __init__(self, last_notes_file, notes_files, mappings, logger, journal, parent=None,
+                 preview=False, plan=None, undo=False, capture=None, dedup=None):
+        super().__init__(parent)
+        self.last_notes_file = last_notes_file
+        self.notes_files = list(notes_files) # Globs are expanded in run(); a large vault takes a moment
+        self.mappings = copy.deepcopy(mappings) # The settings dialog may edit the live list meanwhile
+        self.logger = logger
+        self.journal = journal
+        self.preview = preview # Only plan the pass and emit the OrganizePlan
+        self.plan = plan # Commit this earlier preview instead of planning again
+        self.undo = undo # Reverse the last journaled run instead of organizing
+        self.capture = capture # CapturedNotes to write straight to their targets instead of organizing
+        self.dedup = dedup # DedupIndex of the notes already in each target, or None
+        self.api_waiters = [] # (future, diff flag or captured notes) of API requests answered by this run
+        self.result = None
+        self.error = None
+        self._cancel_requested = threading.Event()
+
+    def cancel(self):
+        self._cancel_requested.set()
+
+    def run(self):
+        try:
+            if self.undo:
+                result = organizer_engine.undo_last_run(self.journal, self.logger)
+            elif self.capture is not None:
+                result = organizer_engine.ingest_notes(self.capture, self.mappings, self.last_notes_file, logger=self.logger,
+                                                       dedup=self.dedup)
+            elif self.plan is not None:
+                result = organizer_engine.commit_plan(self.plan, logger=self.logger, progress=self.progress.emit,
+                                                      should_cancel=self._cancel_requested.is_set, journal=self.journal,
+                                                      dedup=self.dedup)
+            else:
+                sources = organizer_engine.resolve_sources(self.last_notes_file, self.notes_files, self.mappings)
+                if self.preview:
+                    result = organizer_engine.plan_organize(sources, self.mappings,
+                                                            should_cancel=self._cancel_requested.is_set, dedup=self.dedup)
+                else:
+                    result = organizer_engine.organize_notes(sources, self.mappings, logger=self.logger,
+                                                             progress=self.progress.emit,
+                                                             should_cancel=self._cancel_requested.is_set,
+                                                             journal=self.journal, dedup=self.dedup)
+        except organizer_engine.OrganizerError as e:
+            self.error = e
+            self.failed.emit(e)
+        except Exception as e: # Never let an unexpected error die silently in the thread
+            self.error = organizer_engine.OrganizerError("Organization Error", f"Unexpected error while organizing: {e}")
+            self.failed.emit(self.error)
+        else:
+            self.result = result
+            self.succeeded.emit(result)
+
+    def kind(self):
+        if self.undo:
+            return "undo"
+        if self.capture is not None:
+            return "capture"
+        return "preview" if self.preview else "organize"
+
+
+class ApiBridge(QObject):
+    # Hands API requests from the server's thread to the GUI thread (the signal is queued across threads)
+    requested = pyqtSignal(str, object, object)
+
+
 class NoteOrganizerAppLogic:
-    def __init__(self):
+    def __init__(self, startup_timer=None):
+        self.startup_timer = startup_timer or StartupTimer()
         self.q_app = QApplication.instance() # Get existing instance or None
         if not self.q_app:
              self.q_app = QApplication(sys.argv)
         self.q_app.setQuitOnLastWindowClosed(False) # Important for tray icon
+        self.startup_timer.mark("qt_app")
 
         self.settings_dialog_instance = None
         self.tray_icon = None
-        
+        self.cancel_action = None
+        self.organize_worker = None
+        self.organize_pending = False # Set when organize is requested while a run is in progress
+        self.organize_quiet = False # Watch-triggered runs only report when something happened
+        self.pending_quiet = False
+        self.preview_plan = None # (OrganizePlan, mappings) from a finished preview, shown once its worker is done
+        self.last_run_summary = None # Shown in the idle tooltip, e.g. "last run 0.42 s, 3 notes"
+        self.last_result = None # to_dict() of the last finished pass, for the API's status
+
+        # Set by load_state, which runs after the tray icon is shown
+        self.config_store = None
+        self.config_data = {} # Kept whole so sections the app doesn't edit survive a save
+        self.mappings = []
+        self.last_notes_file = ""
+        self.history = None
+        self.logger = None
+        self.journal = None
+        self.dedup = None
+
+        # Watch mode: file change -> debounce timer -> fingerprint check -> organize
+        self.watch_enabled = False
+        self.watch_action = None
+        self.file_watcher = None
+        self.watch_timer = QTimer()
+        self.watch_timer.setSingleShot(True)
+        self.watch_timer.timeout.connect(self.on_watch_timeout)
+        self.inbox_fingerprint = None # Fingerprint of the main file after the last pass or skipped check
+        self.fingerprint_key = None # (notes file, header matcher, body matcher) the fingerprint is valid for
+
+        # Local socket API: requests wait in api_waiters until the run that answers them starts
+        self.api_server = None
+        self.api_bridge = ApiBridge()
+        self.api_bridge.requested.connect(self.on_api_request)
+        self.api_waiters = {"organize": [], "dry-run": [], "capture": []}
+        # Captures are held this long from the first one, then written with one write per target
+        self.capture_timer = QTimer()
+        self.capture_timer.setSingleShot(True)
+        self.capture_timer.timeout.connect(self.on_capture_timeout)
+        # No notes_file_path_var directly, UI will handle its own display
+
+    def load_state(self):
+        # Config, logs and indexes; this is where the lazily imported backend modules get loaded
+        if self.logger is not None:
+            return
+        self.config_store = organizer_config.ConfigStore(organizer_engine.CONFIG_FILE, report_error=self._show_config_error_message)
         config_data = self.load_config()
-        self.mappings = config_data.get("mappings", [])
+        watch_options = config_data.get("watch", {})
+        self.watch_enabled = isinstance(watch_options, dict) and bool(watch_options.get("enabled", False))
         self.last_notes_file = config_data.get("last_notes_file", "")
-        # No notes_file_path_var directly, UI will handle its own display
+        self.history = organizer_history.MoveHistory(organizer_history.HISTORY_FILE)
+        self.logger = organizer_log.RunLogger.from_config(config_data, organizer_log.LOG_FILE, history=self.history)
+        self.apply_config(config_data)
 
     def show_settings_window(self):
         if self.settings_dialog_instance is None or not self.settings_dialog_instance.isVisible():
+            self.refresh_config()
             self.settings_dialog_instance = SettingsDialog(self)
             self.settings_dialog_instance.show()
             self.settings_dialog_instance.activateWindow() # Bring to front
@@ -306,42 +682,89 @@ class NoteOrganizerAppLogic:
 
 
     def run_organization_from_tray(self):
-        self.log_action("TRAY_CLICK", "Organize triggered from tray", "N/A", "N/A")
-        # Ensure config is current before organizing (already loaded in __init__, settings dialog saves on close)
+        self.logger.event("tray_click")
+        # organize_notes picks up config.json changes made by other programs; the settings dialog saves on close
         self.organize_notes()
 
     def on_quit(self):
-        self.log_action("APP_QUIT", "Application quitting. Attempting to save config...", "System", "System")
+        self.logger.event("app_quit")
         # If settings window is open and visible, grab the latest notes file path from it
         if self.settings_dialog_instance and self.settings_dialog_instance.isVisible():
             current_notes_file_in_dialog = self.settings_dialog_instance.notes_file_entry.text()
             if current_notes_file_in_dialog: # Only update if there's something in the field
                  self.last_notes_file = current_notes_file_in_dialog
         
+        if self.organize_worker is not None:
+            # Cancel if the main file is not yet rewritten, otherwise let the run finish writing targets
+            self.organize_pending = False
+            self.organize_worker.cancel()
+            self.organize_worker.wait()
+            self.answer_api_waiters(self.organize_worker)
+
         self.save_config() # Save configuration before quitting
+        self.shutdown()
+
+    def shutdown(self):
+        self.stop_api()
+        self.logger.close()
+        self.history.close()
+        if self.dedup is not None:
+            self.dedup.close()
+        organizer_engine.shutdown_scan_pool()
         self.q_app.quit()
 
     def start_tray_app(self):
         if not QSystemTrayIcon.isSystemTrayAvailable():
             QMessageBox.critical(None, "Systray", "I couldn't detect any system tray on this system.")
-            self.log_action("ERROR", "System tray not available.", "System", "System")
+            self.load_state()
+            self.logger.event("error", message="System tray not available.")
             sys.exit(1)
 
         icon_path = TRAY_ICON_FILE
         if not os.path.exists(icon_path):
             QMessageBox.critical(None, "Tray Icon Error", f"Icon file '{icon_path}' not found. Exiting.")
-            self.log_action("ERROR", f"Icon file {icon_path} not found.", "System", "System")
+            self.load_state()
+            self.logger.event("error", message=f"Icon file {icon_path} not found.")
             sys.exit(1)
         
-        self.tray_icon = QSystemTrayIcon(QIcon(icon_path), self.q_app)
-        self.tray_icon.setToolTip("Obsidian Note Organizer")
+        self.tray_icon = QSystemTrayIcon(load_tray_icon(icon_path), self.q_app)
+        self.tray_icon.setToolTip(TRAY_TOOLTIP)
+        self.tray_icon.show()
+        self.startup_timer.mark("tray_shown")
+        # The icon is painted on the event loop's first turn; everything else waits until then
+        QTimer.singleShot(0, self.finish_startup)
+        sys.exit(self.q_app.exec_())
+
+    def finish_startup(self):
+        self.startup_timer.mark("first_paint")
+        self.load_state()
+        self.startup_timer.mark("config")
 
         menu = QMenu()
         
         organize_action = QAction("Organize Notes", self.q_app)
         organize_action.triggered.connect(self.run_organization_from_tray)
         menu.addAction(organize_action)
+
+        preview_action = QAction("Preview Organize...", self.q_app)
+        preview_action.triggered.connect(self.preview_organize)
+        menu.addAction(preview_action)
+
+        self.cancel_action = QAction("Cancel Organize", self.q_app)
+        self.cancel_action.setEnabled(False)
+        self.cancel_action.triggered.connect(self.cancel_organize)
+        menu.addAction(self.cancel_action)
         
+        undo_action = QAction("Undo Last Run", self.q_app)
+        undo_action.triggered.connect(self.undo_last_run)
+        menu.addAction(undo_action)
+
+        self.watch_action = QAction("Auto-Organize on Change", self.q_app)
+        self.watch_action.setCheckable(True)
+        self.watch_action.setChecked(self.watch_enabled)
+        self.watch_action.toggled.connect(self.set_watch_enabled)
+        menu.addAction(self.watch_action)
+
         settings_action = QAction("Settings", self.q_app)
         settings_action.triggered.connect(self.show_settings_window)
         menu.addAction(settings_action)
@@ -354,36 +777,51 @@ class NoteOrganizerAppLogic:
         
         self.tray_icon.setContextMenu(menu)
         self.tray_icon.activated.connect(self.on_tray_activated)
-        self.tray_icon.show()
+        self.update_watch()
+        self.start_api()
+        if self.watch_enabled:
+            try:
+                self.fingerprint_key_for(self.mappings) # Cached, so the first watch check doesn't build them
+            except header_matcher.MappingError:
+                pass # Reported by the first pass
+        self.startup_timer.mark("ready")
 
-        self.log_action("APP_START", "Application started in tray mode.", "System", "System")
-        sys.exit(self.q_app.exec_())
+        self.logger.event("app_start", **self.startup_timer.as_fields())
+        if self.startup_timer.report_only:
+            print(self.startup_timer.report())
+            self.shutdown()
 
     def on_tray_activated(self, reason):
         if reason == QSystemTrayIcon.Trigger: # Left click
             self.run_organization_from_tray()
 
     def load_config(self):
-        default_config = {"mappings": [], "last_notes_file": ""}
-        if os.path.exists(CONFIG_FILE):
-            try:
-                with open(CONFIG_FILE, "r", encoding="utf-8") as f:
-                    config_data = json.load(f)
-                    if not isinstance(config_data, dict):
-                        self._show_config_error_message(f"{CONFIG_FILE} has an invalid format. Resetting.")
-                        return default_config
-                    if "mappings" not in config_data or not isinstance(config_data["mappings"], list):
-                        config_data["mappings"] = []
-                    if "last_notes_file" not in config_data or not isinstance(config_data["last_notes_file"], str):
-                        config_data["last_notes_file"] = ""
-                    return config_data
-            except json.JSONDecodeError:
-                self._show_config_error_message(f"Could not decode {CONFIG_FILE}. Using default configuration.")
-                return default_config
-            except Exception as e:
-                self._show_config_error_message(f"Could not load {CONFIG_FILE}: {e}. Using default configuration.")
-                return default_config
-        return default_config
+        return self.config_store.load()
+
+    def refresh_config(self):
+        # Pick up edits other programs made to config.json. Skipped while the settings window is
+        # open, since it edits the mappings in place; its save merges both sets of changes instead.
+        if self.settings_dialog_instance is not None and self.settings_dialog_instance.isVisible():
+            return False
+        if not self.config_store.changed():
+            return False
+        self.apply_config(self.config_store.load())
+        self.logger.event("config_reloaded", mappings=len(self.mappings))
+        return True
+
+    def apply_config(self, config_data):
+        notes_file_changed = config_data.get("last_notes_file", "") != self.last_notes_file
+        self.config_data = config_data
+        self.mappings = config_data.get("mappings", [])
+        self.last_notes_file = config_data.get("last_notes_file", "")
+        self.journal = organizer_journal.UndoJournal.from_config(config_data, organizer_journal.JOURNAL_FILE)
+        self.dedup = organizer_dedup.DedupIndex.from_config(config_data, organizer_dedup.DEDUP_FILE)
+        watch_options = config_data.get("watch", {})
+        if isinstance(watch_options, dict): # "enabled" stays as the tray menu has it
+            self.watch_timer.setInterval(int(watch_options.get("debounce_ms", DEFAULT_WATCH_DEBOUNCE_MS)))
+        self.capture_timer.setInterval(organizer_api.capture_window_ms(config_data))
+        if notes_file_changed:
+            self.update_watch()
 
     def _show_config_error_message(self, message):
         # This might be called before QApplication is fully set up for dialogs if config load fails early
@@ -393,208 +831,357 @@ class NoteOrganizerAppLogic:
 
 
     def save_config(self):
-        config_data = {
-            "mappings": self.mappings,
-            "last_notes_file": self.last_notes_file # Updated by SettingsDialog on accept
-        }
+        config_data = dict(self.config_data)
+        config_data["mappings"] = self.mappings
+        config_data["last_notes_file"] = self.last_notes_file # Updated by SettingsDialog on accept
+        watch_options = config_data.get("watch")
+        watch_options = dict(watch_options) if isinstance(watch_options, dict) else {}
+        watch_options["enabled"] = self.watch_enabled
+        config_data["watch"] = watch_options
+        self.config_data = config_data
+        self.update_watch() # The notes file may have changed in the settings dialog
         try:
-            with open(CONFIG_FILE, "w", encoding="utf-8") as f:
-                json.dump(config_data, f, indent=2)
+            # Returns the file as saved, including sections another program changed meanwhile
+            self.apply_config(self.config_store.save(config_data))
         except Exception as e:
-            QMessageBox.critical(None, "Config Save Error", f"Could not save configuration to {CONFIG_FILE}: {e}")
+            QMessageBox.critical(None, "Config Save Error", f"Could not save configuration to {organizer_engine.CONFIG_FILE}: {e}")
     
-    def log_action(self, header, note_snippet, source_file, target_file):
-        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        log_entry = f"{timestamp} | HEADER: {header} | NOTE_SNIPPET: {note_snippet[:30].replace(os.linesep, ' ')}... | MOVED_FROM: {os.path.basename(source_file)} | MOVED_TO: {target_file}{os.linesep}"
+    def show_message(self, title, message, icon=QSystemTrayIcon.Information, msecs=3000):
+        if self.tray_icon:
+            self.tray_icon.showMessage(title, message, icon, msecs)
+        elif icon == QSystemTrayIcon.Warning: # Fallback if tray icon isn't initialized for some reason
+            QMessageBox.warning(None, title, message)
+        else:
+            QMessageBox.information(None, title, message)
+
+    def set_tray_status(self, status=None):
+        status = status or self.last_run_summary
+        if self.tray_icon:
+            self.tray_icon.setToolTip(f"{TRAY_TOOLTIP} - {status}" if status else TRAY_TOOLTIP)
+
+    def organize_notes(self, quiet=False):
+        # Current state of self.mappings/last_notes_file is used; __init__ loads it and the settings dialog saves it.
+        if self.organize_worker is not None:
+            # Any number of requests during a run collapse into a single follow-up run
+            self.pending_quiet = quiet and (self.pending_quiet or not self.organize_pending)
+            self.organize_pending = True
+            return
+        self.organize_pending = False
+        self.organize_quiet = quiet
+        self.refresh_config()
+        worker = OrganizeWorker(self.last_notes_file, self.config_data.get("notes_files", []),
+                                self.mappings, self.logger, self.journal, self.q_app, dedup=self.dedup)
+        worker.api_waiters, self.api_waiters["organize"] = self.api_waiters["organize"], []
+        worker.succeeded.connect(self.report_result)
+        self.start_worker(worker, "Organizing...")
+
+    def preview_organize(self):
+        if self.organize_worker is not None:
+            self.show_message("Note Organizer", "An organize pass is running. Preview again once it has finished.")
+            return
+        self.refresh_config()
+        worker = OrganizeWorker(self.last_notes_file, self.config_data.get("notes_files", []),
+                                self.mappings, self.logger, self.journal, self.q_app, preview=True, dedup=self.dedup)
+        # Shown once the worker has finished, so "Organize" in the preview can start the commit right away
+        worker.succeeded.connect(lambda plan: setattr(self, "preview_plan", (plan, worker.mappings)))
+        self.start_worker(worker, "Previewing...")
+
+    def commit_preview(self, plan, mappings):
+        if self.organize_worker is not None:
+            self.show_message("Note Organizer", "An organize pass is running. Preview again once it has finished.")
+            return
+        self.organize_quiet = False
+        worker = OrganizeWorker(self.last_notes_file, (), mappings, self.logger, self.journal, self.q_app, plan=plan,
+                                dedup=self.dedup)
+        worker.succeeded.connect(self.report_result)
+        self.start_worker(worker, "Organizing...")
+
+    def undo_last_run(self):
+        if self.organize_worker is not None:
+            self.show_message("Note Organizer", "An organize pass is running. Undo once it has finished.")
+            return
+        reply = QMessageBox.question(None, "Undo Last Run",
+                                     "Put the notes moved by the last organize pass back into the main notes file?",
+                                     QMessageBox.Yes | QMessageBox.No, QMessageBox.No)
+        if reply != QMessageBox.Yes:
+            return
+        worker = OrganizeWorker(self.last_notes_file, (), self.mappings, self.logger, self.journal, self.q_app, undo=True)
+        worker.succeeded.connect(self.report_undo)
+        self.start_worker(worker, "Undoing...")
+
+    def report_undo(self, undone):
+        self.remember_fingerprint(undone) # So watch mode doesn't route the restored notes straight back out
+        self.show_message("Undo Complete", f"{undone.notes_restored} note(s) put back into the main notes file.")
+
+    def start_worker(self, worker, status):
+        worker.progress.connect(self.on_organize_progress)
+        worker.failed.connect(self.on_organize_failed)
+        worker.finished.connect(self.on_organize_finished)
+        self.organize_worker = worker
+        if self.cancel_action:
+            self.cancel_action.setEnabled(True)
+        self.set_tray_status(status)
+        worker.start()
+
+    def show_preview(self, plan, mappings):
+        if plan.status == "no_mappings":
+            self.show_message("Note Organizer", "No header-to-file mappings defined. Nothing to organize.")
+            return
+        if plan.notes_moved == 0 and plan.notes_skipped == 0:
+            self.show_message("Organize Preview", "No notes matched the defined mappings for moving.")
+            return
+        summary = [f"{plan.notes_moved} note(s) would be moved (planned in {plan.plan_ms:.0f} ms):"]
+        summary += [f"{target.notes_count} \u2192 {target.target_file} ({target.position})" for target in plan.targets]
+        if plan.notes_skipped:
+            summary.append(f"{plan.notes_skipped} note(s) already in their target would only be removed from the main notes file.")
+        box = QMessageBox(QMessageBox.Question, "Organize Preview", "\n".join(summary))
+        box.setDetailedText(plan.diff())
+        organize_button = box.addButton("Organize", QMessageBox.AcceptRole)
+        box.addButton(QMessageBox.Close)
+        box.exec_()
+        if box.clickedButton() is organize_button:
+            self.commit_preview(plan, mappings)
+
+    def cancel_organize(self):
+        self.organize_pending = False
+        self.cancel_api_waiters("organize") # Their follow-up run won't happen now
+        if self.organize_worker is not None:
+            self.organize_worker.cancel()
+
+    def on_organize_progress(self, notes_routed, notes_total):
+        self.set_tray_status(f"{notes_routed}/{notes_total} notes routed")
+
+    def on_organize_failed(self, error):
+        if isinstance(error, organizer_engine.OrganizeCancelled):
+            self.show_message("Note Organizer", error.message)
+        else:
+            QMessageBox.critical(None, error.title, error.message)
+
+    def on_organize_finished(self):
+        self.answer_api_waiters(self.organize_worker)
+        self.organize_worker.deleteLater()
+        self.organize_worker = None
+        if self.cancel_action:
+            self.cancel_action.setEnabled(False)
+        self.set_tray_status()
+        if self.preview_plan is not None:
+            plan, mappings = self.preview_plan
+            self.preview_plan = None
+            self.show_preview(plan, mappings)
+        # Waiting captures go first: they are small and their senders are blocked on them
+        if self.api_waiters["capture"] and not self.capture_timer.isActive() and self.organize_worker is None:
+            self.start_capture()
+        if self.organize_pending and self.organize_worker is None:
+            self.organize_notes(self.pending_quiet)
+        if self.api_waiters["dry-run"] and self.organize_worker is None:
+            self.start_api_preview()
+
+    # --- Watch mode ---
+
+    def set_watch_enabled(self, enabled):
+        self.watch_enabled = enabled
+        self.logger.event("watch_enabled" if enabled else "watch_disabled")
+        self.update_watch()
+
+    def update_watch(self):
+        if self.file_watcher is not None:
+            self.file_watcher.deleteLater()
+            self.file_watcher = None
+        self.watch_timer.stop()
+        if not self.watch_enabled or not self.last_notes_file:
+            return
+        self.file_watcher = QFileSystemWatcher()
+        if os.path.exists(self.last_notes_file):
+            self.file_watcher.addPath(self.last_notes_file)
+        # The directory is watched too, to notice the file coming back after an editor replaced it
+        notes_dir = os.path.dirname(os.path.abspath(self.last_notes_file))
+        if os.path.isdir(notes_dir):
+            self.file_watcher.addPath(notes_dir)
+        self.file_watcher.fileChanged.connect(self.on_notes_file_changed)
+        self.file_watcher.directoryChanged.connect(self.on_notes_dir_changed)
+
+    def on_notes_file_changed(self, path):
+        # Replacing saves (and our own rewrite) drop the path from the watcher; put it back
+        if path not in self.file_watcher.files() and os.path.exists(path):
+            self.file_watcher.addPath(path)
+        self.watch_timer.start() # Restarting the timer is the debounce
+
+    def on_notes_dir_changed(self, path):
+        if self.last_notes_file not in self.file_watcher.files() and os.path.exists(self.last_notes_file):
+            self.file_watcher.addPath(self.last_notes_file)
+            self.watch_timer.start()
+
+    def on_watch_timeout(self):
+        self.refresh_config()
+        if not os.path.exists(self.last_notes_file):
+            return
         try:
-            with open(LOG_FILE, "a", encoding="utf-8") as f:
-                f.write(log_entry)
-        except Exception as e:
-            # Avoid showing QMessageBox here as it could be frequent or from background tasks
-            print(f"Logging Error: Failed to write to log file {LOG_FILE}: {e}")
-
+            key = self.fingerprint_key_for(self.mappings)
+            previous = self.inbox_fingerprint if key == self.fingerprint_key else None
+            needed, fingerprint = organizer_watch.needs_organize(self.last_notes_file, previous, key[1], key[2])
+        except (OSError, header_matcher.MappingError):
+            needed, key, fingerprint = True, None, None # Let the real pass report the problem
+        if needed:
+            self.organize_notes(quiet=True)
+        else:
+            self.inbox_fingerprint, self.fingerprint_key = fingerprint, key
 
-    def organize_notes(self):
-        # self.save_config() # Config is saved by settings dialog on close, or loaded fresh
-        
-        # Ensure latest config is used if settings window wasn't opened / saved yet
-        # Or, if called when settings window is not open, current state of self.mappings/last_notes_file is used.
-        # This is fine as __init__ loads it, and settings dialog updates it then saves.
-        current_main_notes_file = self.last_notes_file
+    def fingerprint_key_for(self, mappings):
+        # Compiled matchers are cached, so unchanged mappings give the same objects; raises MappingError
+        return (self.last_notes_file, header_matcher.compile_mappings(mappings), body_matcher.compile_rules(mappings))
 
-        if not current_main_notes_file or not os.path.exists(current_main_notes_file):
-            QMessageBox.critical(None, "File Error", "Main notes file path is invalid or file does not exist.")
+    def remember_fingerprint(self, result):
+        try:
+            # The mappings this run actually used; they may have been edited since it started
+            key = self.fingerprint_key_for(self.organize_worker.mappings)
+        except header_matcher.MappingError:
+            key = None
+        fingerprint = result.fingerprints.get(self.last_notes_file)
+        if fingerprint is not None and key is not None:
+            self.inbox_fingerprint = fingerprint
+            self.fingerprint_key = key
+        else:
+            self.inbox_fingerprint = self.fingerprint_key = None
+
+    def report_result(self, result):
+        self.remember_fingerprint(result)
+        self.last_result = result.to_dict()
+        if result.duration_ms is not None:
+            self.last_run_summary = f"last run {result.duration_ms / 1000:.2f} s, {result.notes_moved} note(s)"
+            self.set_tray_status()
+        if self.organize_quiet and result.notes_moved == 0 and result.notes_skipped == 0:
             return
 
-        if not self.mappings:
-            if self.tray_icon:
-                self.tray_icon.showMessage("Note Organizer", "No header-to-file mappings defined. Nothing to organize.", QSystemTrayIcon.Information, 3000)
-            else: # Fallback if tray icon isn't initialized for some reason
-                QMessageBox.information(None, "No Mappings", "No header-to-file mappings defined. Nothing to organize.")
-            return
-        
-        try:
-            with open(current_main_notes_file, "r", encoding="utf-8") as f:
-                all_lines_from_file = f.readlines()
-        except Exception as e:
-            QMessageBox.critical(None, "File Read Error", f"Could not read main notes file: {e}")
+        if result.status == "no_mappings":
+            self.show_message("Note Organizer", "No header-to-file mappings defined. Nothing to organize.")
             return
 
-        remaining_lines_for_main_file = []
-        notes_to_move_by_target = collections.defaultdict(list)
-        notes_moved_count = 0
-
-        date_pattern = re.compile(r"^\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}$")
-        configured_headers_map = {}
-        for m in self.mappings:
-            header = m['header']
-            # Since we're storing individual mappings, header should be a string
-            configured_headers_map[header.lower()] = m['target_file']
-
-        idx = 0
-        while idx < len(all_lines_from_file):
-            current_line_text = all_lines_from_file[idx].rstrip('\r\n')
-            is_date_line = date_pattern.match(current_line_text)
-            actual_header_str = ""
-            num_header_lines_for_current_segment = 0
-            first_line_of_segment = all_lines_from_file[idx]
-
-            if is_date_line:
-                if idx + 1 < len(all_lines_from_file):
-                    actual_header_str = all_lines_from_file[idx+1].strip()
-                    num_header_lines_for_current_segment = 2
-                else:
-                    remaining_lines_for_main_file.append(first_line_of_segment)
-                    idx += 1
-                    continue
-            else:
-                actual_header_str = current_line_text
-                num_header_lines_for_current_segment = 1
-
-            if actual_header_str.lower() in configured_headers_map:
-                target_file = configured_headers_map[actual_header_str.lower()]
-                current_note_lines_accumulator = []
-                current_note_lines_accumulator.append(first_line_of_segment)
-                if is_date_line:
-                    current_note_lines_accumulator.append(all_lines_from_file[idx+1])
-
-                content_scan_idx = idx + num_header_lines_for_current_segment
-                while content_scan_idx < len(all_lines_from_file):
-                    line_being_scanned = all_lines_from_file[content_scan_idx]
-                    line_being_scanned_stripped = line_being_scanned.strip()
-                    if not line_being_scanned_stripped:
-                        idx = content_scan_idx + 1
-                        break
-                    scan_is_date = date_pattern.match(line_being_scanned_stripped)
-                    scan_actual_header = ""
-                    if scan_is_date:
-                        if content_scan_idx + 1 < len(all_lines_from_file):
-                            scan_actual_header = all_lines_from_file[content_scan_idx+1].strip()
-                    else:
-                        scan_actual_header = line_being_scanned_stripped
-                    if scan_actual_header.lower() in configured_headers_map: # Use .lower() here too
-                        idx = content_scan_idx
-                        break
-                    else:
-                        current_note_lines_accumulator.append(line_being_scanned)
-                        content_scan_idx += 1
-                        if content_scan_idx == len(all_lines_from_file):
-                            idx = content_scan_idx
-                            break
-                else:
-                    idx = content_scan_idx
-                
-                note_content_lines = current_note_lines_accumulator[num_header_lines_for_current_segment:]
-                actual_note_content_for_file = "".join(note_content_lines).strip()
-                new_timestamp_header = datetime.now().strftime("%Y-%m-%d %H:%M:%S") + " (auto)"
-                formatted_note_for_target = new_timestamp_header
-                if actual_note_content_for_file:
-                    formatted_note_for_target += os.linesep + actual_note_content_for_file
-                notes_to_move_by_target[target_file].append(formatted_note_for_target)
-                log_snippet_content = "".join(note_content_lines)
-                self.log_action(actual_header_str, log_snippet_content, current_main_notes_file, target_file)
-                notes_moved_count += 1
-            else:
-                remaining_lines_for_main_file.append(first_line_of_segment)
-                idx += 1
-        
-        updated_main_content = "".join(remaining_lines_for_main_file)
+        if result.notes_moved > 0 or result.notes_skipped > 0:
+            skipped = f" ({result.notes_skipped} already in their target, not written again)" if result.notes_skipped else ""
+            msg = (f"{result.notes_moved} note(s) moved{skipped}.\n"
+                   "Use 'Undo Last Run' to put them back.\n"
+                   f"Please check {organizer_log.LOG_FILE} for details.")
+            self.show_message("Organization Complete", msg, QSystemTrayIcon.Information, 5000)
+        else:
+            self.show_message("Organization Complete", "No notes matched the defined mappings for moving.")
+
+    # --- Local socket API (organizer_api) ---
+
+    def start_api(self):
+        path = organizer_api.socket_path(self.config_data)
+        if path is None:
+            return
+        server = organizer_api.ApiServer(path, self.submit_api_request)
         try:
-            backup_file_path = current_main_notes_file + ".bak"
-            if os.path.exists(backup_file_path):
-                 os.remove(backup_file_path)
-            if os.path.exists(current_main_notes_file):
-                os.rename(current_main_notes_file, backup_file_path)
-            with open(current_main_notes_file, "w", encoding="utf-8") as f:
-                f.write(updated_main_content)
-        except Exception as e:
-            QMessageBox.critical(None, "File Update Error", f"Could not update main notes file: {e}")
-            if os.path.exists(backup_file_path) and not os.path.exists(current_main_notes_file):
-                try:
-                    os.rename(backup_file_path, current_main_notes_file)
-                    if self.tray_icon:
-                        self.tray_icon.showMessage("Note Organizer", "Attempted to restore original file from backup.", QSystemTrayIcon.Information, 3000)
-                    else:
-                        QMessageBox.information(None, "Restore", "Attempted to restore original file from backup.")
-                except Exception as restore_error:
-                    QMessageBox.critical(None, "Restore Error", f"Could not restore original file: {restore_error}")
+            server.start()
+        except organizer_engine.OrganizerError as e:
+            print(f"API ERROR: {e.message}")
+            self.logger.event("error", message=e.message)
             return
-
-        for target_file, notes_list in notes_to_move_by_target.items():
-            if not notes_list:
-                continue
-            target_dir = os.path.dirname(target_file)
-            if target_dir and not os.path.exists(target_dir):
-                os.makedirs(target_dir, exist_ok=True)
-            existing_content = ""
-            if os.path.exists(target_file):
-                try:
-                    with open(target_file, "r", encoding="utf-8") as tf_read:
-                        existing_content = tf_read.read()
-                except Exception as e:
-                    err_msg = f"Could not read existing target file {target_file}: {e}"
-                    if self.tray_icon:
-                        self.tray_icon.showMessage("Target Read Error", err_msg, QSystemTrayIcon.Warning, 5000)
-                    else:
-                        QMessageBox.warning(None, "Target Read Error", err_msg)
-                    self.log_action("ERROR_TARGET_READ", err_msg, current_main_notes_file, target_file)
-                    continue
-            new_notes_block = (os.linesep + os.linesep).join(notes_list)
-            final_content = new_notes_block
-            if existing_content.strip():
-                final_content += os.linesep + os.linesep + existing_content.strip()
+        self.api_server = server
+
+    def stop_api(self):
+        self.capture_timer.stop()
+        if self.api_waiters["capture"]:
+            # Write them here and now rather than drop notes that were already accepted
+            worker = self.capture_worker()
+            worker.run()
+            self.answer_api_waiters(worker)
+        for kind in self.api_waiters:
+            self.cancel_api_waiters(kind)
+        if self.api_server is not None:
+            self.api_server.stop()
+            self.api_server = None
+
+    def submit_api_request(self, command, request):
+        # Called on the API server's thread; on_api_request answers through the future on the GUI thread
+        future = concurrent.futures.Future()
+        self.api_bridge.requested.emit(command, request, future)
+        return future
+
+    def on_api_request(self, command, request, future):
+        if command != "status": # Status may be polled; don't fill the log with it
+            self.logger.event("api_request", command=command)
+        if command == "status":
+            future.set_result(self.api_status())
+        elif command == "reload-config":
+            if self.settings_dialog_instance is not None and self.settings_dialog_instance.isVisible():
+                future.set_result({"status": "deferred",
+                                   "message": "The settings window is open; config.json is merged when it closes."})
             else:
-                 final_content = new_notes_block.strip()
+                future.set_result({"status": "ok", "reloaded": self.refresh_config(), "mappings": len(self.mappings)})
+        elif command == "organize":
+            # Joins the next run to start: a run already in progress may have read the notes file too early
+            self.api_waiters["organize"].append((future, None))
+            self.organize_notes(quiet=True)
+        elif command == "capture":
             try:
-                with open(target_file, "w", encoding="utf-8") as tf_write:
-                    tf_write.write(final_content + os.linesep)
-            except Exception as e:
-                err_msg = f"Could not write to target file {target_file}: {e}"
-                if self.tray_icon:
-                    self.tray_icon.showMessage("Target Write Error", err_msg, QSystemTrayIcon.Warning, 5000)
-                else:
-                    QMessageBox.warning(None, "Target Write Error", err_msg)
-                self.log_action("ERROR_TARGET_WRITE", err_msg, current_main_notes_file, target_file)
-
-        if notes_moved_count > 0:
-            msg = (f"{notes_moved_count} note(s) moved.\n"
-                   f"Original file backed up to: {current_main_notes_file + '.bak'}\n"
-                   f"Please check {LOG_FILE} for details.")
-            if self.tray_icon:
-                self.tray_icon.showMessage("Organization Complete", msg, QSystemTrayIcon.Information, 5000)
-            else:
-                QMessageBox.information(None, "Organization Complete", msg)
+                notes = organizer_engine.captured_notes(request["notes"] if "notes" in request else [request])
+            except organizer_engine.OrganizerError as e:
+                future.set_result(organizer_api.error_response(e))
+                return
+            self.api_waiters["capture"].append((future, notes))
+            if not self.capture_timer.isActive():
+                self.capture_timer.start()
         else:
-            msg = "No notes matched the defined mappings for moving."
-            if self.tray_icon:
-                self.tray_icon.showMessage("Organization Complete", msg, QSystemTrayIcon.Information, 3000)
+            self.api_waiters["dry-run"].append((future, bool(request.get("diff"))))
+            if self.organize_worker is None:
+                self.start_api_preview()
+
+    def on_capture_timeout(self):
+        if self.organize_worker is None:
+            self.start_capture() # Otherwise on_organize_finished starts it
+
+    def capture_worker(self):
+        waiters, self.api_waiters["capture"] = self.api_waiters["capture"], []
+        worker = OrganizeWorker(self.last_notes_file, (), self.mappings, self.logger, self.journal, self.q_app,
+                                capture=[note for _, notes in waiters for note in notes], dedup=self.dedup)
+        worker.api_waiters = waiters
+        return worker
+
+    def start_capture(self):
+        self.refresh_config()
+        self.start_worker(self.capture_worker(), "Capturing...")
+
+    def start_api_preview(self):
+        self.refresh_config()
+        worker = OrganizeWorker(self.last_notes_file, self.config_data.get("notes_files", []),
+                                self.mappings, self.logger, self.journal, self.q_app, preview=True, dedup=self.dedup)
+        worker.api_waiters, self.api_waiters["dry-run"] = self.api_waiters["dry-run"], []
+        self.start_worker(worker, "Previewing...")
+
+    def api_status(self):
+        worker = self.organize_worker
+        return {"status": "ok",
+                "running": worker.kind() if worker is not None else None,
+                "organize_pending": self.organize_pending,
+                "watch_enabled": self.watch_enabled,
+                "last_notes_file": self.last_notes_file,
+                "mappings": len(self.mappings),
+                "last_run": self.last_result}
+
+    def answer_api_waiters(self, worker):
+        for future, extra in worker.api_waiters:
+            if worker.error is not None:
+                response = organizer_api.error_response(worker.error)
             else:
-                QMessageBox.information(None, "Organization Complete", msg)
+                response = worker.result.to_dict()
+                if worker.capture is not None:
+                    response["notes_captured"] = len(extra)
+                elif extra:
+                    response["diff"] = worker.result.diff()
+            future.set_result(response)
+        worker.api_waiters = []
+
+    def cancel_api_waiters(self, kind):
+        for future, _ in self.api_waiters[kind]:
+            future.set_result(organizer_api.error_response(organizer_engine.OrganizeCancelled()))
+        self.api_waiters[kind] = []
 
 
 def main():
     # QApplication instance is managed by NoteOrganizerAppLogic
-    app_logic = NoteOrganizerAppLogic()
+    app_logic = NoteOrganizerAppLogic(StartupTimer(report_only=STARTUP_TIMING_FLAG in sys.argv[1:]))
     app_logic.start_tray_app()
 
 
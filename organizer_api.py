@@ -0,0 +1,193 @@
+"""Local control API: newline-delimited JSON over a Unix-domain socket.
+
+The tray app serves it so hotkey daemons, sync hooks and git hooks can start or
+query runs without starting an interpreter and Qt of their own. Each request is
+one JSON object on one line and gets one line back:
+
+    {"command": "organize"}       run a pass; requests made while one is pending share it
+    {"command": "dry-run"}        what a pass would move ("diff": true adds the diff)
+    {"command": "status"}         what the app is doing and how its last pass went
+    {"command": "reload-config"}  re-read config.json now
+    {"command": "capture", "header": "Todo", "body": "..."}
+                                  route a note straight to its target file; "notes": [{"header": ..., "body": ...}, ...]
+                                  sends several. Captures arriving within capture_window_ms share one write per target
+
+Responses are the JSON the CLI prints for the same operation; failures are
+{"status": "error", "error": title, "message": text}. An "id" in a request is
+echoed back in its response.
+
+    printf '{"command": "organize"}\\n' | socat - UNIX-CONNECT:organizer.sock
+"""
+import asyncio
+import json
+import os
+import socket
+import stat
+import threading
+
+import organizer_io
+from organizer_engine import OrganizerError
+
+SOCKET_FILE = "organizer.sock"
+COMMANDS = ("organize", "dry-run", "status", "reload-config", "capture")
+MAX_REQUEST_BYTES = 1024 * 1024
+DEFAULT_CAPTURE_WINDOW_MS = 100
+STOP_TIMEOUT_S = 5
+
+
+def _options(config_data):
+    # Optional "api" section: {"enabled": true, "socket": "organizer.sock", "capture_window_ms": 100}
+    options = config_data.get("api", {})
+    return options if isinstance(options, dict) else {}
+
+
+def socket_path(config_data):
+    options = _options(config_data)
+    if not options.get("enabled", True):
+        return None
+    return options.get("socket") or SOCKET_FILE
+
+
+def capture_window_ms(config_data):
+    return int(_options(config_data).get("capture_window_ms", DEFAULT_CAPTURE_WINDOW_MS))
+
+
+def error_response(error):
+    return {"status": "error", "error": error.title, "message": error.message}
+
+
+def _remove_stale_socket(path):
+    try:
+        mode = os.lstat(path).st_mode
+    except FileNotFoundError:
+        return
+    if not stat.S_ISSOCK(mode):
+        raise OrganizerError("API Error", f"{path} exists and is not a socket.")
+    probe = socket.socket(socket.AF_UNIX)
+    try:
+        probe.connect(path)
+    except ConnectionRefusedError: # Left behind by an app that didn't shut down cleanly
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+    else:
+        raise OrganizerError("API Error", f"Another organizer is already listening on {path}.")
+    finally:
+        probe.close()
+
+
+class ApiServer:
+    """Serves the API from an asyncio event loop on its own thread.
+
+    submit(command, request) is called on that thread and must return a
+    concurrent.futures.Future that resolves to the response dict; the app resolves
+    it from the GUI thread once it has an answer.
+    """
+
+    def __init__(self, path, submit):
+        self.path = path
+        self.submit = submit
+        self._loop = None
+        self._stopped = None # asyncio.Event, set from stop()
+        self._connections = set() # Handler tasks, cancelled on stop so idle clients can't hold it up
+        self._thread = None
+        self._ready = threading.Event()
+        self._error = None
+
+    def start(self):
+        """Start listening; raises OrganizerError if the socket can't be set up."""
+        self._thread = threading.Thread(target=self._run, name="organizer-api", daemon=True)
+        self._thread.start()
+        self._ready.wait()
+        if self._error is not None:
+            raise self._error
+
+    def stop(self):
+        if self._thread is None or not self._thread.is_alive():
+            return
+        self._loop.call_soon_threadsafe(self._stopped.set)
+        self._thread.join(STOP_TIMEOUT_S)
+
+    def _run(self):
+        loop = asyncio.new_event_loop()
+        try:
+            loop.run_until_complete(self._serve())
+        finally:
+            loop.close()
+
+    async def _serve(self):
+        self._loop = asyncio.get_running_loop()
+        self._stopped = asyncio.Event()
+        try:
+            _remove_stale_socket(self.path)
+            server = await asyncio.start_unix_server(self._handle, path=self.path, limit=MAX_REQUEST_BYTES)
+            os.chmod(self.path, 0o600) # Only this user may trigger runs
+        except OrganizerError as e:
+            self._error = e
+        except OSError as e:
+            self._error = OrganizerError("API Error", f"Could not listen on {self.path}: {e}")
+        self._ready.set()
+        if self._error is not None:
+            return
+        try:
+            await self._stopped.wait()
+            server.close()
+            connections = list(self._connections)
+            for task in connections:
+                task.cancel()
+            await asyncio.gather(*connections, return_exceptions=True)
+            await server.wait_closed()
+        finally:
+            organizer_io.remove_quietly(self.path)
+
+    async def _handle(self, reader, writer):
+        task = asyncio.current_task()
+        self._connections.add(task)
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except ValueError: # Longer than MAX_REQUEST_BYTES
+                    await self._send(writer, error_response(OrganizerError("Bad Request", "Request is too long.")))
+                    break
+                if not line:
+                    break
+                if line.strip():
+                    await self._send(writer, await self._respond(line))
+        except (ConnectionError, asyncio.CancelledError): # Client went away, or the server is stopping
+            pass
+        finally:
+            self._connections.discard(task)
+            writer.close()
+
+    async def _send(self, writer, response):
+        writer.write(json.dumps(response).encode("utf-8") + b"\n")
+        await writer.drain()
+
+    async def _respond(self, line):
+        try:
+            request = json.loads(line)
+        except ValueError:
+            return error_response(OrganizerError("Bad Request", "Request is not valid JSON."))
+        if not isinstance(request, dict) or request.get("command") not in COMMANDS:
+            return error_response(OrganizerError("Bad Request", f"Unknown command; expected one of: {', '.join(COMMANDS)}."))
+        try:
+            response = await asyncio.wrap_future(self.submit(request["command"], request))
+        except Exception as e: # Never let one request take the server down
+            response = error_response(OrganizerError("API Error", f"Unexpected error: {e}"))
+        if "id" in request:
+            response = dict(response, id=request["id"])
+        return response
+
+
+def request(command, path=SOCKET_FILE, timeout=None, **fields):
+    """Send one request to the running app and return its response."""
+    with socket.socket(socket.AF_UNIX) as sock:
+        sock.settimeout(timeout)
+        sock.connect(path)
+        sock.sendall(json.dumps(dict(fields, command=command)).encode("utf-8") + b"\n")
+        with sock.makefile("rb") as f:
+            line = f.readline()
+    if not line:
+        raise OrganizerError("API Error", "The organizer closed the connection without answering.")
+    return json.loads(line)
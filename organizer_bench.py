@@ -0,0 +1,233 @@
+"""Benchmark an organize pass against a synthetic inbox and vault.
+
+    python -m organizer_bench --notes 20000 --mappings 500 --target-size 1000000 --out before.json
+    python -m organizer_bench --notes 20000 --mappings 500 --target-size 1000000 --compare before.json
+
+Every repetition generates a fresh vault in a temporary directory (an organize pass
+changes it), runs the pass headlessly and records wall time, peak RSS and, per
+phase, the time spent and bytes read/written by this process (from /proc/self/io
+where available), plus the engine's own finer phase timings (organizer_metrics).
+The JSON report keeps every repetition plus the median.
+"""
+import argparse
+import contextlib
+import json
+import os
+import platform
+import random
+import resource
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import organizer_engine
+from organizer_journal import UndoJournal
+from organizer_log import RunLogger
+
+WORDS = ("idea note todo draft juggling pattern prompt movie story music habit research "
+         "remember buy read watch project script memo sketch thought").split()
+PHASES = ("scan_sources", "write_kept", "write_targets", "replace_main_file")
+
+
+# --- Synthetic vault ---
+
+def _body(rng, min_lines=1, max_lines=5):
+    return "\n".join(" ".join(rng.choice(WORDS) for _ in range(rng.randint(3, 12)))
+                     for _ in range(rng.randint(min_lines, max_lines)))
+
+
+def generate_vault(root, notes=1000, mappings=50, date_ratio=0.5, unmatched_ratio=0.2,
+                   target_size=0, sources=1, seed=0):
+    """Create sources, target files and a config under root; returns the config dict.
+
+    date_ratio is the share of notes with a date line above the header,
+    unmatched_ratio the share whose header has no mapping (they stay put), and
+    target_size the number of bytes each target file starts with.
+    """
+    rng = random.Random(seed)
+    vault_dir = os.path.join(root, "vault")
+    os.makedirs(vault_dir, exist_ok=True)
+
+    config_mappings = []
+    for i in range(mappings):
+        target_file = os.path.join(vault_dir, f"Topic{i}.md")
+        config_mappings.append({"header": f"Topic{i}", "target_file": target_file})
+        with open(target_file, "w", encoding="utf-8") as f:
+            written = 0
+            while written < target_size:
+                written += f.write(f"2024-01-01 00:00:00 (auto)\n{_body(rng)}\n\n")
+
+    source_files = [os.path.join(root, "Inbox.md" if i == 0 else f"Inbox{i}.md") for i in range(max(1, sources))]
+    handles = [open(path, "w", encoding="utf-8") for path in source_files]
+    try:
+        for n in range(notes):
+            f = handles[n % len(handles)]
+            if rng.random() < date_ratio:
+                f.write(f"2025-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d} "
+                        f"{rng.randint(0, 23):02d}:{rng.randint(0, 59):02d}:{rng.randint(0, 59):02d}\n")
+            if mappings and rng.random() >= unmatched_ratio:
+                f.write(f"Topic{rng.randrange(mappings)}\n")
+            else:
+                f.write(f"Loose{rng.randrange(1000)}\n")
+            f.write(_body(rng) + "\n\n")
+    finally:
+        for f in handles:
+            f.close()
+
+    return {"mappings": config_mappings, "last_notes_file": source_files[0], "notes_files": source_files[1:]}
+
+
+# --- Measurement ---
+
+def _io_counters():
+    # rchar/wchar count bytes passed through read/write syscalls, page cache or not
+    try:
+        with open("/proc/self/io", "r") as f:
+            fields = dict(line.split(":", 1) for line in f)
+        return int(fields["rchar"]), int(fields["wchar"])
+    except (OSError, KeyError, ValueError):
+        return 0, 0
+
+
+def _peak_rss_kb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    if sys.platform == "darwin": # Reported in bytes there, kilobytes elsewhere
+        peak, children = peak // 1024, children // 1024
+    return max(peak, children)
+
+
+@contextlib.contextmanager
+def timed_phases(phases):
+    """Wrap the engine's phase functions so each call adds its time and I/O to phases."""
+    originals = {name: getattr(organizer_engine, name) for name in PHASES}
+
+    def wrap(name, func):
+        def timed(*args, **kwargs):
+            read_before, written_before = _io_counters()
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                read_after, written_after = _io_counters()
+                phase = phases.setdefault(name, {"ms": 0.0, "calls": 0, "bytes_read": 0, "bytes_written": 0})
+                phase["ms"] += (time.perf_counter() - started) * 1000
+                phase["calls"] += 1
+                phase["bytes_read"] += read_after - read_before
+                phase["bytes_written"] += written_after - written_before
+        return timed
+
+    for name, func in originals.items():
+        setattr(organizer_engine, name, wrap(name, func))
+    try:
+        yield phases
+    finally:
+        for name, func in originals.items():
+            setattr(organizer_engine, name, func)
+
+
+def run_once(params, seed):
+    with tempfile.TemporaryDirectory(prefix="organizer_bench_") as root:
+        generate_started = time.perf_counter()
+        config_data = generate_vault(root, seed=seed, **params)
+        generate_ms = (time.perf_counter() - generate_started) * 1000
+        sources = organizer_engine.config_sources(config_data)
+        logger = RunLogger(os.path.join(root, "organizer.log"))
+
+        phases = {}
+        with timed_phases(phases):
+            started = time.perf_counter()
+            result = organizer_engine.organize_notes(sources, config_data["mappings"], logger=logger,
+                                                     journal=UndoJournal(os.path.join(root, "organizer_journal.jsonl")))
+            wall_ms = (time.perf_counter() - started) * 1000
+        logger.close()
+
+        return {
+            "seed": seed,
+            "generate_ms": round(generate_ms, 3),
+            "wall_ms": round(wall_ms, 3),
+            "peak_rss_kb": _peak_rss_kb(),
+            "phases": {name: {k: round(v, 3) if isinstance(v, float) else v for k, v in phase.items()}
+                       for name, phase in phases.items()},
+            "engine_phases": result.phases.to_dict(),
+            "notes_moved": result.notes_moved,
+            "bytes_read": result.bytes_read,
+            "bytes_written": result.bytes_written,
+        }
+
+
+def run_benchmark(params, repeat=3, seed=0):
+    runs = [run_once(params, seed + i) for i in range(repeat)]
+    return {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "params": params,
+        "repeat": repeat,
+        "median_wall_ms": round(statistics.median(run["wall_ms"] for run in runs), 3),
+        "median_phase_ms": {name: round(statistics.median(run["phases"].get(name, {}).get("ms", 0.0) for run in runs), 3)
+                            for name in PHASES},
+        "peak_rss_kb": max(run["peak_rss_kb"] for run in runs),
+        "runs": runs,
+    }
+
+
+def compare(current, baseline):
+    lines = []
+
+    def row(label, new, old):
+        change = f"{(new - old) / old * 100:+.1f}%" if old else "n/a"
+        lines.append(f"{label:<28}{old:>14.3f}{new:>14.3f}{change:>10}")
+
+    lines.append(f"{'metric':<28}{'baseline':>14}{'current':>14}{'change':>10}")
+    row("median_wall_ms", current["median_wall_ms"], baseline["median_wall_ms"])
+    for name in PHASES:
+        row(f"{name}_ms", current["median_phase_ms"].get(name, 0.0), baseline.get("median_phase_ms", {}).get(name, 0.0))
+    row("peak_rss_kb", current["peak_rss_kb"], baseline["peak_rss_kb"])
+    if current["params"] != baseline.get("params"):
+        lines.append("warning: benchmark parameters differ from the baseline")
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="organizer_bench", description="Benchmark an organize pass on a synthetic vault")
+    parser.add_argument("--notes", type=int, default=1000, help="notes in the generated inbox")
+    parser.add_argument("--mappings", type=int, default=50, help="header mappings (one target file each)")
+    parser.add_argument("--date-ratio", type=float, default=0.5, help="share of notes with a date line before the header")
+    parser.add_argument("--unmatched-ratio", type=float, default=0.2, help="share of notes with an unmapped header")
+    parser.add_argument("--target-size", type=int, default=0, help="initial size of each target file in bytes")
+    parser.add_argument("--sources", type=int, default=1, help="spread the notes over this many main notes files")
+    parser.add_argument("--repeat", type=int, default=3, help="repetitions; the median is reported")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", help="write the JSON report here instead of stdout")
+    parser.add_argument("--compare", help="earlier JSON report to compare against")
+    args = parser.parse_args(argv)
+
+    params = {
+        "notes": args.notes,
+        "mappings": args.mappings,
+        "date_ratio": args.date_ratio,
+        "unmatched_ratio": args.unmatched_ratio,
+        "target_size": args.target_size,
+        "sources": args.sources,
+    }
+    report = run_benchmark(params, repeat=max(1, args.repeat), seed=args.seed)
+
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        sys.stdout.write("\n")
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            print(compare(report, json.load(f)), file=sys.stderr)
+    organizer_engine.shutdown_scan_pool()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,218 @@
+"""Command-line front end for the organizer engine.
+
+    python -m organizer_cli [--config config.json] organize [--notes-file Inbox.md ...]
+    python -m organizer_cli [--config config.json] preview [--notes-file Inbox.md ...] [--diff]
+    python -m organizer_cli [--config config.json] undo
+    python -m organizer_cli [--config config.json] capture HEADER [BODY] | capture --jsonl < notes.jsonl
+    python -m organizer_cli history [--text words] [--header H] [--target path] [--since DATE] [--until DATE]
+    python -m organizer_cli --profile organize.prof organize
+    python -m organizer_cli api {organize,dry-run,status,reload-config} [--socket organizer.sock] [--diff]
+
+Prints a JSON summary of the run (or of what a run would do) on stdout and exits
+non-zero on failure. `api` sends the command to the running tray app instead
+(see organizer_api) and prints its response.
+"""
+import argparse
+import cProfile
+import json
+import sys
+import time
+
+import organizer_api
+import organizer_engine
+from organizer_dedup import DEDUP_FILE, DedupIndex
+from organizer_engine import OrganizerError
+from organizer_history import DEFAULT_LIMIT, HISTORY_FILE, MoveHistory
+from organizer_journal import JOURNAL_FILE, UndoJournal
+from organizer_log import LOG_FILE, RunLogger
+
+
+def print_json(data):
+    json.dump(data, sys.stdout, indent=2)
+    sys.stdout.write("\n")
+
+
+def _load(args):
+    config_data = organizer_engine.load_config(args.config, report_error=lambda msg: print(f"CONFIG ERROR: {msg}", file=sys.stderr))
+    if args.notes_file:
+        notes_files = organizer_engine.resolve_sources("", args.notes_file, config_data["mappings"])
+    else:
+        notes_files = organizer_engine.config_sources(config_data)
+    return config_data, notes_files
+
+
+def cmd_organize(args):
+    config_data, notes_files = _load(args)
+    logger = RunLogger.from_config(config_data, args.log_file, history=MoveHistory(args.history_file))
+    journal = UndoJournal.from_config(config_data, args.journal_file)
+    dedup = DedupIndex.from_config(config_data, args.dedup_file)
+    try:
+        result = organizer_engine.organize_notes(notes_files, config_data["mappings"], logger=logger, journal=journal,
+                                                 dedup=dedup)
+    except OrganizerError as e:
+        print_json({"status": "error", "error": e.title, "message": e.message, "notes_files": notes_files})
+        return 1
+    finally:
+        logger.close()
+        if dedup is not None:
+            dedup.close()
+    print_json(result.to_dict())
+    return 0
+
+
+def cmd_preview(args):
+    config_data, notes_files = _load(args)
+    dedup = DedupIndex.from_config(config_data, args.dedup_file)
+    try:
+        plan = organizer_engine.plan_organize(notes_files, config_data["mappings"], dedup=dedup)
+    except OrganizerError as e:
+        print_json({"status": "error", "error": e.title, "message": e.message, "notes_files": notes_files})
+        return 1
+    finally:
+        if dedup is not None:
+            dedup.close()
+    summary = plan.to_dict()
+    if args.diff:
+        summary["diff"] = plan.diff()
+    print_json(summary)
+    return 0
+
+
+def cmd_undo(args):
+    config_data = organizer_engine.load_config(args.config, report_error=lambda msg: print(f"CONFIG ERROR: {msg}", file=sys.stderr))
+    logger = RunLogger.from_config(config_data, args.log_file, history=MoveHistory(args.history_file))
+    try:
+        undone = organizer_engine.undo_last_run(UndoJournal.from_config(config_data, args.journal_file), logger)
+    except OrganizerError as e:
+        print_json({"status": "error", "error": e.title, "message": e.message})
+        return 1
+    finally:
+        logger.close()
+    print_json({"status": "ok", "run_id": undone.run_id, "notes_restored": undone.notes_restored,
+                "notes_files": undone.notes_files, "target_files": undone.target_files})
+    return 0
+
+
+def cmd_capture(args):
+    config_data = organizer_engine.load_config(args.config, report_error=lambda msg: print(f"CONFIG ERROR: {msg}", file=sys.stderr))
+    try:
+        if args.jsonl:
+            notes = [json.loads(line) for line in sys.stdin if line.strip()]
+        elif args.header is None:
+            raise OrganizerError("Capture Error", "Give a HEADER, or --jsonl with notes on stdin.")
+        else:
+            notes = [(args.header, sys.stdin.read() if args.body is None else args.body)]
+        notes = organizer_engine.captured_notes(notes)
+    except ValueError as e:
+        print_json({"status": "error", "error": "Capture Error", "message": f"Invalid JSON on stdin: {e}"})
+        return 1
+    except OrganizerError as e:
+        print_json({"status": "error", "error": e.title, "message": e.message})
+        return 1
+    logger = RunLogger.from_config(config_data, args.log_file, history=MoveHistory(args.history_file))
+    dedup = DedupIndex.from_config(config_data, args.dedup_file)
+    try:
+        result = organizer_engine.ingest_notes(notes, config_data["mappings"], config_data["last_notes_file"],
+                                               logger=logger, dedup=dedup)
+    except OrganizerError as e:
+        print_json({"status": "error", "error": e.title, "message": e.message})
+        return 1
+    finally:
+        logger.close()
+        if dedup is not None:
+            dedup.close()
+    print_json(result.to_dict())
+    return 0
+
+
+def cmd_history(args):
+    history = MoveHistory(args.history_file)
+    started = time.perf_counter()
+    results = history.search(text=args.text, header=args.header, target=args.target,
+                             since=args.since, until=args.until, limit=args.limit)
+    print_json({"query_ms": round((time.perf_counter() - started) * 1000, 3), "results": results})
+    return 0
+
+
+def cmd_api(args):
+    fields = {"diff": True} if args.diff else {}
+    try:
+        response = organizer_api.request(args.api_command, args.socket, **fields)
+    except (FileNotFoundError, ConnectionRefusedError):
+        print_json({"status": "error", "error": "Organizer Not Running", "message": f"Nothing is listening on {args.socket}."})
+        return 1
+    except (OSError, OrganizerError) as e:
+        print_json({"status": "error", "error": "API Error", "message": str(e)})
+        return 1
+    print_json(response)
+    return 1 if response.get("status") == "error" else 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="organizer_cli", description="Obsidian inbox organizer (headless)")
+    parser.add_argument("--config", default=organizer_engine.CONFIG_FILE, help="path to config.json")
+    parser.add_argument("--log-file", default=LOG_FILE, help="path to the JSON Lines activity log")
+    parser.add_argument("--journal-file", default=JOURNAL_FILE, help="path to the undo journal")
+    parser.add_argument("--history-file", default=HISTORY_FILE, help="path to the SQLite move history")
+    parser.add_argument("--dedup-file", default=DEDUP_FILE, help="path to the SQLite index of notes already in each target")
+    parser.add_argument("--profile", metavar="FILE",
+                        help="run the command under cProfile and write the stats to FILE (pstats format; "
+                             "scans of several main files run in worker processes and are not included)")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    organize_parser = subparsers.add_parser("organize", help="run one organize pass and exit")
+    organize_parser.add_argument("--notes-file", action="append",
+                                 help="main notes file or glob pattern; repeatable "
+                                      "(defaults to last_notes_file and notes_files from the config)")
+    organize_parser.set_defaults(func=cmd_organize)
+
+    preview_parser = subparsers.add_parser("preview", help="show what an organize pass would move, without changing any file")
+    preview_parser.add_argument("--notes-file", action="append",
+                                help="main notes file or glob pattern; repeatable "
+                                     "(defaults to last_notes_file and notes_files from the config)")
+    preview_parser.add_argument("--diff", action="store_true", help="include a diff of the lines each file would lose or gain")
+    preview_parser.set_defaults(func=cmd_preview)
+
+    undo_parser = subparsers.add_parser("undo", help="reverse the most recent organize pass that has not been undone")
+    undo_parser.set_defaults(func=cmd_undo)
+
+    capture_parser = subparsers.add_parser("capture", help="route new notes straight to their target files, "
+                                                           "without going through the main notes file")
+    capture_parser.add_argument("header", nargs="?", help="the note's header")
+    capture_parser.add_argument("body", nargs="?", help="the note's text (read from stdin if omitted)")
+    capture_parser.add_argument("--jsonl", action="store_true",
+                                help='read notes from stdin, one {"header": ..., "body": ...} object per line')
+    capture_parser.set_defaults(func=cmd_capture)
+
+    history_parser = subparsers.add_parser("history", help="search the notes moved so far, newest first")
+    history_parser.add_argument("--text", help="words in the note or its header (prefix match)")
+    history_parser.add_argument("--header", help="original header, ignoring case")
+    history_parser.add_argument("--target", help="target file path or glob pattern")
+    history_parser.add_argument("--since", help="ISO date or timestamp")
+    history_parser.add_argument("--until", help="ISO date (inclusive) or timestamp")
+    history_parser.add_argument("--limit", type=int, default=DEFAULT_LIMIT)
+    history_parser.set_defaults(func=cmd_history)
+
+    api_parser = subparsers.add_parser("api", help="send a command to the running tray app over its local socket")
+    api_parser.add_argument("api_command", choices=organizer_api.COMMANDS)
+    api_parser.add_argument("--socket", default=organizer_api.SOCKET_FILE, help="path to the app's API socket")
+    api_parser.add_argument("--diff", action="store_true", help="with dry-run, include the diff")
+    api_parser.set_defaults(func=cmd_api)
+
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if not args.profile:
+        return args.func(args)
+    profiler = cProfile.Profile()
+    try:
+        return profiler.runcall(args.func, args)
+    finally:
+        profiler.dump_stats(args.profile)
+        print(f"Profile written to {args.profile}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
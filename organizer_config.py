@@ -0,0 +1,167 @@
+"""config.json access shared by the tray app, the CLI and scripts that generate mappings.
+
+ConfigStore keeps the parsed, validated config in memory and only re-reads the
+file when its inode, mtime or size changes. Saving takes an advisory lock, merges
+in whatever another process wrote since the last load (sections this process did
+not change keep the other process's version; mappings edited on both sides are
+merged by header), skips the write when nothing differs, and replaces the file
+atomically.
+
+A script can edit the config safely while the app runs:
+
+    store = ConfigStore("config.json")
+    with store.editing() as config_data:
+        config_data["mappings"].append({"header": "Recipes", "target_file": "notes/recipes.md"})
+"""
+import contextlib
+import copy
+import json
+import os
+
+import organizer_engine
+from organizer_engine import CONFIG_FILE
+
+try:
+    import fcntl
+except ImportError: # Not on Windows; saves are still atomic, just not serialized between processes
+    fcntl = None
+
+
+def _signature(stat_result):
+    return (stat_result.st_ino, stat_result.st_mtime_ns, stat_result.st_size)
+
+
+def merge_mappings(base, ours, theirs):
+    """Three-way merge of two edited mapping lists, matching mappings by header.
+
+    Keeps our order and edits, drops mappings they removed and we left alone, takes
+    their edits to mappings we left alone, and appends mappings only they added.
+    """
+    base_by_header = {m.get("header"): m for m in base}
+    theirs_by_header = {m.get("header"): m for m in theirs}
+    merged = []
+    for mapping in ours:
+        header = mapping.get("header")
+        if header in base_by_header and mapping == base_by_header[header]:
+            if header not in theirs_by_header:
+                continue
+            mapping = theirs_by_header[header]
+        merged.append(mapping)
+    ours_headers = {m.get("header") for m in ours}
+    merged.extend(m for m in theirs if m.get("header") not in base_by_header and m.get("header") not in ours_headers)
+    return merged
+
+
+class ConfigStore:
+    def __init__(self, path=CONFIG_FILE, report_error=print):
+        self.path = path
+        self.report_error = report_error
+        self.data = None # Validated config as last loaded or saved
+        self.version = 0 # Bumped whenever data is replaced
+        self._base = None # Separate copy of data, to tell which sections the caller changed
+        self._signature = None # (inode, mtime_ns, size) of the file data came from; None if it was missing
+        self._lock_depth = 0 # flock isn't re-entrant across file handles, so nested locked() calls share one
+
+    # --- Loading ---
+
+    def _stat(self):
+        try:
+            return _signature(os.stat(self.path))
+        except FileNotFoundError:
+            return None
+
+    def changed(self):
+        """True if config.json was written (or removed) since it was last loaded or saved here."""
+        return self.data is None or self._stat() != self._signature
+
+    def load(self):
+        """Return the config, re-reading config.json only if it changed on disk."""
+        if self.changed():
+            self._set(*self._read())
+        return self.data
+
+    def _read(self):
+        # Returns (validated config, signature); the signature comes from the handle that was read
+        try:
+            f = open(self.path, "r", encoding="utf-8")
+        except FileNotFoundError:
+            return organizer_engine.default_config(), None
+        except OSError as e:
+            self.report_error(f"Could not load {self.path}: {e}. Using default configuration.")
+            return organizer_engine.default_config(), None
+        with f:
+            signature = _signature(os.fstat(f.fileno()))
+            try:
+                config_data = json.load(f)
+            except ValueError:
+                self.report_error(f"Could not decode {self.path}. Using default configuration.")
+                return organizer_engine.default_config(), signature
+        return organizer_engine.validate_config(config_data, self.path, self.report_error), signature
+
+    def _set(self, config_data, signature):
+        self.data = config_data
+        self._base = copy.deepcopy(config_data)
+        self._signature = signature
+        self.version += 1
+
+    # --- Saving ---
+
+    @contextlib.contextmanager
+    def locked(self):
+        """Hold the advisory lock that serializes config writers (a .lock file next to config.json)."""
+        if fcntl is None or self._lock_depth:
+            self._lock_depth += 1
+            try:
+                yield
+            finally:
+                self._lock_depth -= 1
+            return
+        with open(self.path + ".lock", "a") as lock_file:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            self._lock_depth = 1
+            try:
+                yield
+            finally:
+                self._lock_depth = 0
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+    def save(self, config_data):
+        """Write config_data and return the config now on disk.
+
+        Sections (top-level keys) that config_data changed relative to the last load
+        replace the file's; the file's version of every other section is kept, so
+        edits made meanwhile by another process survive. Nothing is written when the
+        result equals the file's content.
+        """
+        with self.locked():
+            base = self._base if self._base is not None else organizer_engine.default_config()
+            if self.changed():
+                current, signature = self._read()
+            else:
+                current, signature = self._base, self._signature
+            merged = dict(current)
+            for key in set(config_data) | set(base):
+                if config_data.get(key) == base.get(key):
+                    continue
+                if key == "mappings" and current.get(key) != base.get(key):
+                    # Both sides edited the mappings (e.g. a generator script while the settings window was open)
+                    merged[key] = merge_mappings(base.get(key, []), config_data.get(key, []), current.get(key, []))
+                elif key in config_data:
+                    merged[key] = config_data[key]
+                else:
+                    merged.pop(key, None)
+            if merged == current and signature is not None:
+                if current is not self._base:
+                    self._set(current, signature)
+                return self.data
+            organizer_engine.save_config(merged, self.path)
+            self._set(merged, self._stat())
+            return self.data
+
+    @contextlib.contextmanager
+    def editing(self):
+        """Load the newest config under the lock, let the caller change it, then save it."""
+        with self.locked():
+            config_data = copy.deepcopy(self.load())
+            yield config_data
+            self.save(config_data)
@@ -0,0 +1,121 @@
+"""Index of the notes already in each target file, so a pass never routes the same note twice.
+
+A pass can route notes a second time when it fails after writing the targets but
+before rewriting the main notes file, or when a sync conflict brings back an older
+main file. For every target the index keeps the SHA-256 of each note body in it
+(as organizer_history.note_hash computes it) plus the file's inode, size and
+mtime after the organizer last wrote it. While those still match, checking a note
+is one indexed lookup and the target is never read. When they don't (the file was
+edited, synced or undone), that target alone is re-read and re-indexed the next
+time a note is routed to it.
+"""
+import os
+import sqlite3
+import threading
+
+from organizer_history import note_hash
+from organizer_rollover import iter_stamped_notes
+
+DEDUP_FILE = "organizer_dedup.sqlite3"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS targets (
+    target TEXT PRIMARY KEY,
+    inode INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS note_hashes (
+    target TEXT NOT NULL,
+    note_hash TEXT NOT NULL,
+    PRIMARY KEY (target, note_hash)
+) WITHOUT ROWID;
+"""
+
+_MISSING = (0, -1, 0) # Signature of a target that doesn't exist yet, whose index is validly empty
+
+
+def _signature(path):
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return _MISSING
+    return (st.st_ino, st.st_size, st.st_mtime_ns)
+
+
+def target_hashes(path):
+    """Hashes of the bodies of the notes in a target file, read in one pass."""
+    with open(path, "rb") as f:
+        data = f.read()
+    hashes = set()
+    for note in iter_stamped_notes(data):
+        body = data[note.body_start:note.end].decode("utf-8", errors="replace").replace("\r\n", "\n")
+        if body.strip():
+            hashes.add(note_hash(body))
+    return hashes
+
+
+class DedupIndex:
+    def __init__(self, path=DEDUP_FILE):
+        self.path = path
+        self._local = threading.local() # sqlite3 connections may only be used by the thread that made them
+
+    @classmethod
+    def from_config(cls, config_data, path=DEDUP_FILE):
+        # Optional "dedup" section: {"enabled": true}; None when disabled
+        options = config_data.get("dedup", {})
+        if isinstance(options, dict) and not options.get("enabled", True):
+            return None
+        return cls(path)
+
+    def _connect(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=10)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.executescript(_SCHEMA)
+            self._local.connection = connection
+        return connection
+
+    def close(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is not None:
+            connection.close()
+            self._local.connection = None
+
+    def _store(self, connection, target_file, signature, hashes, replace):
+        with connection:
+            if replace:
+                connection.execute("DELETE FROM note_hashes WHERE target = ?", (target_file,))
+            connection.executemany("INSERT OR IGNORE INTO note_hashes (target, note_hash) VALUES (?, ?)",
+                                   [(target_file, h) for h in hashes])
+            connection.execute("INSERT OR REPLACE INTO targets (target, inode, size, mtime_ns) VALUES (?, ?, ?, ?)",
+                               (target_file, *signature))
+
+    def validate(self, target_file):
+        """Re-index target_file if it changed since the organizer last wrote it; call before writing to it."""
+        target_file = os.path.abspath(target_file)
+        signature = _signature(target_file)
+        connection = self._connect()
+        row = connection.execute("SELECT inode, size, mtime_ns FROM targets WHERE target = ?", (target_file,)).fetchone()
+        if row != signature:
+            # Edited, replaced or never indexed: read it once and index it from scratch
+            hashes = target_hashes(target_file) if signature != _MISSING else ()
+            self._store(connection, target_file, signature, hashes, replace=True)
+
+    def present(self, target_file, hashes):
+        """The subset of hashes whose notes target_file already holds."""
+        self.validate(target_file)
+        target_file = os.path.abspath(target_file)
+        connection = self._connect()
+        return {h for h in hashes if connection.execute(
+            "SELECT 1 FROM note_hashes WHERE target = ? AND note_hash = ?", (target_file, h)).fetchone()}
+
+    def record(self, target_file, hashes):
+        """Add the notes just written to target_file and remember the file as this write left it."""
+        target_file = os.path.abspath(target_file)
+        connection = self._connect()
+        if connection.execute("SELECT 1 FROM targets WHERE target = ?", (target_file,)).fetchone() is None:
+            return # validate() wasn't called; the next present() indexes the whole file
+        self._store(connection, target_file, _signature(target_file), hashes, replace=False)
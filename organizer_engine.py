@@ -0,0 +1,1334 @@
+"""Qt-free note routing engine shared by the tray app and the command line."""
+import array
+import atexit
+import collections
+import concurrent.futures
+import contextlib
+import copy
+import glob
+import hashlib
+import json
+import multiprocessing
+import os
+import re
+import shutil
+import sys
+import time
+import uuid
+from datetime import datetime
+
+import organizer_io
+from body_matcher import compile_rules
+from header_matcher import MappingError, compile_mappings
+from organizer_history import note_hash
+from organizer_journal import JOURNAL_FILE, JournalError, UndoJournal
+from organizer_log import LOG_FILE, RunLogger
+from organizer_metrics import PhaseTimer, write_textfile
+from organizer_rollover import RolloverError, roll_over, rollover_policies, shard_dir, shard_files
+
+CONFIG_FILE = "config.json"
+
+DATE_PATTERN = re.compile(r"^\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}$")
+AUTO_TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S (auto)"
+TARGET_WRITE_WORKERS = 8
+SCAN_PROCESSES = os.cpu_count() or 2
+CANCEL_CHECK_INTERVAL = 4096 # Candidate lines between cancellation checks while scanning a main file
+SCAN_CHUNK_BYTES = 4 * 1024 * 1024 # A main file is scanned in pieces of about this size, cut at line ends
+PLAN_ATTEMPTS = 3 # organize_notes() re-plans when a source changes between planning and committing
+MERGE_ATTEMPTS = 5 # Rounds of catching up with text still being appended to a source before replacing it
+CAPTURE_SOURCE = "capture" # Logged as the source of notes ingest_notes() writes
+
+
+class OrganizerError(Exception):
+    # Fatal problem that aborts a run; title is what the GUI uses for its dialog caption
+    def __init__(self, title, message):
+        super().__init__(message)
+        self.title = title
+        self.message = message
+
+    def __reduce__(self):
+        # Errors raised in scan worker processes have to survive pickling
+        return (self.__class__, (self.title, self.message))
+
+
+class OrganizeCancelled(OrganizerError):
+    def __init__(self):
+        super().__init__("Organization Cancelled", "Organization was cancelled before any file was changed.")
+
+    def __reduce__(self):
+        return (self.__class__, ())
+
+
+# A routed note: the optional date line above its header, the header as matched ("" for notes routed
+# by a body rule, whose body is the whole block), the raw body, and the byte range [start, end) it
+# occupies in its main notes file
+NoteSegment = collections.namedtuple("NoteSegment", ["date_line", "header", "target_file", "content", "start", "end"])
+
+# One inbox line with everything the segmenter needs computed exactly once
+_ScannedLine = collections.namedtuple("_ScannedLine", ["raw", "text", "stripped", "key", "is_date", "start", "end"])
+
+# What scanning one main notes file found: its fingerprint before the scan, the number of bytes
+# scanned and their hash, the notes to route out of it (in file order) and how long the scan took
+PlannedSource = collections.namedtuple("PlannedSource", ["notes_file", "fingerprint", "size", "content_hash", "notes",
+                                                         "scan_ms"])
+
+# A note handed straight to ingest_notes() instead of being written into a main notes file first
+CapturedNote = collections.namedtuple("CapturedNote", ["header", "body"])
+
+# Everything one target file receives in a pass, already rendered, with the note hashes to add to the dedup
+# index and the organizer_rollover.RolloverPolicy to apply before writing, if any
+PlannedTarget = collections.namedtuple("PlannedTarget", ["target_file", "position", "notes_count", "block", "hashes",
+                                                         "rollover"], defaults=((), None))
+
+
+class PlanStale(OrganizerError):
+    def __init__(self, notes_file):
+        super().__init__("Notes File Changed",
+                         f"{notes_file} changed after the preview was made. Preview again before organizing.")
+        self.notes_file = notes_file
+
+    def __reduce__(self):
+        return (self.__class__, (self.notes_file,))
+
+
+class OrganizePlan:
+    """What an organize pass would do, worked out without writing any file.
+
+    Holds the routed notes of every source (with their byte ranges) and the
+    rendered block for every target. commit_plan() executes it as long as none of
+    the sources changed since it was made, other than by text appended to them,
+    which is carried over. mappings are the ones it was planned with. Notes in skipped, (notes file, NoteSegment)
+    pairs, are already in their target: they leave the source but aren't written again.
+    """
+
+    def __init__(self, notes_files, sources=(), targets=(), status="ok", plan_ms=None, phases=None, skipped=(),
+                 mappings=()):
+        self.plan_id = uuid.uuid4().hex[:12]
+        self.created = datetime.now()
+        self.notes_files = tuple(notes_files)
+        self.mappings = mappings
+        self.sources = tuple(sources)
+        self.targets = tuple(targets)
+        self.status = status
+        self.plan_ms = plan_ms
+        self.phases = phases if phases is not None else PhaseTimer() # See organizer_metrics for the phase names
+        self.skipped = tuple(skipped)
+
+    @property
+    def notes_moved(self):
+        return sum(target.notes_count for target in self.targets)
+
+    @property
+    def notes_skipped(self):
+        return len(self.skipped)
+
+    @property
+    def bytes_read(self):
+        return sum(source.size for source in self.sources)
+
+    def to_dict(self):
+        return {
+            "plan_id": self.plan_id,
+            "created": self.created.isoformat(timespec="seconds"),
+            "status": self.status,
+            "notes_files": list(self.notes_files),
+            "notes_moved": self.notes_moved,
+            "notes_skipped": self.notes_skipped,
+            "notes_by_source": {source.notes_file: len(source.notes) for source in self.sources if source.notes},
+            "notes_by_target": {target.target_file: {"notes": target.notes_count, "position": target.position,
+                                                     "bytes": len(target.block.encode("utf-8"))}
+                                for target in self.targets},
+            "bytes_read": self.bytes_read,
+            "plan_ms": self.plan_ms,
+            "phases": self.phases.to_dict(),
+        }
+
+    def diff(self):
+        """Unified-diff style text of the lines leaving each source and the blocks each target gets."""
+        lines = []
+        skipped = {(notes_file, note.start) for notes_file, note in self.skipped}
+        for source in self.sources:
+            if not source.notes:
+                continue
+            lines += [f"--- {source.notes_file}", f"+++ {source.notes_file}"]
+            for note in source.notes:
+                duplicate = " (already there)" if (source.notes_file, note.start) in skipped else ""
+                lines.append(f"@@ bytes {note.start}-{note.end} -> {note.target_file}{duplicate} @@")
+                removed = [note.date_line.rstrip("\n")] if note.date_line else []
+                removed += ([note.header] if note.header else []) + note.content.splitlines()
+                lines += ["-" + line for line in removed]
+        for target in self.targets:
+            lines += [f"--- {target.target_file}", f"+++ {target.target_file}", f"@@ {target.position} @@"]
+            lines += ["+" + line for line in target.block.splitlines()]
+        return "\n".join(lines) + "\n" if lines else ""
+
+
+class OrganizeResult:
+    def __init__(self, notes_files):
+        self.notes_files = list(notes_files)
+        self.run_id = None
+        self.status = "ok"
+        self.notes_moved = 0
+        self.notes_skipped = 0 # Routed out of a source but not written, being in the target already
+        self.notes_pending = 0 # In text appended to a source during the run, left for the next pass
+        self.notes_by_target = collections.OrderedDict()
+        self.notes_by_source = collections.OrderedDict()
+        self.snapshot_files = collections.OrderedDict() # notes file -> full snapshot the undo journal took
+        self.fingerprints = {} # notes file -> organizer_io.FileFingerprint as this run left it
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self.duration_ms = None
+        self.phases = PhaseTimer() # See organizer_metrics for the phase names
+        self.target_ms = collections.OrderedDict() # target file -> time spent staging it
+        self.shards = collections.OrderedDict() # target file -> {shard file: notes rolled over into it}
+
+    @property
+    def notes_file(self):
+        return self.notes_files[0] if self.notes_files else ""
+
+    def to_dict(self):
+        return {
+            "run_id": self.run_id,
+            "status": self.status,
+            "notes_files": self.notes_files,
+            "notes_moved": self.notes_moved,
+            "notes_skipped": self.notes_skipped,
+            "notes_pending": self.notes_pending,
+            "notes_by_source": dict(self.notes_by_source),
+            "notes_by_target": dict(self.notes_by_target),
+            "snapshot_files": dict(self.snapshot_files),
+            "bytes_read": self.bytes_read,
+            "bytes_written": self.bytes_written,
+            "duration_ms": self.duration_ms,
+            "phases": self.phases.to_dict(),
+            "target_ms": {target_file: round(ms, 3) for target_file, ms in self.target_ms.items()},
+            "shards": dict(self.shards),
+        }
+
+
+def default_config():
+    return {"mappings": [], "last_notes_file": ""}
+
+
+def load_config(config_file=CONFIG_FILE, report_error=print):
+    if not os.path.exists(config_file):
+        return default_config()
+    try:
+        with open(config_file, "r", encoding="utf-8") as f:
+            config_data = json.load(f)
+    except json.JSONDecodeError:
+        report_error(f"Could not decode {config_file}. Using default configuration.")
+        return default_config()
+    except Exception as e:
+        report_error(f"Could not load {config_file}: {e}. Using default configuration.")
+        return default_config()
+    return validate_config(config_data, config_file, report_error)
+
+
+def validate_config(config_data, config_file=CONFIG_FILE, report_error=print):
+    if not isinstance(config_data, dict):
+        report_error(f"{config_file} has an invalid format. Resetting.")
+        return default_config()
+    if "mappings" not in config_data or not isinstance(config_data["mappings"], list):
+        config_data["mappings"] = []
+    if "last_notes_file" not in config_data or not isinstance(config_data["last_notes_file"], str):
+        config_data["last_notes_file"] = ""
+    if not isinstance(config_data.get("notes_files", []), list):
+        report_error(f"'notes_files' in {config_file} must be a list of paths or glob patterns. Ignoring it.")
+        config_data["notes_files"] = []
+    return config_data
+
+
+def config_sources(config_data):
+    return resolve_sources(config_data.get("last_notes_file", ""), config_data.get("notes_files", []),
+                           config_data.get("mappings", []))
+
+
+def save_config(config_data, config_file=CONFIG_FILE):
+    # Written to a temp file that replaces config.json, so a crash mid-write never truncates it
+    out, tmp_path = organizer_io.open_temp_sibling(config_file)
+    try:
+        with out:
+            json.dump(config_data, out, indent=2)
+            out.flush()
+            os.fsync(out.fileno())
+        if os.path.exists(config_file):
+            shutil.copymode(config_file, tmp_path)
+        organizer_io.commit_staged(tmp_path, config_file)
+    except BaseException:
+        organizer_io.remove_quietly(tmp_path)
+        raise
+
+
+# UTF-8 of every character str.strip() removes, except the newline that ends a line
+_WS_BYTES = rb"(?:[\t\x0b\x0c\r\x1c-\x1f ]|\xc2[\x85\xa0]|\xe1\x9a\x80|\xe2\x80[\x80-\x8a\xa8\xa9\xaf]|\xe2\x81\x9f|\xe3\x80\x80)*"
+_DIGIT_BYTES = rb"(?:[0-9]|[\x80-\xff]{2,4})" # DATE_PATTERN's \d also takes other scripts' digits
+_DATE_BYTES = rb"%s{4}-%s{2}-%s{2} %s{2}:%s{2}:%s{2}" % ((_DIGIT_BYTES,) * 6)
+
+_boundary_cache = (None, None) # (matcher, its patterns); only the current mappings' matcher is needed
+
+
+def _boundary_patterns(header_matcher):
+    """(first line, later lines) byte regexes for the lines the segmenter has to look at.
+
+    Those are blank lines, date lines and lines a header could match, each with
+    any surrounding whitespace. The second pattern matches the newline before such
+    a line, which lets the regex engine skip ahead with a plain character search.
+    """
+    global _boundary_cache
+    if _boundary_cache[0] is not header_matcher:
+        headers = header_matcher.line_regex()
+        line = rb"[^\n]*" if headers is None else _WS_BYTES + b"(?:" + _DATE_BYTES + b"|" + headers + b")?" + _WS_BYTES
+        first_bytes = header_matcher.line_first_bytes()
+        # Most lines are rejected on their first byte before the full pattern is tried
+        gate = b"" if headers is None or first_bytes is None else \
+            rb"(?=[\n\t\x0b\x0c\r\x1c-\x1f 0-9\x80-\xff" + re.escape(first_bytes) + rb"]|\Z)"
+        patterns = (re.compile(line + rb"$", re.MULTILINE), re.compile(rb"\n" + gate + rb"(?=" + line + rb"$)", re.MULTILINE))
+        _boundary_cache = (header_matcher, patterns)
+    return _boundary_cache[1]
+
+
+def boundary_index(data, header_matcher, should_cancel=None):
+    """Start offsets, in order, of the lines of data (bytes) that could start, end or interrupt a note.
+
+    Found with one C-level regex scan; the lines in between are never decoded.
+    """
+    first, later = _boundary_patterns(header_matcher)
+    offsets = array.array("q")
+    if data and first.match(data):
+        offsets.append(0)
+    matches = later.finditer(data)
+    if should_cancel is not None:
+        matches = _cancellable(matches, should_cancel)
+    offsets.extend(match.end() for match in matches)
+    if offsets and offsets[-1] == len(data): # The "line" after a final newline
+        offsets.pop()
+    return offsets
+
+
+def _scan_line(data, start, end, base):
+    raw = data[start:end].decode("utf-8")
+    if raw.endswith("\r\n"):
+        raw = raw[:-2] + "\n"
+    text = raw.rstrip('\r\n')
+    stripped = text.strip()
+    return _ScannedLine(raw, text, stripped, stripped.lower(), DATE_PATTERN.match(stripped) is not None,
+                        base + start, base + end)
+
+
+def _scan_boundaries(data, offsets, base=0):
+    # Candidate lines are scanned in full; each run of other lines between them becomes one
+    # opaque line that is neither blank nor a date and matches no header. data starts at offset base.
+    position = 0
+    for start in offsets:
+        if start > position:
+            yield _ScannedLine(None, None, None, None, False, base + position, base + start)
+        newline = data.find(b"\n", start)
+        position = len(data) if newline < 0 else newline + 1
+        yield _scan_line(data, start, position, base)
+    if position < len(data):
+        yield _ScannedLine(None, None, None, None, False, base + position, base + len(data))
+
+
+class _BufferSource:
+    # Content already in memory, scanned as one chunk
+    def __init__(self, data):
+        self.data = data
+        self.size = len(data)
+
+    def chunks(self):
+        yield 0, self.data
+
+    def read(self, start, end):
+        return self.data[start:end]
+
+
+class _FileSource:
+    """A main notes file scanned in SCAN_CHUNK_BYTES pieces, so memory doesn't grow with the file.
+
+    Every piece ends at a line end (a line longer than a piece makes that piece
+    longer). Byte ranges of notes and blocks are sliced from the current piece, or
+    read back with pread() when they started in an earlier one. size and digest
+    (its tail_hash) cover everything read once chunks() is exhausted.
+    """
+
+    def __init__(self, f):
+        self.f = f
+        self.size = 0
+        self.digest = hashlib.blake2b(digest_size=16)
+        self._base, self._chunk = 0, b""
+
+    def chunks(self):
+        carry = b""
+        while True:
+            piece = self.f.read(SCAN_CHUNK_BYTES)
+            self.digest.update(piece)
+            self.size += len(piece)
+            cut = piece.rfind(b"\n") + 1
+            if piece and not cut:
+                carry += piece # The line goes on in the next piece
+                continue
+            chunk = carry + piece[:cut] if piece else carry
+            carry = piece[cut:]
+            if chunk:
+                self._base, self._chunk = self.size - len(carry) - len(chunk), chunk
+                yield self._base, chunk
+            if not piece:
+                return
+
+    def read(self, start, end):
+        if self._base <= start and end <= self._base + len(self._chunk):
+            return self._chunk[start - self._base:end - self._base]
+        return os.pread(self.f.fileno(), end - start, start)
+
+
+def _scan_chunks(source, header_matcher, should_cancel):
+    for base, chunk in source.chunks():
+        yield from _scan_boundaries(chunk, boundary_index(chunk, header_matcher, should_cancel), base)
+
+
+def _body_note(source, start, end, separator_end, body_matcher):
+    # A block no header claimed, routed if a body rule matches its text
+    block = source.read(start, end)
+    target_file = body_matcher.match(block.decode("utf-8", errors="replace"))
+    if target_file is None:
+        return None
+    try:
+        text = block.decode("utf-8").replace("\r\n", "\n").strip("\n")
+    except UnicodeDecodeError: # Left where it is, like any text that isn't routed
+        return None
+    first, _, rest = text.partition("\n")
+    date_line = None
+    if DATE_PATTERN.match(first) and rest.strip():
+        date_line, text = first + "\n", rest
+    # No header: the whole block, first line included, is the note
+    return NoteSegment(date_line, "", target_file, text, start, separator_end)
+
+
+def iter_segments(data, header_matcher, should_cancel=None, body_matcher=None):
+    """Walk a main file's content (bytes, or a _FileSource) once, yielding every routed note as a NoteSegment.
+
+    A note starts at a line matching a configured header (or a date line followed
+    by one) and runs until a blank line or the start of the next routed note.
+    With a body_matcher (body_matcher.BodyMatcher), a block between blank lines
+    that no header claims is routed as a whole when its text matches a body rule.
+    Everything outside the yielded byte ranges stays in the main file. Only the
+    lines in boundary_index() are decoded and tested, plus, for body rules, the
+    blocks no header claims; a note's body is decoded in one piece from its byte range.
+    """
+    source = _BufferSource(data) if isinstance(data, bytes) else data
+    scanned = _scan_chunks(source, header_matcher, should_cancel)
+    if should_cancel is not None:
+        scanned = _cancellable(scanned, should_cancel)
+    current = next(scanned, None)
+    following = next(scanned, None)
+    body_matcher = body_matcher or None
+    block_start, block_routed = 0, False # The blank-line delimited block being walked, and if a header claimed part of it
+
+    while current is not None:
+        if current.raw is None:
+            current, following = following, next(scanned, None)
+            continue
+        if body_matcher is not None and not current.stripped:
+            if not block_routed and current.start > block_start:
+                note = _body_note(source, block_start, current.start, current.end, body_matcher)
+                if note is not None:
+                    yield note
+            block_start, block_routed = current.end, False
+        # A date line only counts at the top level when it has no surrounding whitespace
+        if current.is_date and len(current.text) == len(current.stripped):
+            if following is None:
+                break
+            date_line, header, header_key = current.raw, following.stripped, following.key
+        else:
+            date_line, header = None, current.text
+            header_key = current.key if len(current.text) == len(current.stripped) else current.text.lower()
+
+        target_file = None if header_key is None else header_matcher.get(header_key)
+        if target_file is None:
+            current, following = following, next(scanned, None)
+            continue
+
+        start = current.start
+        if date_line is None:
+            line, end = following, current.end
+        else:
+            line, end = next(scanned, None), following.end
+        current = following = None
+        content_start = content_end = end
+        block_routed = True
+        while line is not None:
+            if line.raw is not None and not line.stripped:
+                # The separating blank line is consumed together with the note
+                end = line.end
+                block_start, block_routed = end, False
+                current = next(scanned, None)
+                following = next(scanned, None)
+                break
+            after = next(scanned, None)
+            if line.is_date:
+                scan_key = after.key if after is not None else ""
+            else:
+                scan_key = line.key
+            if scan_key is not None and scan_key in header_matcher:
+                current, following = line, after
+                break
+            content_end = end = line.end
+            line = after
+
+        content = source.read(content_start, content_end).decode("utf-8").replace("\r\n", "\n")
+        yield NoteSegment(date_line, header, target_file, content, start, end)
+
+    if body_matcher is not None and not block_routed and source.read(block_start, source.size).strip():
+        note = _body_note(source, block_start, source.size, source.size, body_matcher)
+        if note is not None:
+            yield note
+
+
+def format_note(note_content, timestamp=None):
+    if timestamp is None:
+        timestamp = datetime.now()
+    formatted_note = timestamp.strftime(AUTO_TIMESTAMP_FORMAT)
+    actual_note_content = note_content.strip()
+    if actual_note_content:
+        formatted_note += os.linesep + actual_note_content
+    return formatted_note
+
+
+def replace_main_file(main_notes_file, new_file_path):
+    try:
+        shutil.copymode(main_notes_file, new_file_path)
+        os.replace(new_file_path, main_notes_file)
+        organizer_io.fsync_dir(main_notes_file)
+    except Exception as e:
+        organizer_io.remove_quietly(new_file_path)
+        raise OrganizerError("File Update Error", f"Could not update main notes file {main_notes_file}: {e}")
+
+
+class StagedTarget:
+    """One target's share of a run, written in two steps so a failure anywhere changes nothing.
+
+    stage() does the expensive part: a synced temp file for prepends, or the append
+    itself for bottom targets. Either way it leaves a Splice describing the change
+    for the undo journal. commit() swaps prepend temp files in; rollback() undoes
+    whatever stage() did.
+    """
+
+    def __init__(self, planned_target):
+        self.target_file = planned_target.target_file
+        self.notes_count = planned_target.notes_count
+        self.position = planned_target.position
+        self.block = planned_target.block
+        self.tmp_path = None
+        self.splice = None
+        self.appended = False
+        self.bytes_written = 0
+        self.stage_ms = 0.0
+
+    def stage(self):
+        started = time.perf_counter()
+        try:
+            self._stage()
+        finally:
+            self.stage_ms = (time.perf_counter() - started) * 1000
+
+    def _stage(self):
+        target_dir = os.path.dirname(self.target_file)
+        if target_dir and not os.path.exists(target_dir):
+            os.makedirs(target_dir, exist_ok=True)
+        if self.position == "bottom":
+            self.splice = organizer_io.append_block(self.target_file, self.block)
+            self.appended = True
+            self.bytes_written = self.splice.tail_len
+        else:
+            self.tmp_path, self.splice = organizer_io.stage_prepend(self.target_file, self.block)
+            self.bytes_written = self.splice.new_size
+
+    def commit(self):
+        if self.tmp_path is not None:
+            organizer_io.commit_staged(self.tmp_path, self.target_file)
+            self.tmp_path = None
+
+    def rollback(self):
+        if self.tmp_path is not None:
+            organizer_io.remove_quietly(self.tmp_path)
+            self.tmp_path = None
+        if self.appended:
+            organizer_io.revert_splice(self.target_file, self.splice)
+            self.appended = False
+
+
+def write_targets(staged_targets, logger, progress=None, notes_total=0, before_commit=None, phases=None):
+    """Stage every target concurrently, then commit them all, or roll them all back on any failure.
+
+    before_commit() runs once everything is staged; if it raises, nothing is committed.
+    Time spent staging and committing is added to phases (a PhaseTimer) if given.
+    """
+    phases = phases if phases is not None else PhaseTimer()
+    failures = []
+    notes_routed = 0
+    workers = max(1, min(TARGET_WRITE_WORKERS, len(staged_targets)))
+    stage_started = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(staged.stage): staged for staged in staged_targets}
+        for future in concurrent.futures.as_completed(futures):
+            staged = futures[future]
+            try:
+                future.result()
+            except Exception as e:
+                failures.append(f"Could not write to target file {staged.target_file}: {e}")
+                logger.event("target_error", message=failures[-1], target=staged.target_file)
+                continue
+            notes_routed += staged.notes_count
+            if progress:
+                progress(notes_routed, notes_total)
+    phases.add("stage_targets", (time.perf_counter() - stage_started) * 1000,
+               bytes=sum(staged.bytes_written for staged in staged_targets), notes=notes_routed)
+    for staged in staged_targets:
+        phases.add("write_target", staged.stage_ms, bytes=staged.bytes_written, notes=staged.notes_count)
+
+    if failures:
+        for staged in staged_targets:
+            try:
+                staged.rollback()
+            except Exception as e:
+                failures.append(f"Could not roll back {staged.target_file}: {e}")
+        raise OrganizerError("Target Write Error",
+                             "\n".join(failures) + "\nNo notes were moved; the main notes file is unchanged.")
+
+    if before_commit is not None:
+        try:
+            with phases.phase("journal"):
+                before_commit()
+        except Exception as e:
+            error = e if isinstance(e, OrganizerError) else OrganizerError(
+                "Undo Journal Error", f"Could not write the undo journal: {e}\nNo notes were moved; the main notes file is unchanged.")
+            for staged in staged_targets:
+                try:
+                    staged.rollback()
+                except Exception as rollback_error:
+                    error.message += f"\nCould not roll back {staged.target_file}: {rollback_error}"
+            raise error
+
+    with phases.phase("commit_targets"):
+        for staged in staged_targets:
+            try:
+                staged.commit()
+            except Exception as e:
+                # Targets committed so far keep their notes; leaving the main file alone means duplicates, not loss
+                for remaining in staged_targets:
+                    remaining.rollback()
+                raise OrganizerError("Target Write Error",
+                                     f"Could not replace target file {staged.target_file}: {e}\n"
+                                     "The main notes file is unchanged; some notes may now appear twice.")
+
+
+def target_positions(mappings):
+    # A target collects new notes at the bottom if any mapping feeding it asks for that
+    return {m["target_file"] for m in mappings if m.get("position", "top") == "bottom"}
+
+
+def resolve_sources(last_notes_file, notes_files=(), mappings=()):
+    """Expand the configured main notes files into an ordered, de-duplicated list of paths.
+
+    last_notes_file comes first, then each notes_files entry in order. Entries may be
+    glob patterns ("**" recurses); their matches are sorted. Target files, the
+    rollover shards of targets with a rollover policy and .bak files are never
+    treated as sources.
+    """
+    excluded = {os.path.abspath(m["target_file"]) for m in mappings}
+    try:
+        policies = rollover_policies(mappings)
+    except RolloverError: # Reported when the run starts
+        policies = {}
+    shard_dirs = tuple(os.path.join(os.path.abspath(shard_dir(target_file)), "") for target_file in policies)
+    for target_file in policies:
+        excluded.update(os.path.abspath(path) for path in shard_files(target_file))
+    sources = []
+    seen = set()
+    for entry in ([last_notes_file] if last_notes_file else []) + list(notes_files):
+        if not isinstance(entry, str) or not entry:
+            continue
+        entry = os.path.expanduser(entry)
+        if glob.has_magic(entry):
+            matches = sorted(p for p in glob.glob(entry, recursive=True)
+                             if os.path.isfile(p) and not p.endswith(".bak"))
+        else:
+            matches = [entry] # Missing explicit files are reported when the run starts
+        for path in matches:
+            key = os.path.abspath(path)
+            if key not in seen and key not in excluded and not key.startswith(shard_dirs):
+                seen.add(key)
+                sources.append(path)
+    return sources
+
+
+def _cancellable(lines, should_cancel):
+    for count, line in enumerate(lines):
+        if count % CANCEL_CHECK_INTERVAL == 0 and should_cancel():
+            raise OrganizeCancelled()
+        yield line
+
+
+def scan_source(main_notes_file, mappings, should_cancel=None):
+    """Find the notes to route out of one main notes file without writing anything.
+
+    Returns a PlannedSource. Runs in scan worker processes, so everything it takes
+    and returns must pickle.
+    """
+    started = time.perf_counter()
+    header_matcher = compile_mappings(mappings)
+    body_matcher = compile_rules(mappings)
+    try:
+        # Taken before scanning so a change made during the scan makes the plan stale
+        fingerprint = organizer_io.file_fingerprint(main_notes_file)
+        src = open(main_notes_file, "rb")
+    except Exception as e:
+        raise OrganizerError("File Read Error", f"Could not read main notes file {main_notes_file}: {e}")
+    with src:
+        try:
+            source = _FileSource(src)
+            notes = tuple(iter_segments(source, header_matcher, should_cancel, body_matcher))
+        except (UnicodeDecodeError, OSError) as e:
+            raise OrganizerError("File Read Error", f"Could not read main notes file {main_notes_file}: {e}")
+    return PlannedSource(main_notes_file, fingerprint, source.size, source.digest.hexdigest(), notes,
+                         (time.perf_counter() - started) * 1000)
+
+
+_scan_pool = None
+
+
+def _get_scan_pool():
+    # Kept for the life of the process so workers (and their compiled matchers) are reused across runs
+    global _scan_pool
+    if _scan_pool is None:
+        methods = multiprocessing.get_all_start_methods()
+        # Never fork: the tray app calls this from a QThread
+        context = multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+        _scan_pool = concurrent.futures.ProcessPoolExecutor(max_workers=SCAN_PROCESSES, mp_context=context)
+        atexit.register(shutdown_scan_pool)
+    return _scan_pool
+
+
+def shutdown_scan_pool():
+    global _scan_pool
+    if _scan_pool is not None:
+        _scan_pool.shutdown(wait=True, cancel_futures=True)
+        _scan_pool = None
+
+
+def scan_sources(notes_files, mappings, should_cancel):
+    """Scan every source, in parallel worker processes when there is more than one.
+
+    Results come back in notes_files order; the first failure is raised once all
+    scans have finished.
+    """
+    if len(notes_files) == 1:
+        return [scan_source(notes_files[0], mappings, should_cancel)]
+
+    futures = [_get_scan_pool().submit(scan_source, path, mappings) for path in notes_files]
+    scanned, failure = [], None
+    for future in futures:
+        try:
+            scanned.append(future.result())
+        except OrganizerError as e:
+            failure = failure or e
+        except Exception as e:
+            failure = failure or OrganizerError("File Read Error", f"Could not scan main notes file: {e}")
+    if failure is None and should_cancel():
+        failure = OrganizeCancelled()
+    if failure is not None:
+        raise failure
+    return scanned
+
+
+def write_kept(source):
+    """Write everything outside the source's routed byte ranges to a synced temp file.
+
+    The kept ranges are copied in-kernel where possible. Returns (tmp_path, bytes_written).
+    """
+    notes_file = source.notes_file
+    try:
+        src = open(notes_file, "rb")
+    except OSError as e:
+        raise OrganizerError("File Read Error", f"Could not read main notes file {notes_file}: {e}")
+    with src:
+        try:
+            out, tmp_path = organizer_io.open_temp_sibling(notes_file, "wb")
+        except OSError as e:
+            raise OrganizerError("File Update Error", f"Could not update main notes file {notes_file}: {e}")
+        try:
+            with out:
+                position = 0
+                for note in source.notes:
+                    organizer_io.copy_range(src.fileno(), out.fileno(), position, note.start - position)
+                    position = note.end
+                organizer_io.copy_range(src.fileno(), out.fileno(), position, source.size - position)
+                os.fsync(out.fileno())
+        except OSError as e:
+            organizer_io.remove_quietly(tmp_path)
+            raise OrganizerError("File Update Error", f"Could not update main notes file {notes_file}: {e}")
+    return tmp_path, source.size - sum(note.end - note.start for note in source.notes)
+
+
+def appended_since(source):
+    """Bytes appended to a source since it was scanned, or None if it changed in any other way."""
+    try:
+        current = organizer_io.file_fingerprint(source.notes_file)
+        if current == source.fingerprint:
+            return 0
+        if current.size < source.size or organizer_io.prefix_hash(source.notes_file, source.size) != source.content_hash:
+            return None
+    except OSError as e:
+        raise OrganizerError("File Read Error", f"Could not read main notes file {source.notes_file}: {e}")
+    return current.size - source.size
+
+
+def check_fresh(source):
+    # Appends are fine: write_kept() only copies the scanned bytes and merge_appended() adds the rest
+    if appended_since(source) is None:
+        raise PlanStale(source.notes_file)
+
+
+def merge_appended(source, tmp_path):
+    """Copy text appended to a source since it was scanned onto the end of its rewritten temp file.
+
+    Call right before replacing the source, holding its lock. Returns the number
+    of bytes copied; raises OrganizerError if the source changed in any other way
+    or kept growing, in which case it has to be left as it is.
+    """
+    notes_file = source.notes_file
+    merged = 0
+    for _ in range(MERGE_ATTEMPTS):
+        appended = appended_since(source)
+        if appended is None:
+            raise OrganizerError("File Update Error", f"Main notes file {notes_file} was edited while it was "
+                                                      "being organized, so it was left as it is.")
+        if appended == merged:
+            return merged
+        try:
+            with open(notes_file, "rb") as src, open(tmp_path, "r+b") as out:
+                out.seek(0, os.SEEK_END) # Not "ab": copy_file_range refuses O_APPEND files
+                organizer_io.copy_range(src.fileno(), out.fileno(), source.size + merged, appended - merged)
+                out.flush()
+                os.fsync(out.fileno())
+        except OSError as e:
+            raise OrganizerError("File Update Error", f"Could not update main notes file {notes_file}: {e}")
+        merged = appended
+    raise OrganizerError("File Update Error", f"Main notes file {notes_file} kept changing while it was being "
+                                              "organized, so it was left as it is.")
+
+
+def _appended_notes(source, merged, mappings):
+    # Segments just the appended text, from the start of the line it begins on, to see if it holds notes to route
+    try:
+        with open(source.notes_file, "rb") as f:
+            window_start = max(0, source.size - organizer_io.FINGERPRINT_TAIL_BYTES)
+            f.seek(window_start)
+            data = f.read(source.size + merged - window_start)
+        data = data[data.rfind(b"\n", 0, source.size - window_start) + 1:]
+        return sum(1 for _ in iter_segments(data, compile_mappings(mappings), None, compile_rules(mappings)))
+    except (OSError, UnicodeDecodeError):
+        return 1 # Can't tell; let the next pass look
+
+
+@contextlib.contextmanager
+def _locked_files(notes_files, target_files=()):
+    # Sources and targets are locked together in one sorted order, so two runs locking overlapping files
+    # can't deadlock, and a file that is both is locked once (a second flock from this process would wait).
+    # Each lock is taken on a .<name>.lock file beside the file, so a target that doesn't exist yet stays missing
+    kinds = {os.path.abspath(target_file): "target file" for target_file in target_files}
+    kinds.update((os.path.abspath(notes_file), "main notes file") for notes_file in notes_files)
+    with contextlib.ExitStack() as locks:
+        for path in sorted(kinds):
+            try:
+                if kinds[path] == "target file":
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                locks.enter_context(organizer_io.locked(organizer_io.lock_path(path)))
+            except OSError as e:
+                raise OrganizerError("File Busy", f"Could not lock {kinds[path]} {path}: {e}")
+        yield
+
+
+def _normalize_sources(notes_files):
+    if isinstance(notes_files, str):
+        return [notes_files] if notes_files else []
+    return list(notes_files)
+
+
+def plan_organize(notes_files, mappings, should_cancel=None, dedup=None):
+    """Work out what an organize pass over notes_files would do, without writing any file.
+
+    Returns an OrganizePlan; raises OrganizerError when a main notes file cannot
+    be read or the mappings are invalid. Notes from several sources are merged
+    per target in source order, then file order. With dedup (an
+    organizer_dedup.DedupIndex), notes their target already holds are skipped.
+    """
+    started = time.perf_counter()
+    notes_files = _normalize_sources(notes_files)
+    should_cancel = should_cancel or (lambda: False)
+    if not notes_files:
+        raise OrganizerError("File Error", "Main notes file path is invalid or file does not exist.")
+    for main_notes_file in notes_files:
+        if not os.path.exists(main_notes_file):
+            raise OrganizerError("File Error", f"Main notes file path is invalid or file does not exist: {main_notes_file}")
+
+    if not mappings:
+        return OrganizePlan(notes_files, status="no_mappings")
+
+    try:
+        compile_mappings(mappings)
+        compile_rules(mappings)
+        policies = rollover_policies(mappings)
+    except (MappingError, RolloverError) as e:
+        raise OrganizerError("Mapping Error", str(e))
+
+    sources = scan_sources(notes_files, mappings, should_cancel)
+    phases = PhaseTimer()
+    for source in sources:
+        phases.add("scan", source.scan_ms, bytes=source.size, notes=len(source.notes))
+
+    notes_by_target = collections.OrderedDict() # target file -> [(notes file, note, hash of its body)]
+    for source in sources:
+        for note in source.notes:
+            content_hash = note_hash(note.content) if dedup is not None and note.content.strip() else None
+            notes_by_target.setdefault(note.target_file, []).append((source.notes_file, note, content_hash))
+    skipped = []
+    if dedup is not None:
+        with phases.phase("dedup") as checked:
+            for target_file, routed in notes_by_target.items():
+                try:
+                    present = dedup.present(target_file, [h for _, _, h in routed if h is not None])
+                except Exception as e: # The index is only a shortcut; without it the notes are written as before
+                    _dedup_error(None, f"Could not check {target_file} in {dedup.path}: {e}")
+                    continue
+                if present:
+                    skipped += [(notes_file, note) for notes_file, note, h in routed if h in present]
+                    notes_by_target[target_file] = [entry for entry in routed if entry[2] not in present]
+            checked["notes"] = len(skipped)
+
+    with phases.phase("render") as render:
+        bottom_targets = target_positions(mappings)
+        targets = [PlannedTarget(target_file, "bottom" if target_file in bottom_targets else "top", len(routed),
+                                 (os.linesep + os.linesep).join(format_note(note.content) for _, note, _ in routed),
+                                 tuple(h for _, _, h in routed if h is not None), policies.get(target_file))
+                   for target_file, routed in notes_by_target.items() if routed]
+        render["notes"] = sum(target.notes_count for target in targets)
+    plan_ms = (time.perf_counter() - started) * 1000
+    phases.add("plan", plan_ms, bytes=sum(source.size for source in sources), notes=phases.phases["render"]["notes"])
+    return OrganizePlan(notes_files, sources, targets, plan_ms=round(plan_ms, 3), phases=phases, skipped=skipped,
+                        mappings=copy.deepcopy(mappings))
+
+
+def commit_plan(plan, logger=None, progress=None, should_cancel=None, journal=None, dedup=None):
+    """Carry out a plan from plan_organize() as one logged run; returns an OrganizeResult.
+
+    Raises PlanStale, without changing any file, when a source it routes notes out
+    of has changed since the plan was made. See organize_notes() for the rest.
+    """
+    should_cancel = should_cancel or (lambda: False)
+    return _logged_run(plan.notes_files, logger, journal,
+                       lambda result, logger, journal: _commit(plan, result, logger, journal, progress, should_cancel,
+                                                               dedup))
+
+
+def organize_notes(notes_files, mappings, logger=None, progress=None, should_cancel=None, journal=None, dedup=None):
+    """Run one organize pass over one main notes file (a path) or several (a list).
+
+    Plans the pass and commits the plan straight away, planning again if a source
+    changes in between. Returns an OrganizeResult. Raises OrganizerError when a
+    main notes file cannot be read or rewritten or when any target file cannot be
+    written; in the latter case no file is changed. Log entries are buffered in
+    logger and written once when the run ends; how to reverse the run is recorded
+    in journal (an UndoJournal) before any file is replaced.
+
+    progress(notes_routed, notes_total) is called as target files are written.
+    should_cancel() is polled until the main files are replaced; once that has
+    happened the run always finishes so no routed note is lost. With dedup (an
+    organizer_dedup.DedupIndex), notes already in their target are taken out of
+    the main file without being written again.
+    """
+    should_cancel = should_cancel or (lambda: False)
+
+    def run(result, logger, journal):
+        for attempt in range(PLAN_ATTEMPTS):
+            plan = plan_organize(result.notes_files, mappings, should_cancel, dedup)
+            try:
+                return _commit(plan, result, logger, journal, progress, should_cancel, dedup)
+            except PlanStale:
+                if attempt == PLAN_ATTEMPTS - 1:
+                    raise
+
+    return _logged_run(notes_files, logger, journal, run)
+
+
+def captured_notes(notes):
+    """Validate (header, body) pairs or {"header": ..., "body": ...} dicts as CapturedNotes."""
+    captured = []
+    for note in notes:
+        if isinstance(note, dict):
+            note = (note.get("header"), note.get("body", ""))
+        try:
+            header, body = note
+        except (TypeError, ValueError):
+            raise OrganizerError("Capture Error", "Each note needs a header and a body.")
+        if not isinstance(header, str) or not header.strip() or "\n" in header.strip():
+            raise OrganizerError("Capture Error", "A note's header must be one non-empty line.")
+        if not isinstance(body, str):
+            raise OrganizerError("Capture Error", f"The body of note '{header}' must be text.")
+        captured.append(CapturedNote(header.strip(), body))
+    return captured
+
+
+def ingest_notes(notes, mappings, inbox_file="", logger=None, timestamp=None, dedup=None):
+    """Route captured notes straight into their target files as one logged run; returns an OrganizeResult.
+
+    notes are CapturedNotes (see captured_notes()). Each is formatted exactly as an
+    organize pass would format it, and every target file gets one write for the
+    whole batch, all or nothing, as in a pass. Notes whose header has no mapping
+    and no body rule match are appended to inbox_file as header and body, so they
+    are never dropped.
+    Captures are not journaled, so Undo Last Run leaves them alone. They are never
+    skipped as duplicates, but are added to dedup (a DedupIndex) if given.
+    """
+    try:
+        header_matcher = compile_mappings(mappings)
+        body_matcher = compile_rules(mappings)
+        policies = rollover_policies(mappings)
+    except (MappingError, RolloverError) as e:
+        raise OrganizerError("Mapping Error", str(e))
+    routed = []
+    for note in notes:
+        target_file = header_matcher.get(note.header.lower())
+        if target_file is None and body_matcher:
+            text = note.header + "\n" + note.body
+            target_file = body_matcher.match(text)
+            if target_file is not None: # Routed on its text, so the header line is part of the note, as in a pass
+                note = CapturedNote("", text)
+        routed.append((note, target_file))
+    unrouted = [note for note, target_file in routed if target_file is None]
+    if unrouted and not inbox_file:
+        raise OrganizerError("Capture Error", f"No mapping matches '{unrouted[0].header}' and there is no "
+                                              "main notes file to keep it in. No notes were written.")
+
+    def run(result, logger, journal):
+        with result.phases.phase("render") as render:
+            notes_by_target = collections.OrderedDict()
+            hashes_by_target = {}
+            for note, target_file in routed:
+                if target_file is None:
+                    block = (note.header + os.linesep + note.body.strip()).strip()
+                    notes_by_target.setdefault(inbox_file, []).append(block)
+                else:
+                    notes_by_target.setdefault(target_file, []).append(format_note(note.body, timestamp))
+                    if note.body.strip():
+                        hashes_by_target.setdefault(target_file, []).append(note_hash(note.body))
+            bottom_targets = target_positions(mappings) | {inbox_file}
+            targets = [PlannedTarget(target_file, "bottom" if target_file in bottom_targets else "top",
+                                     len(notes_list), (os.linesep + os.linesep).join(notes_list),
+                                     tuple(hashes_by_target.get(target_file, ())), policies.get(target_file))
+                       for target_file, notes_list in notes_by_target.items()]
+            render["notes"] = len(routed)
+        indexed = [target for target in targets if target.target_file != inbox_file]
+        staged_targets = [StagedTarget(target) for target in targets]
+        try:
+            # A pass writing the same files waits, and so does this; otherwise one would swap in a
+            # file staged before the other's write and drop it
+            with _locked_files([inbox_file] if inbox_file in notes_by_target else [],
+                               [target.target_file for target in indexed]):
+                if dedup is not None:
+                    with result.phases.phase("dedup"):
+                        for target in indexed:
+                            try:
+                                dedup.validate(target.target_file)
+                            except Exception as e:
+                                _dedup_error(logger, f"Could not check {target.target_file} in {dedup.path}: {e}")
+                _roll_over(targets, logger, result)
+                write_targets(staged_targets, logger, phases=result.phases)
+        finally:
+            for staged in staged_targets:
+                result.target_ms[staged.target_file] = staged.stage_ms
+        if dedup is not None:
+            _record_dedup(dedup, indexed, result.phases, logger)
+        result.notes_moved = len(routed)
+        for staged in staged_targets:
+            result.notes_by_target[staged.target_file] = staged.notes_count
+            result.bytes_written += staged.bytes_written
+        with result.phases.phase("log", notes=len(routed)):
+            for note, target_file in routed:
+                logger.note_moved(note.header, note.body, CAPTURE_SOURCE, target_file or inbox_file)
+
+    return _logged_run([], logger, None, run)
+
+
+def undo_last_run(journal=None, logger=None):
+    """Reverse the newest journaled run; returns an organizer_journal.UndoResult.
+
+    Raises OrganizerError, without changing any file, when there is nothing to undo
+    or a file the run touched has been edited since. The run's files are locked
+    like a pass locks them, so the two can't overwrite each other's replacements.
+    """
+    if journal is None:
+        journal = UndoJournal(JOURNAL_FILE)
+    if logger is None:
+        logger = RunLogger(LOG_FILE)
+    try:
+        run = journal.last_run() or {"run_id": None, "sources": [], "targets": []}
+        with _locked_files([source["notes_file"] for source in run["sources"]],
+                           [target["target_file"] for target in run["targets"]]):
+            undone = journal.undo_last_run(run["run_id"])
+    except OrganizerError as e:
+        logger.event("undo_error", message=e.message)
+        raise
+    except JournalError as e:
+        logger.event("undo_error", message=str(e))
+        raise OrganizerError("Undo Error", str(e))
+    except OSError as e:
+        logger.event("undo_error", message=str(e))
+        raise OrganizerError("Undo Error", f"Could not undo the last run: {e}")
+    logger.run_undone(undone.run_id, notes_restored=undone.notes_restored,
+                      sources=undone.notes_files, targets=undone.target_files)
+    return undone
+
+
+def _roll_over(targets, logger, result):
+    # Before the targets are staged, so this run's undo entry describes the rolled-over files
+    for target in targets:
+        if target.rollover is None:
+            continue
+        with result.phases.phase("rollover") as rollover:
+            try:
+                shards = roll_over(target.target_file, target.rollover, target.position)
+            except Exception as e: # The target just stays larger; the notes are never lost
+                message = f"Could not roll over target file {target.target_file}: {e}"
+                print(f"Rollover Error: {message}", file=sys.stderr) # Not stdout, where the CLI prints its JSON
+                logger.event("rollover_error", message=message, target=target.target_file)
+                continue
+            rollover["notes"] = sum(shards.values())
+        if shards:
+            result.shards[target.target_file] = shards
+            logger.event("target_rolled_over", target=target.target_file, shards=shards)
+
+
+def _dedup_error(logger, message):
+    # stderr, so the CLI's JSON on stdout stays valid; planning has no logger
+    print(f"Dedup Error: {message}", file=sys.stderr)
+    if logger is not None:
+        logger.event("dedup_error", message=message)
+
+
+def _record_dedup(dedup, targets, phases, logger):
+    with phases.phase("dedup", notes=sum(len(target.hashes) for target in targets)):
+        for target in targets:
+            try:
+                dedup.record(target.target_file, target.hashes)
+            except Exception as e: # A stale entry only means the target is re-read next time
+                _dedup_error(logger, f"Could not update {target.target_file} in {dedup.path}: {e}")
+
+
+def _logged_run(notes_files, logger, journal, run):
+    result = OrganizeResult(_normalize_sources(notes_files))
+    if logger is None:
+        logger = RunLogger(LOG_FILE)
+    if journal is None:
+        journal = UndoJournal(JOURNAL_FILE)
+    result.run_id = logger.begin_run(sources=result.notes_files)
+    try:
+        run(result, logger, journal)
+    except OrganizeCancelled:
+        result.status = "cancelled"
+        raise
+    except OrganizerError as e:
+        result.status = "error"
+        logger.event("run_error", error=e.title, message=e.message)
+        raise
+    finally:
+        with result.phases.phase("log_flush"):
+            result.duration_ms = logger.end_run(status=result.status,
+                                                notes_moved=result.notes_moved,
+                                                notes_skipped=result.notes_skipped,
+                                                bytes_read=result.bytes_read,
+                                                bytes_written=result.bytes_written,
+                                                phases=result.phases.to_dict())
+        if logger.metrics_file:
+            try:
+                write_textfile(logger.metrics_file, result)
+            except Exception as e: # stderr, so the CLI's JSON on stdout stays valid
+                message = f"Failed to write {logger.metrics_file}: {e}"
+                print(f"Metrics Error: {message}", file=sys.stderr)
+                logger.event("metrics_error", message=message)
+    return result
+
+
+def _commit(plan, result, logger, journal, progress, should_cancel, dedup=None):
+    # Other organizers (and captures) wait while the sources are rewritten and the targets staged and swapped
+    # in; editors that don't lock are caught by the freshness checks instead
+    with _locked_files([source.notes_file for source in plan.sources if source.notes],
+                       [target.target_file for target in plan.targets] +
+                       [note.target_file for _, note in plan.skipped]):
+        return _commit_locked(plan, result, logger, journal, progress, should_cancel, dedup)
+
+
+def _recheck_skipped(plan, dedup, logger):
+    """The targets and skipped notes to commit plan with, once each skipped note is checked again.
+
+    The plan checked the dedup index without any lock held; a skipped note its target no longer
+    holds (emptied, edited or undone since) is written back instead of leaving the source for nowhere.
+    """
+    if dedup is None or not plan.skipped:
+        return plan.targets, plan.skipped
+    skipped_by_target = collections.OrderedDict()
+    for notes_file, note in plan.skipped:
+        skipped_by_target.setdefault(note.target_file, []).append((notes_file, note, note_hash(note.content)))
+    skipped = []
+    for target_file, entries in skipped_by_target.items():
+        try:
+            present = dedup.present(target_file, [h for _, _, h in entries])
+        except Exception as e: # Can't tell, so write them: a duplicate is better than a lost note
+            _dedup_error(logger, f"Could not check {target_file} in {dedup.path}: {e}")
+            present = set()
+        skipped += [(notes_file, note) for notes_file, note, h in entries if h in present]
+    if len(skipped) == len(plan.skipped):
+        return plan.targets, plan.skipped
+
+    kept_skipped = {(notes_file, note.start) for notes_file, note in skipped}
+    restored = [target_file for target_file, entries in skipped_by_target.items()
+                if any((notes_file, note.start) not in kept_skipped for notes_file, note, _ in entries)]
+    policies = rollover_policies(plan.mappings)
+    bottom_targets = target_positions(plan.mappings)
+    targets = collections.OrderedDict((target.target_file, target) for target in plan.targets)
+    for target_file in restored:
+        notes = [note for source in plan.sources for note in source.notes
+                 if note.target_file == target_file and (source.notes_file, note.start) not in kept_skipped]
+        targets[target_file] = PlannedTarget(target_file, "bottom" if target_file in bottom_targets else "top",
+                                             len(notes),
+                                             (os.linesep + os.linesep).join(format_note(note.content) for note in notes),
+                                             tuple(note_hash(note.content) for note in notes if note.content.strip()),
+                                             policies.get(target_file))
+    return tuple(targets.values()), tuple(skipped)
+
+
+def _commit_locked(plan, result, logger, journal, progress, should_cancel, dedup):
+    result.status = plan.status
+    result.bytes_read = plan.bytes_read
+    result.phases.update(plan.phases)
+    for source in plan.sources:
+        if not source.notes:
+            result.fingerprints[source.notes_file] = source.fingerprint
+    routed = [source for source in plan.sources if source.notes]
+    if not routed:
+        return
+    with result.phases.phase("dedup"):
+        targets, skipped_notes = _recheck_skipped(plan, dedup, logger)
+    notes_moved = sum(target.notes_count for target in targets)
+
+    kept = []
+    journaled = False
+    try:
+        for source in routed:
+            with result.phases.phase("rewrite_main", notes=len(source.notes)) as rewrite:
+                check_fresh(source)
+                if should_cancel():
+                    raise OrganizeCancelled()
+                tmp_path, kept_bytes = write_kept(source)
+                try:
+                    # Recorded in the journal and result: what the main file will look like once replaced
+                    rewritten_fingerprint = organizer_io.file_fingerprint(tmp_path)
+                    # So undo can tell text appended since from any other edit
+                    rewritten_hash = organizer_io.prefix_hash(tmp_path, rewritten_fingerprint.size)
+                except OSError as e:
+                    organizer_io.remove_quietly(tmp_path)
+                    raise OrganizerError("File Update Error", f"Could not update main notes file {source.notes_file}: {e}")
+                rewrite["bytes"] = kept_bytes
+            kept.append((tmp_path, kept_bytes, rewritten_fingerprint, rewritten_hash))
+
+        _roll_over(targets, logger, result)
+        staged_targets = [StagedTarget(target) for target in targets]
+
+        def record_undo():
+            nonlocal journaled
+            for source in routed:
+                check_fresh(source) # Last point where starting over leaves every file as it was
+            snapshots = journal.record_run(result.run_id,
+                                           [(source, fingerprint, content_hash)
+                                            for source, (_, _, fingerprint, content_hash) in zip(routed, kept)],
+                                           [(staged.target_file, staged.splice) for staged in staged_targets])
+            journaled = True
+            result.snapshot_files.update(snapshots)
+
+        if progress:
+            progress(0, notes_moved)
+        # Targets first: a crash before the main files are replaced can duplicate notes but never lose them
+        try:
+            write_targets(staged_targets, logger, progress, notes_moved, before_commit=record_undo,
+                          phases=result.phases)
+        finally:
+            for staged in staged_targets:
+                result.target_ms[staged.target_file] = staged.stage_ms
+    except OrganizerError as e:
+        for tmp_path, _, _, _ in kept:
+            organizer_io.remove_quietly(tmp_path)
+        if journaled: # A target could not be swapped in, so no main file is replaced
+            e.message += _abort_journaled(journal, result, [source.notes_file for source in routed])
+        raise
+    if dedup is not None:
+        _record_dedup(dedup, targets, result.phases, logger)
+
+    for source in routed:
+        result.notes_by_source[source.notes_file] = len(source.notes)
+    result.notes_moved = notes_moved
+    result.notes_skipped = len(skipped_notes)
+    skipped = {(notes_file, note.start) for notes_file, note in skipped_notes}
+    for staged in staged_targets:
+        result.notes_by_target[staged.target_file] = staged.notes_count
+        result.bytes_written += staged.bytes_written
+
+    failures = []
+    failed_sources = []
+    for source, (tmp_path, kept_bytes, rewritten_fingerprint, _) in zip(routed, kept):
+        try:
+            with result.phases.phase("merge_appended") as merge:
+                try:
+                    merge["bytes"] = merged = merge_appended(source, tmp_path)
+                    if merged:
+                        rewritten_fingerprint = organizer_io.file_fingerprint(tmp_path)
+                except BaseException:
+                    organizer_io.remove_quietly(tmp_path)
+                    raise
+                if merged:
+                    merge["notes"] = _appended_notes(source, merged, plan.mappings)
+            with result.phases.phase("replace_main"):
+                replace_main_file(source.notes_file, tmp_path)
+        except (OrganizerError, OSError) as e:
+            failures.append(e.message if isinstance(e, OrganizerError) else
+                            f"Could not update main notes file {source.notes_file}: {e}")
+            failed_sources.append(source.notes_file)
+            continue
+        result.notes_pending += merge["notes"]
+        if not merge["notes"]: # Otherwise leave it unrecorded, so watch mode runs again for the appended notes
+            result.fingerprints[source.notes_file] = rewritten_fingerprint
+        result.bytes_written += kept_bytes + merge["bytes"]
+        with result.phases.phase("log", notes=len(source.notes)):
+            for note in source.notes:
+                if (source.notes_file, note.start) in skipped:
+                    logger.event("note_skipped", header=note.header, source=source.notes_file, target=note.target_file)
+                else:
+                    logger.note_moved(note.header, note.content, source.notes_file, note.target_file)
+    if failures:
+        raise OrganizerError("File Update Error", "\n".join(failures) + "\nThe target files were already updated, "
+                             "so the moved notes are still in the main notes file as well." +
+                             _abort_journaled(journal, result, failed_sources))
+
+
+def _abort_journaled(journal, result, notes_files):
+    # The journaled run never replaced notes_files; without the mark, undo would find them "edited after the run"
+    # and refuse this run and every earlier one. Returns what to add to the error message
+    for notes_file in notes_files:
+        snapshot_path = result.snapshot_files.pop(notes_file, None)
+        if snapshot_path:
+            organizer_io.remove_quietly(snapshot_path)
+    try:
+        journal.record_aborted(result.run_id, notes_files)
+    except OSError as e:
+        return f"\nCould not mark the run as aborted in the undo journal: {e}"
+    return ""
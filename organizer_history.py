@@ -0,0 +1,163 @@
+"""Searchable history of every moved note, kept in a local SQLite database.
+
+Each moved note is one row in `moves` (run ID, time, header, source, target, the
+full note text and its SHA-256), indexed by header, target and time. Note text and
+headers are also indexed with FTS5 where the SQLite build has it; otherwise text
+searches fall back to LIKE. The database runs in WAL mode so the tray app can
+search while a pass is recording its moves.
+"""
+import hashlib
+import sqlite3
+import threading
+
+HISTORY_FILE = "organizer_history.sqlite3"
+DEFAULT_LIMIT = 50
+SNIPPET_TOKENS = 16
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS moves (
+    id INTEGER PRIMARY KEY,
+    run_id TEXT NOT NULL,
+    ts TEXT NOT NULL,
+    header TEXT NOT NULL,
+    header_key TEXT NOT NULL,
+    source TEXT NOT NULL,
+    target TEXT NOT NULL,
+    note_hash TEXT NOT NULL,
+    bytes INTEGER NOT NULL,
+    body TEXT NOT NULL,
+    undone INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS moves_header ON moves (header_key, ts);
+CREATE INDEX IF NOT EXISTS moves_target ON moves (target, ts);
+CREATE INDEX IF NOT EXISTS moves_ts ON moves (ts);
+CREATE INDEX IF NOT EXISTS moves_run ON moves (run_id);
+CREATE INDEX IF NOT EXISTS moves_hash ON moves (note_hash);
+"""
+_FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS moves_fts USING fts5(header, body, content='moves', content_rowid='id');
+"""
+
+_COLUMNS = ("id", "run_id", "ts", "header", "source", "target", "note_hash", "bytes", "undone")
+
+
+def note_hash(content):
+    return hashlib.sha256(content.strip().encode("utf-8")).hexdigest()
+
+
+def _fts_query(text):
+    # Every word must match, as a prefix, so results update while the user is still typing
+    return " ".join('"' + word.replace('"', '""') + '"*' for word in text.split())
+
+
+class MoveHistory:
+    def __init__(self, path=HISTORY_FILE):
+        self.path = path
+        self.has_fts = None
+        self._local = threading.local() # sqlite3 connections may only be used by the thread that made them
+        self._schema_lock = threading.Lock()
+
+    def _connect(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=10)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            with self._schema_lock:
+                connection.executescript(_SCHEMA)
+                if self.has_fts is None:
+                    try:
+                        connection.executescript(_FTS_SCHEMA)
+                        self.has_fts = True
+                    except sqlite3.OperationalError: # SQLite built without FTS5
+                        self.has_fts = False
+            self._local.connection = connection
+        return connection
+
+    def close(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is not None:
+            connection.close()
+            self._local.connection = None
+
+    # --- Recording ---
+
+    def record_moves(self, run_id, moves):
+        """Store one run's moves in a single transaction.
+
+        moves is a list of (ts, header, content, source, target) tuples.
+        """
+        if not moves:
+            return
+        connection = self._connect()
+        with connection:
+            for ts, header, content, source, target in moves:
+                body = content.strip()
+                cursor = connection.execute(
+                    "INSERT INTO moves (run_id, ts, header, header_key, source, target, note_hash, bytes, body) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (run_id, ts, header, header.strip().lower(), source, target, note_hash(content),
+                     len(content.encode("utf-8")), body))
+                if self.has_fts:
+                    connection.execute("INSERT INTO moves_fts (rowid, header, body) VALUES (?, ?, ?)",
+                                       (cursor.lastrowid, header, body))
+
+    def mark_undone(self, run_id):
+        connection = self._connect()
+        with connection:
+            connection.execute("UPDATE moves SET undone = 1 WHERE run_id = ?", (run_id,))
+
+    # --- Queries ---
+
+    def search(self, text=None, header=None, target=None, since=None, until=None, limit=DEFAULT_LIMIT):
+        """Return matching moves, newest first, as dicts.
+
+        text matches words in the note body or header (prefix matches); header is
+        compared ignoring case; target is a path or a glob pattern; since/until
+        are ISO timestamps or dates. Each result has a short `snippet` of the note.
+        """
+        connection = self._connect()
+        clauses, params = [], []
+        text = (text or "").strip()
+        if text and self.has_fts:
+            source = "moves_fts JOIN moves m ON m.id = moves_fts.rowid"
+            snippet = f"snippet(moves_fts, 1, '[', ']', '...', {SNIPPET_TOKENS})"
+            clauses.append("moves_fts MATCH ?")
+            params.append(_fts_query(text))
+        else:
+            source = "moves m"
+            snippet = "substr(m.body, 1, 120)"
+            for word in text.split():
+                clauses.append("(m.body LIKE ? OR m.header LIKE ?)")
+                params += [f"%{word}%", f"%{word}%"]
+        if header:
+            clauses.append("m.header_key = ?")
+            params.append(header.strip().lower())
+        if target:
+            clauses.append("m.target GLOB ?" if any(c in target for c in "*?[") else "m.target = ?")
+            params.append(target)
+        if since:
+            clauses.append("m.ts >= ?")
+            params.append(since)
+        if until:
+            # A bare date means "through the end of that day"
+            clauses.append("m.ts < ?" if len(until) > 10 else "m.ts < (? || 'T99')")
+            params.append(until)
+        where = " WHERE " + " AND ".join(clauses) if clauses else ""
+        columns = ", ".join("m." + column for column in _COLUMNS)
+        order = " ORDER BY m.ts DESC, m.id DESC"
+        if source == "moves m":
+            query = f"SELECT {columns}, {snippet} FROM moves m{where}{order} LIMIT ?"
+            params.append(int(limit))
+        else:
+            # Pick the page first, walking the FTS index newest-first (rows are inserted in time order),
+            # so snippets are only built for the rows returned rather than for every match
+            query = (f"SELECT {columns}, {snippet} FROM {source} WHERE moves_fts MATCH ? AND m.id IN "
+                     f"(SELECT moves_fts.rowid FROM {source}{where} ORDER BY moves_fts.rowid DESC LIMIT ?){order}")
+            params = [params[0]] + params + [int(limit)]
+        rows = connection.execute(query, params).fetchall()
+        return [dict(zip(_COLUMNS + ("snippet",), row)) for row in rows]
+
+    def get_note(self, move_id):
+        row = self._connect().execute("SELECT body FROM moves WHERE id = ?", (move_id,)).fetchone()
+        return row[0] if row else None
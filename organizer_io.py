@@ -0,0 +1,364 @@
+"""Low-level file helpers for rewriting notes without loading whole files into memory."""
+import collections
+import contextlib
+import errno
+import hashlib
+import os
+import shutil
+import tempfile
+import time
+
+try:
+    import fcntl
+except ImportError: # Not on Windows; snapshots fall back to plain copies
+    fcntl = None
+
+COPY_CHUNK_SIZE = 1024 * 1024
+FINGERPRINT_TAIL_BYTES = 4096
+LOCK_TIMEOUT_S = 10
+LOCK_POLL_S = 0.02
+_WHITESPACE = b" \t\n\r\x0b\x0c\x1c\x1d\x1e\x1f" # What str.strip() removes, in ASCII
+_LINESEP = os.linesep.encode("ascii")
+
+# Errors meaning "this kernel/filesystem can't do that copy", as opposed to real I/O failures
+_FALLBACK_ERRNOS = {errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.ENOTSUP}
+_use_copy_file_range = hasattr(os, "copy_file_range")
+_use_sendfile = hasattr(os, "sendfile")
+FICLONE = 0x40049409 # linux/fs.h: share the source's extents instead of copying (btrfs, XFS, ...)
+_CLONE_FALLBACK_ERRNOS = _FALLBACK_ERRNOS | {errno.ENOTTY, errno.EBADF, errno.EPERM}
+
+# mkstemp creates files 0600; brand new targets should get the usual umask-derived mode instead
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+
+# How a write turned a file's old content into its new content:
+#     new = inserted head + old[kept_start:kept_end] + inserted tail
+# removed_head/removed_tail are the (whitespace only) bytes of the old file outside the kept range,
+# and inserted_hash is tail_hash() of the inserted head and tail together.
+Splice = collections.namedtuple("Splice", ["existed", "old_size", "new_size", "head_len", "tail_len",
+                                           "kept_start", "kept_end", "removed_head", "removed_tail", "inserted_hash"])
+
+# Cheap identity of a file's current state: stat fields plus a hash of its last few KB
+FileFingerprint = collections.namedtuple("FileFingerprint", ["inode", "size", "mtime_ns", "tail_hash"])
+
+
+def tail_hash(data):
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def file_fingerprint(path):
+    with open(path, "rb") as f:
+        st = os.fstat(f.fileno())
+        tail_start = max(0, st.st_size - FINGERPRINT_TAIL_BYTES)
+        f.seek(tail_start)
+        tail = f.read(st.st_size - tail_start)
+    return FileFingerprint(st.st_ino, st.st_size, st.st_mtime_ns, tail_hash(tail))
+
+
+def prefix_hash(path, size):
+    """tail_hash() of the first size bytes of path, read in chunks."""
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        while size > 0:
+            chunk = f.read(min(size, COPY_CHUNK_SIZE))
+            if not chunk:
+                break
+            digest.update(chunk)
+            size -= len(chunk)
+    return digest.hexdigest()
+
+
+def lock_path(path):
+    # The lock file beside path: locking path itself would create it when missing, and os.replace()
+    # swaps a new file in under a lock held on the old one
+    directory, name = os.path.split(os.path.abspath(path))
+    return os.path.join(directory, "." + name + ".lock")
+
+
+@contextlib.contextmanager
+def locked(path, timeout=LOCK_TIMEOUT_S):
+    """Hold an advisory exclusive flock() on path (created if missing) for the with-block.
+
+    It only keeps out writers that take the same lock, such as another organizer.
+    A file replaced while waiting is not the one path names any more, so the lock
+    is taken again on the new one. Raises TimeoutError after timeout seconds. Does
+    nothing where fcntl is unavailable.
+    """
+    if fcntl is None:
+        yield
+        return
+    deadline = time.monotonic() + timeout
+    while True:
+        fd = os.open(path, os.O_RDONLY | os.O_CREAT, 0o666)
+        try:
+            while True:
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    break
+                except BlockingIOError:
+                    if time.monotonic() >= deadline:
+                        raise TimeoutError(f"{path} is locked by another writer.")
+                    time.sleep(LOCK_POLL_S)
+            if os.fstat(fd).st_ino == os.stat(path).st_ino:
+                break
+        except BaseException:
+            os.close(fd)
+            raise
+        os.close(fd)
+    try:
+        yield
+    finally:
+        os.close(fd) # Releases the lock
+
+
+def open_temp_sibling(path, mode="w"):
+    # Temp file in the same directory so the final rename never crosses filesystems
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix="." + os.path.basename(path) + ".", suffix=".tmp")
+    if "b" in mode:
+        return open(fd, mode), tmp_path
+    return open(fd, mode, encoding="utf-8"), tmp_path
+
+
+def remove_quietly(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def _write_all(fd, data):
+    view = memoryview(data)
+    while view:
+        written = os.write(fd, view)
+        view = view[written:]
+
+
+def _copy_chunk(src_fd, dst_fd, offset, count):
+    # Prefer in-kernel copies; fall back one level at a time when the platform refuses
+    global _use_copy_file_range, _use_sendfile
+    if _use_copy_file_range:
+        try:
+            return os.copy_file_range(src_fd, dst_fd, count, offset)
+        except OSError as e:
+            if e.errno not in _FALLBACK_ERRNOS:
+                raise
+            _use_copy_file_range = False
+    if _use_sendfile:
+        try:
+            return os.sendfile(dst_fd, src_fd, offset, count)
+        except OSError as e:
+            if e.errno not in _FALLBACK_ERRNOS:
+                raise
+            _use_sendfile = False
+    data = os.pread(src_fd, count, offset)
+    _write_all(dst_fd, data)
+    return len(data)
+
+
+def copy_range(src_fd, dst_fd, offset, count):
+    """Copy count bytes starting at offset in src_fd to the current position of dst_fd."""
+    end = offset + count
+    while offset < end:
+        copied = _copy_chunk(src_fd, dst_fd, offset, min(end - offset, COPY_CHUNK_SIZE))
+        if copied == 0:
+            raise OSError(errno.EIO, "Source file shrank while it was being copied")
+        offset += copied
+
+
+def stripped_range(fd, size):
+    """Return (start, end) of the file content with surrounding whitespace removed."""
+    start = 0
+    while start < size:
+        chunk = os.pread(fd, min(COPY_CHUNK_SIZE, size - start), start)
+        if not chunk:
+            break
+        trimmed = chunk.lstrip(_WHITESPACE)
+        start += len(chunk) - len(trimmed)
+        if trimmed:
+            break
+    end = size
+    while end > start:
+        chunk_start = max(start, end - COPY_CHUNK_SIZE)
+        chunk = os.pread(fd, end - chunk_start, chunk_start)
+        trimmed = chunk.rstrip(_WHITESPACE)
+        end = chunk_start + len(trimmed)
+        if trimmed:
+            break
+    return start, end
+
+
+def fsync_dir(path):
+    # Makes a rename inside the directory durable; not every platform can open directories
+    try:
+        fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def stage_prepend(target_file, block):
+    """Write block + blank line + the existing (stripped) content of target_file into a synced temp file.
+
+    The old content is copied in chunks with copy_file_range/sendfile where available,
+    so it is never decoded or held in memory. Returns (tmp_path, splice); the target
+    itself is untouched until commit_staged() is called.
+    """
+    encoded_block = block.encode("utf-8")
+    tmp_file, tmp_path = open_temp_sibling(target_file, "wb")
+    try:
+        with tmp_file:
+            dst_fd = tmp_file.fileno()
+            src_fd = None
+            try:
+                src_fd = os.open(target_file, os.O_RDONLY)
+            except FileNotFoundError:
+                pass
+            if src_fd is None:
+                head = encoded_block.strip() + _LINESEP
+                _write_all(dst_fd, head)
+                os.chmod(tmp_path, 0o666 & ~_UMASK)
+                splice = Splice(False, 0, len(head), len(head), 0, 0, 0, b"", b"", tail_hash(head))
+            else:
+                try:
+                    old_size = os.fstat(src_fd).st_size
+                    start, end = stripped_range(src_fd, old_size)
+                    if end > start:
+                        head, tail = encoded_block + _LINESEP + _LINESEP, _LINESEP
+                        _write_all(dst_fd, head)
+                        copy_range(src_fd, dst_fd, start, end - start)
+                        _write_all(dst_fd, tail)
+                    else:
+                        head, tail = encoded_block.strip() + _LINESEP, b""
+                        _write_all(dst_fd, head)
+                    splice = Splice(True, old_size, len(head) + (end - start) + len(tail), len(head), len(tail),
+                                    start, end, os.pread(src_fd, start, 0), os.pread(src_fd, old_size - end, end),
+                                    tail_hash(head + tail))
+                    shutil.copymode(target_file, tmp_path)
+                finally:
+                    os.close(src_fd)
+            os.fsync(dst_fd)
+    except BaseException:
+        remove_quietly(tmp_path)
+        raise
+    return tmp_path, splice
+
+
+def commit_staged(tmp_path, target_file):
+    os.replace(tmp_path, target_file)
+    fsync_dir(target_file)
+
+
+def prepend_block(target_file, block):
+    """Prepend block to target_file via a temp file that atomically replaces it; returns the new size."""
+    tmp_path, splice = stage_prepend(target_file, block)
+    try:
+        commit_staged(tmp_path, target_file)
+    except BaseException:
+        remove_quietly(tmp_path)
+        raise
+    return splice.new_size
+
+
+def append_block(target_file, block):
+    """Add block at the bottom of target_file, separated by one blank line; I/O is O(len(block)).
+
+    Returns a Splice describing the change; revert_splice() puts the file back the
+    way it was.
+    """
+    encoded_block = block.encode("utf-8").strip()
+    existed = os.path.exists(target_file)
+    with open(target_file, "ab+") as f:
+        size = f.seek(0, os.SEEK_END)
+        tail_start = max(0, size - 64)
+        f.seek(tail_start)
+        tail = f.read()
+        if tail.strip(_WHITESPACE) or tail_start > 0:
+            # Top up whatever newlines the file already ends with to exactly one blank line
+            trailing = tail[len(tail.rstrip(_WHITESPACE)):]
+            missing = 2 - min(2, trailing.count(b"\n"))
+            appended = _LINESEP * missing + encoded_block + _LINESEP
+            f.write(appended)
+            splice = Splice(existed, size, size + len(appended), 0, len(appended), 0, size, b"", b"", tail_hash(appended))
+        else:
+            # Empty or whitespace-only file: start it fresh
+            f.truncate(0)
+            appended = encoded_block + _LINESEP
+            f.write(appended)
+            splice = Splice(existed, size, len(appended), 0, len(appended), size, size, tail, b"", tail_hash(appended))
+        f.flush()
+        os.fsync(f.fileno())
+    return splice
+
+
+def splice_intact(path, splice):
+    """True if path still holds what the change described by splice inserted (reads only those bytes)."""
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except FileNotFoundError:
+        return False
+    try:
+        if os.fstat(fd).st_size != splice.new_size:
+            return False
+        inserted = os.pread(fd, splice.head_len, 0) + os.pread(fd, splice.tail_len, splice.new_size - splice.tail_len)
+    finally:
+        os.close(fd)
+    return tail_hash(inserted) == splice.inserted_hash
+
+
+def revert_splice(path, splice):
+    """Put path back the way it was before the change described by splice."""
+    if not splice.existed:
+        remove_quietly(path)
+        return
+    if splice.head_len == 0 and not splice.removed_head:
+        # Appends: cut off what was added, in place
+        with open(path, "r+b") as f:
+            f.truncate(splice.new_size - splice.tail_len)
+            f.seek(0, os.SEEK_END)
+            f.write(splice.removed_tail)
+            f.flush()
+            os.fsync(f.fileno())
+        return
+    tmp_file, tmp_path = open_temp_sibling(path, "wb")
+    try:
+        with tmp_file:
+            dst_fd = tmp_file.fileno()
+            _write_all(dst_fd, splice.removed_head)
+            src_fd = os.open(path, os.O_RDONLY)
+            try:
+                copy_range(src_fd, dst_fd, splice.head_len, splice.new_size - splice.tail_len - splice.head_len)
+            finally:
+                os.close(src_fd)
+            _write_all(dst_fd, splice.removed_tail)
+            shutil.copymode(path, tmp_path)
+            os.fsync(dst_fd)
+        commit_staged(tmp_path, path)
+    except BaseException:
+        remove_quietly(tmp_path)
+        raise
+
+
+def clone_file(src_path, dst_path):
+    """Copy src_path to dst_path as a reflink clone where the filesystem supports it.
+
+    Returns True when the copy was a clone (no data was written), False when the
+    bytes had to be copied.
+    """
+    with open(src_path, "rb") as src, open(dst_path, "wb") as dst:
+        if fcntl is not None:
+            try:
+                fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+                return True
+            except OSError as e:
+                if e.errno not in _CLONE_FALLBACK_ERRNOS:
+                    raise
+        copy_range(src.fileno(), dst.fileno(), 0, os.fstat(src.fileno()).st_size)
+        os.fsync(dst.fileno())
+    return False
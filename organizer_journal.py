@@ -0,0 +1,304 @@
+"""Append-only undo journal for organize runs.
+
+Every run that moves notes appends one JSON line describing how to reverse it:
+for each main notes file, the byte ranges that were cut out and their text (or,
+when most of the file moved, a reflink snapshot of the whole file), and for each
+target file the Splice its write made. undo_last_run() checks that none of those
+files changed in a way it cannot reverse, then replays the newest run backwards.
+What is written scales with what moved, not with the size of the inbox. A run
+that fails after it was journaled gets an "aborted" line naming the main files it
+never replaced; undo leaves those alone, and skips the run if that is all of them.
+"""
+import collections
+import json
+import os
+import shutil
+from datetime import datetime
+
+import organizer_io
+
+JOURNAL_FILE = "organizer_journal.jsonl"
+DEFAULT_SNAPSHOT_RATIO = 0.5 # Snapshot a main file instead of journaling its segments once this share of it moves
+DEFAULT_KEEP_RUNS = 20
+DEFAULT_MAX_BYTES = 8 * 1024 * 1024 # Journal size that triggers dropping undone runs and markers as well
+
+
+class JournalError(Exception):
+    pass
+
+
+# What undo_last_run() put back; fingerprints describes the main files as the undo left them
+UndoResult = collections.namedtuple("UndoResult", ["run_id", "notes_restored", "notes_files", "target_files", "fingerprints"])
+
+
+def _fingerprint_matches_prefix(path, after, after_hash=None):
+    """True if path is the file a run left behind, possibly with text appended since.
+
+    after_hash is the hash of that whole file; runs journaled before it was recorded
+    only have the fingerprint's tail hash to go on.
+    """
+    current = organizer_io.file_fingerprint(path)
+    if current == after:
+        return True
+    if current.size < after.size:
+        return False
+    if after_hash is not None:
+        return organizer_io.prefix_hash(path, after.size) == after_hash
+    with open(path, "rb") as f:
+        window_start = max(0, after.size - organizer_io.FINGERPRINT_TAIL_BYTES)
+        f.seek(window_start)
+        return organizer_io.tail_hash(f.read(after.size - window_start)) == after.tail_hash
+
+
+class UndoJournal:
+    def __init__(self, path=JOURNAL_FILE, snapshot_ratio=DEFAULT_SNAPSHOT_RATIO, keep_runs=DEFAULT_KEEP_RUNS,
+                 max_bytes=DEFAULT_MAX_BYTES):
+        self.path = path
+        self.snapshot_ratio = snapshot_ratio
+        self.keep_runs = keep_runs
+        self.max_bytes = max_bytes
+
+    @classmethod
+    def from_config(cls, config_data, path=JOURNAL_FILE):
+        options = config_data.get("undo", {})
+        if not isinstance(options, dict):
+            options = {}
+        return cls(path,
+                   snapshot_ratio=float(options.get("snapshot_ratio", DEFAULT_SNAPSHOT_RATIO)),
+                   keep_runs=int(options.get("keep_runs", DEFAULT_KEEP_RUNS)),
+                   max_bytes=int(options.get("max_bytes", DEFAULT_MAX_BYTES)))
+
+    # --- Recording ---
+
+    def record_run(self, run_id, sources, targets):
+        """Durably journal a run before any of its files are replaced.
+
+        sources is a list of (planned source, fingerprint of its rewritten file, hash
+        of that whole file) and targets a list of (target file, Splice). The main files must still start
+        with the content that was scanned. Returns {notes file: snapshot path} for the sources
+        that were snapshotted.
+        """
+        snapshots = {}
+        try:
+            self._append(self._run_record(run_id, sources, targets, snapshots))
+        except BaseException:
+            for snapshot_path in snapshots.values():
+                organizer_io.remove_quietly(snapshot_path)
+            raise
+        try:
+            # By run count on every run, so the snapshots of dropped runs never pile up; the journal
+            # itself stays small enough to re-read for that
+            if len(self.undoable_runs()) > self.keep_runs or os.path.getsize(self.path) > self.max_bytes:
+                self.compact()
+        except OSError:
+            pass # Compaction is housekeeping; the run is journaled either way
+        return snapshots
+
+    def record_aborted(self, run_id, notes_files):
+        """Journal that run_id never replaced notes_files, so undo doesn't try to restore them."""
+        self._append({"type": "aborted", "run_id": run_id, "notes_files": list(notes_files),
+                      "ts": datetime.now().isoformat(timespec="milliseconds")})
+
+    def _run_record(self, run_id, sources, targets, snapshots):
+        source_records = []
+        for source, after, after_hash in sources:
+            removed = sum(note.end - note.start for note in source.notes)
+            record = {"notes_file": source.notes_file, "notes": len(source.notes),
+                      "before": list(source.fingerprint), "after": list(after), "after_hash": after_hash,
+                      "snapshot": None, "segments": []}
+            if source.size and removed >= self.snapshot_ratio * source.size:
+                record["snapshot"] = snapshots[source.notes_file] = self._snapshot(source.notes_file, run_id, source.size)
+            else:
+                with open(source.notes_file, "rb") as f:
+                    for note in source.notes:
+                        data = os.pread(f.fileno(), note.end - note.start, note.start)
+                        record["segments"].append([note.start, data.decode("utf-8"), organizer_io.tail_hash(data)])
+            source_records.append(record)
+
+        target_records = []
+        for target_file, splice in targets:
+            fields = splice._asdict()
+            fields["removed_head"] = splice.removed_head.decode("ascii") # Only ever whitespace
+            fields["removed_tail"] = splice.removed_tail.decode("ascii")
+            target_records.append({"target_file": target_file, "splice": fields})
+
+        return {"type": "run", "run_id": run_id, "ts": datetime.now().isoformat(timespec="milliseconds"),
+                "sources": source_records, "targets": target_records}
+
+    def _snapshot(self, notes_file, run_id, size):
+        directory, name = os.path.split(os.path.abspath(notes_file))
+        snapshot_path = os.path.join(directory, f".{name}.{run_id}.snapshot")
+        organizer_io.clone_file(notes_file, snapshot_path)
+        try:
+            os.truncate(snapshot_path, size) # Text appended since the scan is carried over by the run, not restored by undo
+        except BaseException:
+            organizer_io.remove_quietly(snapshot_path)
+            raise
+        return snapshot_path
+
+    def _append(self, record):
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    # --- Reading ---
+
+    def records(self):
+        try:
+            f = open(self.path, "r", encoding="utf-8")
+        except FileNotFoundError:
+            return []
+        records = []
+        with f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    continue # A torn last line from a crash mid-append
+        return records
+
+    def undoable_runs(self):
+        """Journaled runs that have not been undone, oldest first, without the sources they never replaced."""
+        records = self.records()
+        undone = {r.get("run_id") for r in records if r.get("type") == "undo"}
+        aborted = {}
+        for record in records:
+            if record.get("type") == "aborted":
+                aborted.setdefault(record.get("run_id"), set()).update(record.get("notes_files", ()))
+        runs = []
+        for record in records:
+            if record.get("type") != "run" or record.get("run_id") in undone:
+                continue
+            if record.get("run_id") in aborted:
+                failed = aborted[record["run_id"]]
+                record = dict(record, sources=[source for source in record["sources"]
+                                               if source["notes_file"] not in failed])
+                if not record["sources"]:
+                    continue
+            runs.append(record)
+        return runs
+
+    def last_run(self):
+        runs = self.undoable_runs()
+        return runs[-1] if runs else None
+
+    # --- Undo ---
+
+    def undo_last_run(self, run_id=None):
+        """Reverse the newest run that has not been undone yet and return an UndoResult.
+
+        Raises JournalError, without changing anything, when there is nothing to undo,
+        when run_id is given and a newer run has been journaled since, or when a file
+        the run touched has changed since in a way that cannot be reversed (text
+        appended to a main notes file is kept).
+        """
+        run = self.last_run()
+        if run is None:
+            raise JournalError("There is no organize run to undo.")
+        if run_id is not None and run["run_id"] != run_id:
+            raise JournalError(f"Run {run['run_id']} was journaled while run {run_id} was being undone. Try again.")
+
+        splices = [(t["target_file"], self._splice(t["splice"])) for t in run["targets"]]
+        problems = []
+        for source in run["sources"]:
+            after = organizer_io.FileFingerprint(*source["after"])
+            try:
+                if not _fingerprint_matches_prefix(source["notes_file"], after, source.get("after_hash")):
+                    problems.append(f"{source['notes_file']} was edited after the run.")
+            except OSError as e:
+                problems.append(f"Could not read {source['notes_file']}: {e}")
+            if source["snapshot"] and not os.path.exists(source["snapshot"]):
+                problems.append(f"The snapshot of {source['notes_file']} is missing.")
+            for start, text, digest in source["segments"]:
+                if organizer_io.tail_hash(text.encode("utf-8")) != digest:
+                    problems.append(f"The journal entry for {source['notes_file']} is damaged.")
+                    break
+        for target_file, splice in splices:
+            if not organizer_io.splice_intact(target_file, splice):
+                problems.append(f"{target_file} was changed after the run.")
+        if problems:
+            raise JournalError("Cannot undo run " + run["run_id"] + ":\n" + "\n".join(problems))
+
+        # Notes go back into the main files before they leave the targets: a crash in between duplicates, never loses
+        fingerprints = {}
+        for source in run["sources"]:
+            self._restore_source(source)
+            fingerprints[source["notes_file"]] = organizer_io.file_fingerprint(source["notes_file"])
+        for target_file, splice in reversed(splices):
+            organizer_io.revert_splice(target_file, splice)
+        for source in run["sources"]:
+            if source["snapshot"]:
+                organizer_io.remove_quietly(source["snapshot"])
+
+        self._append({"type": "undo", "run_id": run["run_id"], "ts": datetime.now().isoformat(timespec="milliseconds")})
+        return UndoResult(run["run_id"], sum(source["notes"] for source in run["sources"]),
+                          [source["notes_file"] for source in run["sources"]],
+                          [target_file for target_file, _ in splices], fingerprints)
+
+    @staticmethod
+    def _splice(fields):
+        fields = dict(fields)
+        fields["removed_head"] = fields["removed_head"].encode("ascii")
+        fields["removed_tail"] = fields["removed_tail"].encode("ascii")
+        return organizer_io.Splice(**fields)
+
+    @staticmethod
+    def _restore_source(source):
+        notes_file = source["notes_file"]
+        after_size = source["after"][1]
+        out, tmp_path = organizer_io.open_temp_sibling(notes_file, "wb")
+        try:
+            with out, open(notes_file, "rb") as current:
+                src_fd, dst_fd = current.fileno(), out.fileno()
+                size = os.fstat(src_fd).st_size
+                if source["snapshot"]:
+                    out.close()
+                    organizer_io.clone_file(source["snapshot"], tmp_path)
+                    with open(tmp_path, "r+b") as appended: # Keep anything captured since the run
+                        appended.seek(0, os.SEEK_END)
+                        organizer_io.copy_range(src_fd, appended.fileno(), after_size, size - after_size)
+                        os.fsync(appended.fileno())
+                else:
+                    position = removed = 0
+                    for start, text, _ in source["segments"]:
+                        data = text.encode("utf-8")
+                        current_start = start - removed
+                        organizer_io.copy_range(src_fd, dst_fd, position, current_start - position)
+                        out.write(data)
+                        out.flush() # Before the next in-kernel copy writes at the fd's position
+                        position = current_start
+                        removed += len(data)
+                    organizer_io.copy_range(src_fd, dst_fd, position, size - position)
+                    os.fsync(dst_fd)
+            shutil.copymode(notes_file, tmp_path)
+            organizer_io.commit_staged(tmp_path, notes_file)
+        except BaseException:
+            organizer_io.remove_quietly(tmp_path)
+            raise
+
+    # --- Housekeeping ---
+
+    def compact(self):
+        """Rewrite the journal keeping only the newest keep_runs runs that can still be undone.
+
+        The snapshots of the runs dropped are deleted.
+        """
+        runs = self.undoable_runs()
+        split = max(0, len(runs) - self.keep_runs)
+        keep, drop = runs[split:], runs[:split]
+        out, tmp_path = organizer_io.open_temp_sibling(self.path)
+        try:
+            with out:
+                for run in keep:
+                    out.write(json.dumps(run, ensure_ascii=False) + "\n")
+                out.flush()
+                os.fsync(out.fileno())
+            organizer_io.commit_staged(tmp_path, self.path)
+        except BaseException:
+            organizer_io.remove_quietly(tmp_path)
+            raise
+        for run in drop:
+            for source in run["sources"]:
+                if source["snapshot"]:
+                    organizer_io.remove_quietly(source["snapshot"])
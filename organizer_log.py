@@ -0,0 +1,200 @@
+"""JSON Lines activity log with one long-lived handle, per-run buffering and rotation."""
+import glob
+import gzip
+import json
+import os
+import shutil
+import sys
+import threading
+import time
+import uuid
+from datetime import datetime
+
+LOG_FILE = "organizer.log"
+DEFAULT_MAX_BYTES = 5 * 1024 * 1024
+DEFAULT_MAX_AGE_DAYS = 30
+DEFAULT_BACKUP_COUNT = 10
+SNIPPET_LENGTH = 80
+
+
+def _metrics_file(config_data):
+    # Optional "metrics" section: {"textfile": "/var/lib/node_exporter/textfile_collector/organizer.prom"}
+    options = config_data.get("metrics", {})
+    if not isinstance(options, dict):
+        return None
+    return options.get("textfile") or None
+
+
+class RunLogger:
+    def __init__(self, path=LOG_FILE, max_bytes=DEFAULT_MAX_BYTES, max_age_days=DEFAULT_MAX_AGE_DAYS,
+                 backup_count=DEFAULT_BACKUP_COUNT, compress=True, history=None, metrics_file=None):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_age_seconds = max_age_days * 86400 if max_age_days else None
+        self.backup_count = backup_count
+        self.compress = compress
+        self.history = history # Optional organizer_history.MoveHistory that gets each run's moves in one batch
+        self.metrics_file = metrics_file # Prometheus textfile the engine rewrites after every run, if set
+        self.run_id = None
+        self._run_started = None
+        self._run_thread = None
+        self._lock = threading.RLock()
+        self._buffer = []
+        self._moves = []
+        self._handle = None
+        self._segment_started = None
+
+    @classmethod
+    def from_config(cls, config_data, path=LOG_FILE, history=None):
+        # Optional "log" section: {"max_bytes": ..., "max_age_days": ..., "backup_count": ..., "compress": ...}
+        options = config_data.get("log", {})
+        if not isinstance(options, dict):
+            options = {}
+        return cls(path,
+                   max_bytes=options.get("max_bytes", DEFAULT_MAX_BYTES),
+                   max_age_days=options.get("max_age_days", DEFAULT_MAX_AGE_DAYS),
+                   backup_count=options.get("backup_count", DEFAULT_BACKUP_COUNT),
+                   compress=options.get("compress", True),
+                   history=history,
+                   metrics_file=_metrics_file(config_data))
+
+    # --- Recording ---
+
+    def event(self, event, **fields):
+        entry = {"ts": datetime.now().isoformat(timespec="milliseconds"), "event": event}
+        with self._lock:
+            # Only the thread running the organize pass gets batched under its run ID
+            in_run = self.run_id is not None and self._run_thread == threading.get_ident()
+            if in_run:
+                entry["run_id"] = self.run_id
+            entry.update(fields)
+            if in_run:
+                self._buffer.append(entry)
+            else:
+                self._write([entry]) # Outside a run there is nothing to batch with
+
+    def begin_run(self, **fields):
+        with self._lock:
+            self.run_id = uuid.uuid4().hex[:12]
+            self._run_started = time.monotonic()
+            self._run_thread = threading.get_ident()
+        self.event("run_start", **fields)
+        return self.run_id
+
+    def note_moved(self, header, content, source_file, target_file):
+        if self.history is not None:
+            with self._lock:
+                self._moves.append((datetime.now().isoformat(timespec="milliseconds"), header, content,
+                                    source_file, target_file))
+        self.event("note_moved",
+                   header=header,
+                   source=source_file,
+                   target=target_file,
+                   bytes=len(content.encode("utf-8")),
+                   snippet=content.strip()[:SNIPPET_LENGTH])
+
+    def end_run(self, **fields):
+        duration_ms = round((time.monotonic() - self._run_started) * 1000, 3)
+        self.event("run_end", duration_ms=duration_ms, **fields)
+        with self._lock:
+            moves, self._moves = self._moves, []
+            if moves:
+                try:
+                    self.history.record_moves(self.run_id, moves)
+                except Exception as e:
+                    print(f"History Error: Failed to record moves in {self.history.path}: {e}", file=sys.stderr)
+            self.run_id = None
+            self._run_started = None
+            self._run_thread = None
+            self.flush()
+        return duration_ms
+
+    def run_undone(self, undone_run_id, **fields):
+        self.event("run_undone", undone_run_id=undone_run_id, **fields)
+        if self.history is not None:
+            try:
+                self.history.mark_undone(undone_run_id)
+            except Exception as e:
+                print(f"History Error: Failed to update {self.history.path}: {e}", file=sys.stderr)
+
+    # --- Writing ---
+
+    def flush(self):
+        with self._lock:
+            entries, self._buffer = self._buffer, []
+            self._write(entries)
+
+    def _write(self, entries):
+        if not entries:
+            return
+        lines = "".join(json.dumps(entry, ensure_ascii=False) + "\n" for entry in entries)
+        with self._lock:
+            try:
+                handle = self._open()
+                handle.write(lines)
+                handle.flush()
+                if self._should_rotate(handle):
+                    self.rotate()
+            except Exception as e:
+                print(f"Logging Error: Failed to write to log file {self.path}: {e}", file=sys.stderr)
+
+    def close(self):
+        with self._lock:
+            self.flush()
+            if self._handle is not None:
+                self._handle.close()
+                self._handle = None
+
+    def _open(self):
+        if self._handle is None:
+            self._segment_started = self._read_segment_start()
+            if self._segment_started is None and os.path.exists(self.path) and os.path.getsize(self.path) > 0:
+                # Pre-JSON log from older versions: archive it rather than mixing formats
+                self.rotate()
+            self._handle = open(self.path, "a", encoding="utf-8")
+            if self._segment_started is None:
+                self._segment_started = time.time()
+        return self._handle
+
+    def _read_segment_start(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                first = json.loads(f.readline())
+            return datetime.fromisoformat(first["ts"]).timestamp()
+        except Exception:
+            return None
+
+    def _should_rotate(self, handle):
+        if self.max_bytes and handle.tell() >= self.max_bytes:
+            return True
+        if self.max_age_seconds and time.time() - self._segment_started >= self.max_age_seconds:
+            return True
+        return False
+
+    def rotate(self):
+        if self._handle is not None:
+            self._handle.close()
+            self._handle = None
+        if not os.path.exists(self.path):
+            return
+        archived = f"{self.path}.{datetime.now().strftime('%Y%m%d-%H%M%S-%f')}"
+        os.rename(self.path, archived)
+        if self.compress:
+            with open(archived, "rb") as src, gzip.open(archived + ".gz", "wb") as dst:
+                shutil.copyfileobj(src, dst)
+            os.remove(archived)
+        self._segment_started = None
+        self._prune()
+
+    def archived_segments(self):
+        # Timestamped names sort oldest first
+        return sorted(glob.glob(glob.escape(self.path) + ".*"))
+
+    def _prune(self):
+        if not self.backup_count:
+            return
+        for old_segment in self.archived_segments()[:-self.backup_count]:
+            try:
+                os.remove(old_segment)
+            except OSError:
+                pass
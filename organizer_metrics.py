@@ -0,0 +1,113 @@
+"""Per-phase timing of organize runs, and export to Prometheus' node_exporter textfile collector.
+
+Phases of a run (milliseconds, calls, bytes, notes):
+
+    plan            wall time of planning: scans (in parallel when there are several files), dedup and render
+    scan            reading, segmenting and header-matching the main notes files, one
+                    streaming pass per file (summed over files scanned in parallel)
+    dedup           checking routed notes against the dedup index, and adding the written ones
+    render          formatting the notes into each target's block
+    rewrite_main    freshness check plus copying the kept bytes of each main file to a temp file
+    rollover        moving old notes out of targets that outgrew their rollover policy
+    stage_targets   staging every target file (wall time; targets are written concurrently)
+    write_target    staging one target file (summed over targets; calls is the target count)
+    journal         recording the run in the undo journal
+    commit_targets  swapping staged target files in
+    merge_appended  copying text appended to a main file during the run onto its rewritten file
+                    (notes: notes found in that text, left for the next pass)
+    replace_main    replacing the main notes files
+    log             per-note log and history entries
+    log_flush       writing the buffered log and history at the end of the run
+"""
+import collections
+import contextlib
+import os
+import time
+
+import organizer_io
+
+METRIC_PREFIX = "organizer_last_run"
+
+
+class PhaseTimer:
+    def __init__(self):
+        self.phases = collections.OrderedDict()
+
+    def add(self, name, ms, bytes=0, notes=0, calls=1):
+        phase = self.phases.setdefault(name, {"ms": 0.0, "calls": 0, "bytes": 0, "notes": 0})
+        phase["ms"] += ms
+        phase["calls"] += calls
+        phase["bytes"] += bytes
+        phase["notes"] += notes
+        return phase
+
+    @contextlib.contextmanager
+    def phase(self, name, bytes=0, notes=0):
+        """Time the with-block as one call of name; the yielded dict takes bytes/notes found out inside it."""
+        counts = {"bytes": bytes, "notes": notes}
+        started = time.perf_counter()
+        try:
+            yield counts
+        finally:
+            self.add(name, (time.perf_counter() - started) * 1000, counts["bytes"], counts["notes"])
+
+    def update(self, other):
+        for name, phase in other.phases.items():
+            self.add(name, phase["ms"], phase["bytes"], phase["notes"], phase["calls"])
+
+    def to_dict(self):
+        return {name: dict(phase, ms=round(phase["ms"], 3)) for name, phase in self.phases.items()}
+
+
+def _label(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def format_textfile(result, timestamp=None):
+    """Render an OrganizeResult in the Prometheus text exposition format."""
+    timestamp = time.time() if timestamp is None else timestamp
+    lines = []
+
+    def metric(name, help_text, samples):
+        lines.append(f"# HELP {METRIC_PREFIX}_{name} {help_text}")
+        lines.append(f"# TYPE {METRIC_PREFIX}_{name} gauge")
+        for labels, value in samples:
+            label_text = "{" + ",".join(f'{k}="{_label(v)}"' for k, v in labels) + "}" if labels else ""
+            lines.append(f"{METRIC_PREFIX}_{name}{label_text} {value}")
+
+    phases = result.phases.phases
+    metric("timestamp_seconds", "Unix time the last organize run ended.", [((), round(timestamp, 3))])
+    metric("success", "1 if the last organize run succeeded or had nothing to do, else 0.",
+           [((("status", result.status),), 0 if result.status in ("error", "cancelled") else 1)])
+    metric("duration_seconds", "Wall time of the last organize run.", [((), (result.duration_ms or 0) / 1000)])
+    metric("notes_moved", "Notes the last organize run moved.", [((), result.notes_moved)])
+    metric("notes_skipped", "Notes the last organize run took out of the main file without writing, "
+           "their target already holding them.", [((), result.notes_skipped)])
+    metric("bytes_read", "Bytes of main notes files the last organize run scanned.", [((), result.bytes_read)])
+    metric("bytes_written", "Bytes the last organize run wrote.", [((), result.bytes_written)])
+    metric("phase_seconds", "Time spent in each phase of the last organize run.",
+           [((("phase", name),), round(phase["ms"] / 1000, 6)) for name, phase in phases.items()])
+    metric("phase_calls", "Times each phase ran in the last organize run.",
+           [((("phase", name),), phase["calls"]) for name, phase in phases.items()])
+    metric("phase_bytes", "Bytes each phase of the last organize run read or wrote.",
+           [((("phase", name),), phase["bytes"]) for name, phase in phases.items()])
+    metric("phase_notes", "Notes each phase of the last organize run handled.",
+           [((("phase", name),), phase["notes"]) for name, phase in phases.items()])
+    if result.target_ms:
+        slowest = max(result.target_ms, key=result.target_ms.get)
+        metric("slowest_target_seconds", "Time spent writing the slowest target file of the last organize run.",
+               [((("target", slowest),), round(result.target_ms[slowest] / 1000, 6))])
+    return "\n".join(lines) + "\n"
+
+
+def write_textfile(path, result):
+    """Atomically replace path with result's metrics, as the textfile collector requires."""
+    out, tmp_path = organizer_io.open_temp_sibling(path)
+    try:
+        with out:
+            out.write(format_textfile(result))
+        os.chmod(tmp_path, 0o644) # mkstemp makes it 0600; node_exporter usually runs as another user
+        os.replace(tmp_path, path)
+    except BaseException:
+        organizer_io.remove_quietly(tmp_path)
+        raise
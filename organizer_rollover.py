@@ -0,0 +1,209 @@
+"""Rollover of target files into dated archive shards, so the active target stays small.
+
+A mapping may carry a policy:
+
+    "rollover": {"max_bytes": 262144, "max_notes": 500, "period": "quarter"}
+
+When a pass writes to a target that has grown past max_bytes or max_notes, its
+oldest notes are moved out until it is back to half of each limit. With period
+("month", "quarter" or "year"), notes from before the current period are moved
+out too. Moved notes go to one shard per period next to the target (notes/Apps.md
+-> notes/Apps/2025-Q2.md; quarterly when no period is set), in the order the
+target had them, and notes/Apps/shards.json records which shard holds which
+date range.
+"""
+import collections
+import json
+import os
+import re
+import shutil
+from datetime import datetime
+
+import organizer_io
+
+MANIFEST_FILE = "shards.json"
+PERIODS = ("month", "quarter", "year")
+DEFAULT_PERIOD = "quarter"
+_STAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+# The "YYYY-MM-DD HH:MM:SS (auto)" line that starts every note a pass writes (organizer_engine.format_note)
+NOTE_START = re.compile(rb"^(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}) \(auto\)\r?$", re.MULTILINE)
+
+RolloverPolicy = collections.namedtuple("RolloverPolicy", ["max_bytes", "max_notes", "period", "by_period"])
+
+# One note in a target file: data[start:end], its text starting at body_start
+StampedNote = collections.namedtuple("StampedNote", ["start", "body_start", "end", "stamp"])
+
+
+class RolloverError(Exception):
+    pass
+
+
+def iter_stamped_notes(data):
+    """The notes a pass wrote into data, a target file's bytes; text before the first one is not included."""
+    matches = list(NOTE_START.finditer(data))
+    for match, following in zip(matches, matches[1:] + [None]):
+        yield StampedNote(match.start(), match.end(), following.start() if following else len(data),
+                          match.group(1).decode("ascii"))
+
+
+def _policy(mapping):
+    options = mapping.get("rollover")
+    if options is None:
+        return None
+    where = f"Rollover policy of the mapping for '{mapping.get('header', '')}'"
+    if not isinstance(options, dict):
+        raise RolloverError(f"{where} must be an object.")
+    limits = {}
+    for key in ("max_bytes", "max_notes"):
+        value = options.get(key)
+        if value is not None and (isinstance(value, bool) or not isinstance(value, int) or value < 1):
+            raise RolloverError(f"{where}: {key} must be a positive whole number.")
+        limits[key] = value
+    period = options.get("period")
+    if period is not None and period not in PERIODS:
+        raise RolloverError(f"{where}: period must be one of {', '.join(PERIODS)}.")
+    if period is None and limits["max_bytes"] is None and limits["max_notes"] is None:
+        raise RolloverError(f"{where} needs max_bytes, max_notes or period.")
+    return RolloverPolicy(limits["max_bytes"], limits["max_notes"], period or DEFAULT_PERIOD, period is not None)
+
+
+def rollover_policies(mappings):
+    """Target file -> RolloverPolicy; the first mapping with a policy wins. Raises RolloverError if one is invalid."""
+    policies = {}
+    for mapping in mappings:
+        policy = _policy(mapping)
+        if policy is not None:
+            policies.setdefault(mapping["target_file"], policy)
+    return policies
+
+
+def shard_label(stamp, period):
+    # Labels of one period sort the way their periods do: "2025-06", "2025-Q2", "2025"
+    if period == "month":
+        return stamp[:7]
+    if period == "year":
+        return stamp[:4]
+    return f"{stamp[:4]}-Q{(int(stamp[5:7]) - 1) // 3 + 1}"
+
+
+def shard_dir(target_file):
+    return os.path.splitext(target_file)[0]
+
+
+def shard_files(target_file):
+    """Paths of the shards the manifest of target_file lists; empty when there is none or it can't be read."""
+    directory = shard_dir(target_file)
+    try:
+        with open(os.path.join(directory, MANIFEST_FILE), "r", encoding="utf-8") as f:
+            return [os.path.join(directory, shard["file"]) for shard in json.load(f).get("shards", [])]
+    except (OSError, ValueError, AttributeError, KeyError, TypeError):
+        return []
+
+
+def _archived(notes, preamble_len, policy, now):
+    """Indexes into notes of the ones to move out."""
+    archived = set()
+    if policy.by_period:
+        current = shard_label(now.strftime(_STAMP_FORMAT), policy.period)
+        archived = {i for i, note in enumerate(notes) if shard_label(note.stamp, policy.period) < current}
+    kept = sorted((i for i in range(len(notes)) if i not in archived), key=lambda i: (notes[i].stamp, i))
+    size = preamble_len + sum(notes[i].end - notes[i].start for i in kept)
+    if (policy.max_bytes and size > policy.max_bytes) or (policy.max_notes and len(kept) > policy.max_notes):
+        # Down to half of each limit, so a target just over it doesn't roll over on every pass
+        oldest = 0
+        while oldest < len(kept) and ((policy.max_bytes and size > policy.max_bytes // 2)
+                                      or (policy.max_notes and len(kept) - oldest > policy.max_notes // 2)):
+            note = notes[kept[oldest]]
+            archived.add(kept[oldest])
+            size -= note.end - note.start
+            oldest += 1
+    return archived
+
+
+def _update_manifest(target_file, added):
+    path = os.path.join(shard_dir(target_file), MANIFEST_FILE)
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            shards = {shard["file"]: shard for shard in json.load(f).get("shards", [])}
+    except FileNotFoundError:
+        shards = {}
+    except (ValueError, AttributeError, KeyError, TypeError) as e:
+        raise RolloverError(f"{path} is not a valid shard manifest: {e}")
+    for file_name, (first, last, count) in added.items():
+        shard = shards.setdefault(file_name, {"file": file_name, "first": first, "last": last, "notes": 0})
+        shard["first"] = min(shard["first"], first)
+        shard["last"] = max(shard["last"], last)
+        shard["notes"] += count
+    out, tmp_path = organizer_io.open_temp_sibling(path)
+    try:
+        with out:
+            json.dump({"target": os.path.basename(target_file),
+                       "shards": [shards[name] for name in sorted(shards)]}, out, indent=2)
+            out.write("\n")
+            out.flush()
+            os.fsync(out.fileno())
+        organizer_io.commit_staged(tmp_path, path)
+    except BaseException:
+        organizer_io.remove_quietly(tmp_path)
+        raise
+
+
+def roll_over(target_file, policy, position="top", now=None):
+    """Move notes out of target_file into its shards as policy asks; returns {shard path: notes moved}.
+
+    Shards and the manifest are synced before the target is rewritten, so a crash
+    can leave a note in both a shard and the target but never in neither. Raises
+    RolloverError, after writing the shards, if the target changed meanwhile.
+    """
+    try:
+        st = os.stat(target_file)
+    except FileNotFoundError:
+        return {}
+    if not policy.by_period and policy.max_notes is None and st.st_size <= policy.max_bytes:
+        return {} # Only a size limit, and still under it: no need to read the file
+    with open(target_file, "rb") as f:
+        st = os.fstat(f.fileno())
+        data = f.read()
+    notes = list(iter_stamped_notes(data))
+    preamble_len = notes[0].start if notes else len(data)
+    archived = _archived(notes, preamble_len, policy, now or datetime.now())
+    if not archived:
+        return {}
+
+    blocks_by_shard = collections.OrderedDict() # shard path -> [note text], in the target's order
+    added = {} # shard file name -> (first stamp, last stamp, notes)
+    for i in sorted(archived):
+        note = notes[i]
+        label = shard_label(note.stamp, policy.period)
+        shard_path = os.path.join(shard_dir(target_file), label + ".md")
+        blocks_by_shard.setdefault(shard_path, []).append(data[note.start:note.end].decode("utf-8").strip())
+        first, last, count = added.get(label + ".md", (note.stamp, note.stamp, 0))
+        added[label + ".md"] = (min(first, note.stamp), max(last, note.stamp), count + 1)
+    os.makedirs(shard_dir(target_file), exist_ok=True)
+    for shard_path, blocks in blocks_by_shard.items():
+        block = (os.linesep + os.linesep).join(blocks)
+        if position == "bottom":
+            organizer_io.append_block(shard_path, block)
+        else:
+            organizer_io.prepend_block(shard_path, block)
+    _update_manifest(target_file, added)
+
+    kept = data[:preamble_len] + b"".join(data[note.start:note.end] for i, note in enumerate(notes) if i not in archived)
+    kept = kept.strip()
+    out, tmp_path = organizer_io.open_temp_sibling(target_file, "wb")
+    try:
+        with out:
+            out.write(kept + os.linesep.encode("ascii") if kept else b"")
+            out.flush()
+            os.fsync(out.fileno())
+        shutil.copymode(target_file, tmp_path)
+        now_st = os.stat(target_file)
+        if (now_st.st_ino, now_st.st_size, now_st.st_mtime_ns) != (st.st_ino, st.st_size, st.st_mtime_ns):
+            raise RolloverError(f"{target_file} changed while it was rolled over; the notes moved to "
+                                f"{', '.join(blocks_by_shard)} are still in it as well.")
+        organizer_io.commit_staged(tmp_path, target_file)
+    except BaseException:
+        organizer_io.remove_quietly(tmp_path)
+        raise
+    return {shard_path: len(blocks) for shard_path, blocks in blocks_by_shard.items()}
@@ -0,0 +1,52 @@
+"""Decide cheaply whether a changed main notes file needs an organize pass.
+
+The tray app watches the main notes file and calls needs_organize() once a burst of
+saves has settled. Captured notes are nearly always appended, so when the file only
+grew and the tail it had after the last pass is still in place, only the appended
+bytes (plus that old tail) are scanned for header lines, and for the tokens of
+any body rules. Any other kind of change is treated as needing a pass.
+"""
+import organizer_io
+from organizer_engine import DATE_PATTERN
+
+
+def _has_candidate_note(text, skip_first_line, header_matcher, body_matcher=None):
+    lines = text.splitlines()
+    if skip_first_line:
+        lines = lines[1:] # Probably cut mid-line by the tail window
+    if body_matcher and body_matcher.match("\n".join(lines)) is not None:
+        return True # A header may still claim the block, but then a pass is needed anyway
+    for i, line in enumerate(lines):
+        stripped = line.strip()
+        if stripped.lower() in header_matcher:
+            return True
+        if DATE_PATTERN.match(stripped) and i + 1 < len(lines) and lines[i + 1].strip().lower() in header_matcher:
+            return True
+    return False
+
+
+def needs_organize(path, previous, header_matcher, body_matcher=None):
+    """Return (needed, fingerprint) for path, given the fingerprint recorded after the last pass.
+
+    previous is None when nothing is known about the file (first check, or the
+    mappings changed), in which case a pass is always needed. body_matcher is the
+    mappings' body_matcher.BodyMatcher, if they have body rules.
+    """
+    current = organizer_io.file_fingerprint(path)
+    if previous is None:
+        return True, current
+    if current == previous:
+        return False, current
+    if current.size < previous.size:
+        return True, current
+
+    with open(path, "rb") as f:
+        window_start = max(0, previous.size - organizer_io.FINGERPRINT_TAIL_BYTES)
+        f.seek(window_start)
+        old_tail = f.read(previous.size - window_start)
+        if organizer_io.tail_hash(old_tail) != previous.tail_hash:
+            return True, current
+        appended = f.read(current.size - previous.size)
+
+    text = (old_tail + appended).decode("utf-8", errors="replace")
+    return _has_candidate_note(text, window_start > 0, header_matcher, body_matcher), current
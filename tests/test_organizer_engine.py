@@ -0,0 +1,134 @@
+import threading
+import time
+
+import organizer_engine
+import organizer_io
+from organizer_dedup import DedupIndex
+from organizer_journal import UndoJournal
+from organizer_log import RunLogger
+
+MAPPINGS = [{"header": "Apps", "target_file": "Apps.md"}]
+
+
+def _organize(dedup, journal):
+    return organizer_engine.organize_notes(["Inbox.md"], MAPPINGS, RunLogger("organizer.log"), journal=journal,
+                                           dedup=dedup)
+
+
+def _read(path):
+    with open(path, encoding="utf-8") as f:
+        return f.read()
+
+
+def _write(path, text):
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(text)
+
+
+def test_commit_writes_back_skipped_note_its_target_lost(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    dedup, journal = DedupIndex("dedup.sqlite3"), UndoJournal("journal.jsonl")
+    _write("Inbox.md", "Apps\nidea one\n")
+    _organize(dedup, journal)
+    _write("Inbox.md", "Apps\nidea one\n")
+    plan = organizer_engine.plan_organize(["Inbox.md"], MAPPINGS, dedup=dedup)
+    assert plan.notes_skipped == 1 and plan.notes_moved == 0
+    _write("Apps.md", "") # The note leaves the target between the preview and the commit
+
+    result = organizer_engine.commit_plan(plan, RunLogger("organizer.log"), journal=journal, dedup=dedup)
+
+    assert (result.notes_moved, result.notes_skipped) == (1, 0)
+    assert _read("Inbox.md") == ""
+    assert _read("Apps.md").splitlines()[1:] == ["idea one"]
+    assert dedup.present("Apps.md", [organizer_engine.note_hash("idea one")])
+
+
+def test_commit_still_skips_note_its_target_holds(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    dedup, journal = DedupIndex("dedup.sqlite3"), UndoJournal("journal.jsonl")
+    _write("Inbox.md", "Apps\nidea one\n")
+    _organize(dedup, journal)
+    target = _read("Apps.md")
+    _write("Inbox.md", "Apps\nidea one\n\nApps\nidea two\n")
+    plan = organizer_engine.plan_organize(["Inbox.md"], MAPPINGS, dedup=dedup)
+
+    result = organizer_engine.commit_plan(plan, RunLogger("organizer.log"), journal=journal, dedup=dedup)
+
+    assert (result.notes_moved, result.notes_skipped) == (1, 1)
+    assert _read("Inbox.md") == ""
+    assert _read("Apps.md").count("idea one") == 1
+    assert _read("Apps.md").endswith(target)
+
+
+def test_undo_removes_target_the_run_created(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    journal = UndoJournal("journal.jsonl")
+    mappings = [{"header": "Todo", "target_file": "vault/Todo.md"}]
+    _write("Inbox.md", "Todo\nbuy milk\n")
+    organizer_engine.organize_notes(["Inbox.md"], mappings, RunLogger("organizer.log"), journal=journal)
+    assert "buy milk" in _read("vault/Todo.md")
+
+    organizer_engine.undo_last_run(journal, RunLogger("organizer.log"))
+
+    assert _read("Inbox.md") == "Todo\nbuy milk\n"
+    assert not (tmp_path / "vault" / "Todo.md").exists()
+
+
+def test_rollover_shards_are_not_sources(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    mappings = [{"header": "Apps", "target_file": "vault/Apps.md", "rollover": {"period": "quarter"}}]
+    (tmp_path / "vault" / "Apps").mkdir(parents=True)
+    _write("vault/Inbox.md", "Apps\nnew idea\n")
+    _write("vault/Apps/2024-Q1.md", "2024-01-02 10:00:00 (auto)\nApps\nold idea\n")
+    _write("vault/Apps/shards.json", '{"target": "Apps.md", "shards": [{"file": "2024-Q1.md", "first": '
+                                     '"2024-01-02 10:00:00", "last": "2024-01-02 10:00:00", "notes": 1}]}\n')
+    _write("vault/Notes.md", "Apps\nanother idea\n")
+
+    sources = organizer_engine.resolve_sources("", ["vault/**/*.md"], mappings)
+
+    assert sources == ["vault/Inbox.md", "vault/Notes.md"]
+
+
+def test_undo_waits_for_a_pass_holding_the_lock(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    journal = UndoJournal("journal.jsonl")
+    _write("Inbox.md", "Apps\nidea one\n")
+    _organize(None, journal)
+    undo = threading.Thread(target=organizer_engine.undo_last_run, args=(journal, RunLogger("organizer.log")))
+
+    with organizer_io.locked(organizer_io.lock_path("Inbox.md")):
+        undo.start()
+        time.sleep(0.2)
+        assert undo.is_alive()
+        assert _read("Inbox.md") == ""
+    undo.join(5)
+
+    assert _read("Inbox.md") == "Apps\nidea one\n"
+
+
+def test_failed_main_file_replace_leaves_earlier_runs_undoable(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    journal = UndoJournal("journal.jsonl")
+    mappings = MAPPINGS + [{"header": "Todo", "target_file": "Todo.md"}]
+    _write("Inbox.md", "Apps\nidea one\n")
+    organizer_engine.organize_notes(["Inbox.md"], mappings, RunLogger("organizer.log"), journal=journal)
+    _write("Inbox.md", "Todo\nbuy milk\n")
+
+    def fail(main_notes_file, new_file_path):
+        organizer_io.remove_quietly(new_file_path)
+        raise OSError("disk full")
+
+    monkeypatch.setattr(organizer_engine, "replace_main_file", fail)
+    try:
+        organizer_engine.organize_notes(["Inbox.md"], mappings, RunLogger("organizer.log"), journal=journal)
+    except organizer_engine.OrganizerError as e:
+        assert "disk full" in e.message
+    else:
+        raise AssertionError("the failed replace was not reported")
+    monkeypatch.undo()
+    monkeypatch.chdir(tmp_path)
+
+    organizer_engine.undo_last_run(journal, RunLogger("organizer.log"))
+
+    assert _read("Inbox.md") == "Apps\nidea one\nTodo\nbuy milk\n"
+    assert not (tmp_path / "Apps.md").exists()
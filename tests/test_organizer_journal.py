@@ -0,0 +1,24 @@
+import glob
+import os
+
+import organizer_engine
+from organizer_journal import UndoJournal
+from organizer_log import RunLogger
+
+MAPPINGS = [{"header": "Apps", "target_file": "Apps.md"}]
+
+
+def test_snapshots_of_runs_beyond_keep_runs_are_deleted(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    journal = UndoJournal("journal.jsonl", keep_runs=2)
+    for i in range(5):
+        with open("Inbox.md", "w", encoding="utf-8") as f:
+            f.write(f"Apps\nidea {i}\n")
+        result = organizer_engine.organize_notes(["Inbox.md"], MAPPINGS, RunLogger("organizer.log"), journal=journal)
+        assert result.snapshot_files # The whole inbox moved, so it was snapshotted
+
+    runs = journal.undoable_runs()
+
+    assert len(runs) == 2
+    assert sorted(glob.glob(".Inbox.md.*.snapshot")) == sorted(os.path.basename(run["sources"][0]["snapshot"])
+                                                               for run in runs)
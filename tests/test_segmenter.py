@@ -0,0 +1,149 @@
+"""Differential test of the chunked boundary scanner against a plain per-line segmenter.
+
+The reference decodes every line and looks each one up by trying the mappings
+one by one, with no boundary regex, no chunking and no combined alternation.
+"""
+import fnmatch
+import hashlib
+import random
+import re
+
+import pytest
+
+import organizer_engine
+from body_matcher import compile_rules
+
+HEADERS = [
+    {"header": "Todo", "target_file": "todo.md"},
+    {"header": "Ap", "match": "prefix", "target_file": "apps.md"},
+    {"header": "Idea", "target_file": "ideas.md", "body": {"tags": ["x"], "words": ["beta"]}},
+    {"header": "İstanbul", "target_file": "travel.md"}, # Lowercases to one more character
+    {"header": "Straße", "match": "prefix", "aliases": ["Rue ΣΊΣΥΦΟΣ"], "target_file": "streets.md"},
+    # Kelvin sign and long s lines only match these through case folding
+    {"header": "Kelvin*", "match": "glob", "target_file": "units.md"},
+    {"header": "Sp?ce", "match": "glob", "target_file": "space.md"},
+]
+REGEX_HEADERS = HEADERS + [{"header": r"log \d+", "match": "regex", "target_file": "log.md"}]
+GROUP_HEADERS = HEADERS + [{"header": r"(ab)+c", "match": "regex", "target_file": "abc.md"},
+                           {"header": r"(?P<w>\w)x(?P=w)", "match": "regex", "target_file": "xx.md"},
+                           {"header": r"(\w)-\1", "match": "regex", "target_file": "pairs.md"}]
+
+LINES = ["Todo", "todo  ", "TODO", "Apps", "Apple pie", "apricot", "Idea", "plain words", "#x here", "beta",
+         "alpha gamma", "2025-01-02 03:04:05", "٢٠٢٥-٠١-٠٢ ٠٣:٠٤:٠٥", " 2025-01-02 03:04:05", "", "  ", " ",
+         "été café", "line\r", "Todo\r", "x" * 50, "i̇stanbul", "İSTANBUL", "Istanbul", "straße", "STRASSE",
+         "Straßenbahn", "rue σίσυφος", "RUE ΣΊΣΥΦΟΣ", "ΣΊΣΥΦΟΣ", "Kelvin scale", "kelvin", "\u212aelvin", "space",
+         "ſpace", "SPACE", "log 12", "LOG 7", "abababc", "axa", "bxa", "a-a", "a-b", "　Todo　"]
+
+
+def _reference_target(mappings, key):
+    exact = prefix = pattern = None
+    prefix_len = -1
+    for m in mappings:
+        kind = m.get("match", "exact")
+        for header in [m["header"]] + list(m.get("aliases", [])):
+            lowered = header.lower()
+            if kind == "exact" and key == lowered:
+                exact = m["target_file"] # Later mappings win
+            elif kind == "prefix" and key.startswith(lowered) and len(lowered) >= prefix_len:
+                prefix, prefix_len = m["target_file"], len(lowered)
+            elif kind in ("glob", "regex") and pattern is None:
+                regex = fnmatch.translate(lowered) if kind == "glob" else header
+                if re.fullmatch(regex, key, re.IGNORECASE):
+                    pattern = m["target_file"]
+    return exact or prefix or pattern
+
+
+def _reference_body_note(data, start, end, separator_end, body_matcher):
+    block = data[start:end]
+    target_file = body_matcher.match(block.decode("utf-8", errors="replace"))
+    if target_file is None:
+        return None
+    text = block.decode("utf-8").replace("\r\n", "\n").strip("\n")
+    first, _, rest = text.partition("\n")
+    date_line = None
+    if organizer_engine.DATE_PATTERN.match(first) and rest.strip():
+        date_line, text = first + "\n", rest
+    return organizer_engine.NoteSegment(date_line, "", target_file, text, start, separator_end)
+
+
+def reference_segments(data, mappings):
+    lines = []
+    position = 0
+    for raw_bytes in re.findall(rb"[^\n]*\n|[^\n]+$", data): # Only "\n" ends a line, as in the scanner
+        raw = raw_bytes.decode("utf-8")
+        if raw.endswith("\r\n"):
+            raw = raw[:-2] + "\n"
+        text = raw.rstrip("\r\n")
+        stripped = text.strip()
+        lines.append((raw, text, stripped, organizer_engine.DATE_PATTERN.match(stripped) is not None,
+                      position, position + len(raw_bytes)))
+        position += len(raw_bytes)
+    body_matcher = compile_rules(mappings) or None
+    notes = []
+    block_start, block_routed = 0, False
+    i = 0
+    while i < len(lines):
+        raw, text, stripped, is_date, line_start, line_end = lines[i]
+        if body_matcher is not None and not stripped:
+            if not block_routed and line_start > block_start:
+                note = _reference_body_note(data, block_start, line_start, line_end, body_matcher)
+                if note is not None:
+                    notes.append(note)
+            block_start, block_routed = line_end, False
+        if is_date and text == stripped:
+            if i + 1 == len(lines):
+                break
+            date_line, header, key, end = raw, lines[i + 1][2], lines[i + 1][2].lower(), lines[i + 1][5]
+            j = i + 2
+        else:
+            date_line, header, key, end = None, text, text.lower(), line_end
+            j = i + 1
+        target_file = _reference_target(mappings, key)
+        if target_file is None:
+            i += 1
+            continue
+        start = line_start
+        content_start = content_end = end
+        block_routed = True
+        i = len(lines)
+        while j < len(lines):
+            _, _, line_stripped, line_is_date, _, next_end = lines[j]
+            if not line_stripped:
+                end = next_end
+                block_start, block_routed = end, False
+                i = j + 1
+                break
+            if line_is_date:
+                scan_key = lines[j + 1][2].lower() if j + 1 < len(lines) else ""
+            else:
+                scan_key = line_stripped.lower()
+            if _reference_target(mappings, scan_key) is not None:
+                i = j
+                break
+            content_end = end = next_end
+            j += 1
+        content = data[content_start:content_end].decode("utf-8").replace("\r\n", "\n")
+        notes.append(organizer_engine.NoteSegment(date_line, header, target_file, content, start, end))
+    if body_matcher is not None and not block_routed and data[block_start:].strip():
+        note = _reference_body_note(data, block_start, len(data), len(data), body_matcher)
+        if note is not None:
+            notes.append(note)
+    return notes
+
+
+@pytest.mark.parametrize("mappings", [HEADERS, REGEX_HEADERS, GROUP_HEADERS], ids=["bounded", "regex", "groups"])
+@pytest.mark.parametrize("chunk_bytes", [1, 3, 7, 64, 4096, organizer_engine.SCAN_CHUNK_BYTES])
+def test_scan_source_matches_per_line_reference(mappings, chunk_bytes, tmp_path, monkeypatch):
+    monkeypatch.setattr(organizer_engine, "SCAN_CHUNK_BYTES", chunk_bytes)
+    rng = random.Random(chunk_bytes)
+    path = str(tmp_path / "Inbox.md")
+    for _ in range(150):
+        lines = [rng.choice(LINES) for _ in range(rng.randint(0, 60))]
+        data = ("\n".join(lines) + rng.choice(["", "\n", "\n\n"])).encode("utf-8")
+        with open(path, "wb") as f:
+            f.write(data)
+
+        source = organizer_engine.scan_source(path, mappings)
+
+        assert list(source.notes) == reference_segments(data, mappings), data
+        assert (source.size, source.content_hash) == (len(data), hashlib.blake2b(data, digest_size=16).hexdigest())